@@ -1,19 +1,13 @@
-from django.contrib.auth.models import User
-from django.core.cache import cache
-from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
 
+from apps.services.presence import presence
+
 
 class ActiveUserMiddleware(MiddlewareMixin):
     def process_request(self, request):
         if request.user.is_authenticated and request.session.session_key:
-            cache_key = f'last-seen-{request.user.id}'
-            last_login = cache.get(cache_key)
-
-            if not last_login:
-                User.objects.filter(id=request.user.id).update(last_login=timezone.now())
-                # Устанавливаем кэширование на 300 секунд с текущей датой по ключу last-seen-id-пользователя
-                cache.set(cache_key, timezone.now(), 300)
+            # Отметка копится в памяти процесса, в кэш и last_login она попадет пачкой при сбросе
+            presence.heartbeat(request.user.id)
 
 
 """
@@ -26,10 +20,10 @@ Middlewareкласс ActiveUserMiddleware определяет метод proces
 В этом методе проверяется, авторизован ли пользователь, и имеет ли его сессия уникальный идентификатор session_key.
 
 Если пользователь авторизован и имеет уникальный session_key, 
-то обновляется его статус "последний раз в сети" с помощью метода cache.set() 
-и сохраняется в кэше на время 300 секунд (можем установить любое значение).
+то его активность отмечается в PresenceTracker (apps/services/presence.py): не чаще раза в минуту на пользователя
+и только в памяти процесса, без обращения к кэшу и БД.
 
-Если в кэше нет записи для пользователя, 
-то его последнее время входа в систему обновляется на текущее время 
-с помощью метода User.objects.filter().update(), и время записывается в кэш.
+Раз в PRESENCE_FLUSH_INTERVAL секунд фоновый поток записывает накопленные отметки пачкой: 
+статус "последний раз в сети" - в кэш одним set_many() на время PRESENCE_TIMEOUT секунд, 
+а время последнего входа - одним запросом User.objects.filter(pk__in=...).update().
 """
@@ -1,10 +1,10 @@
-from django.core.cache import cache
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
 from django.urls import reverse
-from django.utils import timezone
 
+from apps.services.object_cache import CachedManager
+from apps.services.presence import online_status
 from apps.services.utils import unique_slugify
 
 
@@ -20,6 +20,9 @@ class Profile(models.Model):
     bio = models.TextField(max_length=500, blank=True, verbose_name='Информация о себе')
     birth_date = models.DateField(null=True, blank=True, verbose_name='Дата рождения')
 
+    objects = models.Manager()
+    cached = CachedManager(related=('user',))  # кэш профиля по slug/pk (вместе с пользователем) для страницы профиля
+
     class Meta:
         """
         Сортировка, название таблицы в базе данных
@@ -28,6 +31,15 @@ class Profile(models.Model):
         verbose_name = 'Профиль'
         verbose_name_plural = 'Профили'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Запоминаем загруженный аватар, чтобы при сохранении не обрабатывать неизмененное изображение
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_avatar = instance.__dict__['avatar'] if 'avatar' in field_names else None
+        return instance
+
     def save(self, *args, **kwargs):
         """
         Сохранение полей модели при их отсутствии заполнения
@@ -35,6 +47,8 @@ class Profile(models.Model):
         if not self.slug:
             self.slug = unique_slugify(self, self.user.username)
         super().save(*args, **kwargs)
+        if 'avatar' not in self.get_deferred_fields():
+            self._loaded_avatar = self.avatar.name
 
     def __str__(self):
         """
@@ -50,10 +64,7 @@ class Profile(models.Model):
 
     def is_online(self):
         """
-        Проверка: был ли пользователь онлайн в течение последних 5 минут
+        Проверка: был ли пользователь онлайн в течение последних PRESENCE_TIMEOUT секунд
         """
-        last_seen = cache.get(f'last-seen-{self.user.id}')
-        if last_seen is not None and timezone.now() < last_seen + timezone.timedelta(seconds=300):
-            return True
-        return False
+        return online_status([self.user_id])[self.user_id]
 
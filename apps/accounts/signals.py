@@ -1,6 +1,7 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from apps.services.thumbnails import get_derivatives, schedule_derivatives
 from .models import Profile
 
 
@@ -10,6 +11,39 @@ def create_user_profile(sender, instance, created, **kwargs):
         Profile.objects.create(user=instance)
 
 
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    """
+    Сброс профиля в кэше объектов по slug/pk
+    """
+    Profile.cached.invalidate(instance)
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_profile_on_user_change(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Профиль в кэше хранит пользователя; обновление last_login при входе на него не влияет
+    """
+    if not created and (update_fields is None or set(update_fields) != {'last_login'}):
+        Profile.cached.invalidate_pks(Profile.objects.filter(user_id=instance.pk).values('pk'))
+
+
+@receiver(post_save, sender=Profile)
+def generate_avatar_thumbnails(sender, instance, **kwargs):
+    """
+    Уменьшенные копии аватара в фоне. Сохранение без смены аватара (в т.ч. общего default.png у нового профиля,
+    у которого копии уже есть) файлы не читает
+    """
+    if 'avatar' in instance.get_deferred_fields():
+        return
+    name = instance.avatar.name
+    if name == getattr(instance, '_loaded_avatar', None) \
+            or (name == Profile._meta.get_field('avatar').default and get_derivatives(name)):
+        return
+    schedule_derivatives(instance.avatar, 'avatar')
+
+
 """
 create_user_profile это функция приемника, 
 которая запускается каждый раз при создании пользователя. 
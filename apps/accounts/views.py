@@ -2,11 +2,14 @@
 from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.views import View
 from django.views.generic import DetailView, UpdateView, CreateView
 from django.urls import reverse_lazy
 
 from .models import Profile
 from .forms import UserUpdateForm, ProfileUpdateForm, UserRegisterForm, UserLoginForm
+from ..services.presence import online_status, online_count
 
 
 class UserLoginView(SuccessMessageMixin, LoginView):
@@ -53,6 +56,15 @@ class ProfileDetailView(DetailView):
     context_object_name = 'profile'  # использования переменных в шаблоне
     template_name = 'accounts/profile_detail.html'
 
+    def get_object(self, queryset=None):
+        """
+        Профиль из кэша объектов по slug
+        """
+        try:
+            return Profile.cached.get_cached(slug=self.kwargs['slug'])
+        except Profile.DoesNotExist:
+            raise Http404('Профиль не найден')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = f'Страница пользователя: {self.object.user.username}'
@@ -96,3 +108,22 @@ class ProfileUpdateView(UpdateView):
 
     def get_success_url(self):
         return reverse_lazy('profile_detail', kwargs={'slug': self.object.slug})
+
+
+class OnlineStatusView(View):
+    """
+    Представление: статусы "онлайн" для списка пользователей (?ids=1,2,3) одним запросом
+    и общее количество пользователей онлайн
+    """
+    max_ids = 200
+
+    def get(self, request, *args, **kwargs):
+        try:
+            user_ids = {int(user_id) for user_id in request.GET.get('ids', '').split(',') if user_id}
+        except ValueError:
+            return JsonResponse({'error': 'Некорректный список пользователей'}, status=400)
+        statuses = online_status(list(user_ids)[:self.max_ids])
+        return JsonResponse({
+            'online': [user_id for user_id, online in statuses.items() if online],
+            'count': online_count(),
+        })
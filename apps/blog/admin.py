@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django_mptt_admin.admin import DjangoMpttAdmin  # улучшить визуальный вид раздела категорий в админ панели
 # from mptt.admin import DraggableMPTTAdmin
-from .models import Post, Category, Comment, Rating
+from .models import Post, Category, Comment, Rating, RatingRollup, SlugHistory
 
 # admin.site.register(Post)
 """
@@ -11,13 +11,27 @@ from .models import Post, Category, Comment, Rating
 """
 
 
+class SlugHistoryInline(admin.TabularInline):
+    """
+    Прежние адреса записи (только просмотр и удаление)
+    """
+    model = SlugHistory
+    fields = ('slug', 'time_create')
+    readonly_fields = ('slug', 'time_create')
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     """
     Админ-панель модели записей
     """
     prepopulated_fields = {'slug': ('title',)}
-    list_display = ['title', 'status']
+    list_display = ['title', 'status', 'rating_sum']
+    inlines = [SlugHistoryInline]
 
 @admin.register(Category)
 class CategoryAdmin(DjangoMpttAdmin):
@@ -39,4 +53,24 @@ class RatingAdmin(admin.ModelAdmin):
     """
     Админ-панель модели рейтинга
     """
-    pass
\ No newline at end of file
+
+    def delete_queryset(self, request, queryset):
+        """
+        Массовое удаление через delete() каждого голоса, чтобы обновлялись счетчики рейтинга записей
+        """
+        for rating in queryset:
+            rating.delete()
+
+
+@admin.register(RatingRollup)
+class RatingRollupAdmin(admin.ModelAdmin):
+    """
+    Админ-панель свернутых голосов (только просмотр, данные ведет compact_ratings)
+    """
+    list_display = ['post', 'day', 'likes', 'dislikes']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
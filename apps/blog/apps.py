@@ -5,3 +5,9 @@ class BlogConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "apps.blog"
     verbose_name = 'Блог'
+
+    def ready(self):
+        """
+        Подключение модуля signals
+        """
+        import apps.blog.signals
@@ -12,13 +12,13 @@ class LatestPostFeed(Feed):
     description = "Новые записи на моем сайте."
 
     def items(self):
-        return Post.objects.order_by('-update')[:5]
+        return Post.custom.select_related(None).only('title', 'slug', 'excerpt_html', 'update').order_by('-update')[:5]
 
     def item_title(self, item):
         return item.title
 
     def item_description(self, item):
-        return item.description
+        return item.excerpt_html
 
     def item_link(self, item):
-        return reverse('post_detail', args=[item.slug])
+        return reverse('blog:post_detail', args=[item.slug])
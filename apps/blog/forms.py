@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from .models import Post, Comment
 from ckeditor.widgets import CKEditorWidget
 
@@ -60,3 +61,14 @@ class CommentCreateForm(forms.ModelForm):
     class Meta:
         model = Comment
         fields = ('content',)
+
+    def clean_parent(self):
+        """
+        При хранении дерева материализованным путем глубина ветки ограничена длиной пути
+        """
+        parent_id = self.cleaned_data.get('parent')
+        if parent_id and settings.COMMENTS_TREE_STORAGE == 'path':
+            level = Comment.objects.filter(pk=parent_id).values_list('level', flat=True).first()
+            if level is not None and level + 1 >= Comment.MAX_PATH_DEPTH:
+                raise forms.ValidationError('Ветка слишком глубокая, ответьте на комментарий выше')
+        return parent_id
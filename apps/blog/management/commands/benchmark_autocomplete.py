@@ -0,0 +1,85 @@
+import random
+import sqlite3
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from pytils.translit import translify
+
+from apps.services.autocomplete import PrefixIndex, normalize
+
+WORDS = (
+    'django', 'python', 'кэширование', 'запросы', 'индексы', 'шаблоны', 'миграции', 'сигналы', 'поиск',
+    'производительность', 'оптимизация', 'база', 'данных', 'представления', 'формы', 'тестирование', 'sqlite',
+    'postgresql', 'redis', 'celery', 'асинхронность', 'безопасность', 'авторизация', 'комментарии', 'теги',
+    'категории', 'рейтинг', 'изображения', 'статистика', 'развертывание', 'docker', 'nginx', 'очереди', 'логи',
+)
+
+
+class Command(BaseCommand):
+    """
+    Задержка подсказок поиска на синтетических названиях: префиксный индекс в памяти (PrefixIndex)
+    против LIKE '%q%' по таблице SQLite в памяти. Запросы - начала слов названий, в т.ч. в транслитерации.
+    """
+    help = 'Бенчмарк подсказок поиска: префиксный индекс в памяти и LIKE по таблице'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=100000, help='Количество названий')
+        parser.add_argument('--queries', type=int, default=10000, help='Количество запросов к индексу')
+        parser.add_argument('--like-queries', type=int, default=200, help='Количество запросов LIKE')
+        parser.add_argument('--limit', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        rows = [(pk, ' '.join(rnd.choices(WORDS, k=rnd.randint(3, 7))).capitalize() + f' {pk}', f'post-{pk}')
+                for pk in range(1, options['titles'] + 1)]
+        queries = [self.make_query(rnd, label) for _pk, label, _slug in rnd.choices(rows, k=options['queries'])]
+
+        started = time.perf_counter()
+        PrefixIndex(rows)
+        build = time.perf_counter() - started
+        tracemalloc.start()
+        index = PrefixIndex(rows)
+        memory, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f'[индекс] построение {build:.2f} с, память {memory / 1024 / 1024:.1f} МБ '
+                          f'(пик {peak / 1024 / 1024:.1f} МБ), позиций {len(index.main.offsets)}')
+
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(normalize(query), options['limit'])
+            timings.append(time.perf_counter() - started)
+        self.stdout.write(f'[индекс] {self.describe(timings)}')
+
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE post (id INTEGER PRIMARY KEY, title TEXT, slug TEXT)')
+        connection.executemany('INSERT INTO post VALUES (?, ?, ?)', rows)
+        timings = []
+        for query in queries[:options['like_queries']]:
+            started = time.perf_counter()
+            connection.execute('SELECT id, title, slug FROM post WHERE title LIKE ? LIMIT ?',
+                               (f'%{query}%', options['limit'])).fetchall()
+            timings.append(time.perf_counter() - started)
+        connection.close()
+        self.stdout.write(f'[LIKE %q%] {self.describe(timings)}')
+
+    @staticmethod
+    def make_query(rnd, label):
+        """
+        Начало случайного слова названия длиной 2-8 символов; каждый четвертый запрос - в транслитерации
+        """
+        word = rnd.choice(label.split(' ')[:-1]).lower()
+        if rnd.random() < 0.25:
+            word = translify(word)
+        return word[:rnd.randint(2, 8)]
+
+    @staticmethod
+    def describe(timings):
+        timings = sorted(timings)
+        p50 = timings[len(timings) // 2]
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        return (f'среднее {statistics.mean(timings) * 1000:.3f} мс, p50 {p50 * 1000:.3f} мс, '
+                f'p99 {p99 * 1000:.3f} мс, n={len(timings)}')
@@ -0,0 +1,75 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management.base import BaseCommand
+
+from apps.services.tiered_cache import TieredCache
+
+
+class Command(BaseCommand):
+    """
+    Сравнение прежнего FileBasedCache и двухуровневого TieredCache на ключах этого проекта:
+    присутствие пользователей, версии групп страниц, закэшированные страницы и ветки комментариев.
+    Оба кэша создаются во временном каталоге и не затрагивают рабочий кэш.
+    """
+    help = 'Бенчмарк FileBasedCache и TieredCache на типовых ключах сайта'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Количество имитируемых запросов')
+        parser.add_argument('--users', type=int, default=200, help='Количество активных пользователей')
+        parser.add_argument('--pages', type=int, default=50, help='Количество разных закэшированных страниц')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        params = {'OPTIONS': {'MAX_ENTRIES': 10000, **settings.CACHES['default'].get('OPTIONS', {})}}
+        with tempfile.TemporaryDirectory() as directory:
+            backends = {
+                'file': FileBasedCache(os.path.join(directory, 'file'), params),
+                'tiered': TieredCache(os.path.join(directory, 'tiered.sqlite3'), params),
+            }
+            for name, backend in backends.items():
+                for operation, timings in self.run(backend, options).items():
+                    self.stdout.write(f'[{name}] {operation}: {self.describe(timings)}')
+
+    @staticmethod
+    def describe(timings):
+        timings = sorted(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        return f'среднее {statistics.mean(timings) * 1e6:.1f} мкс, p99 {p99 * 1e6:.1f} мкс, n={len(timings)}'
+
+    @staticmethod
+    def run(cache, options):
+        rnd = random.Random(options['seed'])
+        page = b'<html>' + b'x' * 30000 + b'</html>'
+        groups = ['site', 'lists'] + [f'post-{i}' for i in range(options['pages'])]
+        cache.set_many({f'page-version:{group}': 1 for group in groups}, None)
+        for i in range(options['pages']):
+            cache.set(f'page:{i}', {'versions': (1, 1), 'content': page}, 300)
+            cache.set(f'comments-thread:{i}:1:lazy', 'x' * 5000, 3600)
+
+        timings = {'присутствие (get/set)': [], 'версии страниц (get_many)': [], 'страница (get)': [],
+                   'ветка комментариев (get)': [], 'новая версия (incr)': []}
+
+        def measure(operation, func, *args):
+            started = time.perf_counter()
+            func(*args)
+            timings[operation].append(time.perf_counter() - started)
+
+        for _ in range(options['requests']):
+            user_id, page_id = rnd.randrange(options['users']), rnd.randrange(options['pages'])
+            started = time.perf_counter()
+            if cache.get(f'last-seen-{user_id}') is None:
+                cache.set(f'last-seen-{user_id}', time.time(), 300)
+            timings['присутствие (get/set)'].append(time.perf_counter() - started)
+            measure('версии страниц (get_many)', cache.get_many,
+                    ['page-version:site', 'page-version:lists', f'page-version:post-{page_id}'])
+            measure('страница (get)', cache.get, f'page:{page_id}')
+            measure('ветка комментариев (get)', cache.get, f'comments-thread:{page_id}:1:lazy')
+            if rnd.random() < 0.02:
+                measure('новая версия (incr)', cache.incr, f'page-version:post-{page_id}')
+        return timings
@@ -0,0 +1,73 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from apps.blog.models import Category, Comment, Post
+from apps.services.comments import load_comment_page, load_comment_tree
+
+
+class Command(BaseCommand):
+    """
+    Сравнение режимов хранения дерева комментариев (MPTT и материализованный путь)
+    по задержке вставки и чтения на одной записи с большим количеством комментариев.
+    Все данные создаются во временной транзакции и откатываются.
+    """
+    help = 'Бенчмарк вставки и чтения комментариев в режимах mptt и path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Количество комментариев на запись')
+        parser.add_argument('--roots', type=float, default=0.1, help='Доля корневых комментариев')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        for storage in ('mptt', 'path'):
+            with override_settings(COMMENTS_TREE_STORAGE=storage):
+                inserts, reads = self.run(options['count'], options['roots'], options['seed'])
+            self.stdout.write(f'[{storage}] вставка: {self.describe(inserts)}')
+            for name, timings in reads.items():
+                self.stdout.write(f'[{storage}] {name}: {self.describe(timings)}')
+
+    @staticmethod
+    def describe(timings):
+        timings = sorted(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        return f'среднее {statistics.mean(timings) * 1000:.3f} мс, p99 {p99 * 1000:.3f} мс, n={len(timings)}'
+
+    @staticmethod
+    def run(count, roots_share, seed):
+        rnd = random.Random(seed)
+        with transaction.atomic():
+            author = User.objects.create(username=f'benchmark-{time.time_ns()}')
+            category = Category.objects.create(title='Benchmark', slug=f'benchmark-{time.time_ns()}', description='-')
+            post = Post.objects.create(title='Benchmark', description='-', text='-', category=category, author=author)
+
+            inserts, ids = [], []
+            for _ in range(count):
+                parent_id = rnd.choice(ids) if ids and rnd.random() > roots_share else None
+                started = time.perf_counter()
+                comment = Comment(post=post, author=author, content='-', parent_id=parent_id)
+                comment.save()
+                inserts.append(time.perf_counter() - started)
+                ids.append(comment.pk)
+
+            reads = {'полное дерево': [], 'страница корней': [], 'ответы на комментарий': []}
+            for _ in range(20):
+                started = time.perf_counter()
+                load_comment_tree(post)
+                reads['полное дерево'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                load_comment_page(post.pk)
+                reads['страница корней'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                load_comment_page(post.pk, parent_id=rnd.choice(ids))
+                reads['ответы на комментарий'].append(time.perf_counter() - started)
+
+            transaction.set_rollback(True)
+        return inserts, reads
@@ -0,0 +1,70 @@
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps.blog.models import Category, Post
+
+
+class Command(BaseCommand):
+    """
+    Сравнение полной загрузки записей списка и проекции карточек (Post.custom.cards())
+    по времени, памяти на страницу и объему прочитанных данных.
+    Записи с большим текстом создаются во временной транзакции и откатываются.
+    """
+    help = 'Бенчмарк страницы списка записей: полные строки и проекция карточек'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=500, help='Количество записей')
+        parser.add_argument('--text-size', type=int, default=50000, help='Размер полного текста записи в символах')
+        parser.add_argument('--page-size', type=int, default=10, help='Записей на странице')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.create_posts(options['posts'], options['text_size'])
+            querysets = {'полные строки': Post.custom.all(), 'карточки': Post.custom.cards()}
+            for name, queryset in querysets.items():
+                timings, memory, size, columns = self.run(queryset.order_by('-fixed', '-create', '-pk'), options)
+                self.stdout.write(
+                    f'[{name}] среднее {statistics.mean(timings) * 1000:.3f} мс, '
+                    f'память на страницу {memory / 1024:.1f} КБ, прочитано {size / 1024:.1f} КБ, '
+                    f'колонок {columns}'
+                )
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def create_posts(count, text_size):
+        author = User.objects.create(username=f'benchmark-{time.time_ns()}')
+        category = Category.objects.create(title='Benchmark', slug=f'benchmark-{time.time_ns()}', description='-')
+        Post.objects.bulk_create([
+            Post(title=f'Benchmark {number}', slug=f'benchmark-{time.time_ns()}-{number}', description='-' * 300,
+                 text='x' * text_size, category=category, author=author)
+            for number in range(count)
+        ])
+
+    @staticmethod
+    def run(queryset, options):
+        page_size = options['page_size']
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            list(queryset[:page_size])
+            timings.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        list(queryset[:page_size])
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # Объем данных страницы: сумма длин значений всех колонок, которые вернул запрос
+        sql, params = queryset[:page_size].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            columns = len(cursor.description)
+        size = sum(len(str(value)) for row in rows for value in row if value is not None)
+        return timings, memory, size, columns
@@ -0,0 +1,65 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.blog.models import Rating, RatingRollup, RatingVoter
+from apps.services.utils import hash_ip
+
+
+class Command(BaseCommand):
+    """
+    Свертка старых голосов в дневные агрегаты (RatingRollup) и хэши IP (RatingVoter).
+    Каждая пачка обрабатывается в своей транзакции и удаляет свернутые голоса,
+    поэтому прерванный запуск можно просто повторить. Счетчики записей не меняются.
+    """
+    help = 'Сворачивает голоса старше заданного возраста в дневные агрегаты по записям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'RATING_COMPACT_AFTER_DAYS', 365),
+                            help='Сворачивать голоса старше этого количества дней')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество голосов в одной транзакции')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old_ratings = Rating.objects.filter(time_create__lt=cutoff).order_by('time_create', 'pk')
+        total = 0
+
+        while True:
+            with transaction.atomic():
+                batch = list(old_ratings.values('pk', 'post_id', 'ip_address', 'value', 'time_create')[
+                             :options['batch_size']])
+                if not batch:
+                    break
+                self.compact(batch)
+            total += len(batch)
+            self.stdout.write(f'Свернуто голосов: {total}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово, свернуто голосов: {total}'))
+
+    @staticmethod
+    def compact(batch):
+        """
+        Перенос пачки голосов в агрегаты и хэши IP с удалением исходных строк
+        """
+        rollups = defaultdict(lambda: [0, 0])
+        for rating in batch:
+            day = timezone.localdate(rating['time_create'])
+            rollups[(rating['post_id'], day)][0 if rating['value'] == 1 else 1] += 1
+
+        RatingVoter.objects.bulk_create(
+            [RatingVoter(post_id=rating['post_id'], ip_hash=hash_ip(rating['ip_address'])) for rating in batch],
+            ignore_conflicts=True,
+        )
+        for (post_id, day), (likes, dislikes) in rollups.items():
+            updated = RatingRollup.objects.filter(post_id=post_id, day=day).update(
+                likes=F('likes') + likes, dislikes=F('dislikes') + dislikes)
+            if not updated:
+                RatingRollup.objects.create(post_id=post_id, day=day, likes=likes, dislikes=dislikes)
+        # Свернутые голоса остаются в счетчиках записей: удаление без их уменьшения
+        with Rating.keeping_counters():
+            Rating.objects.filter(pk__in=[rating['pk'] for rating in batch]).delete()
@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.blog.models import Comment
+
+
+class Command(BaseCommand):
+    """
+    Пересчет обоих представлений дерева комментариев по parent_id: материализованного пути
+    и полей MPTT (tree_id, lft, rght, level), порядок ответов - по времени добавления (pk).
+    После команды можно включать любой режим COMMENTS_TREE_STORAGE. Запускать без параллельной
+    записи комментариев: tree_id назначаются заново.
+    """
+    help = 'Перестраивает материализованные пути и поля MPTT комментариев по parent_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество комментариев в одном UPDATE')
+
+    def handle(self, *args, **options):
+        total, tree_id = 0, 0
+        post_ids = Comment.objects.order_by('post_id').values_list('post_id', flat=True).distinct()
+        for post_id in list(post_ids):
+            converted, tree_id = self.convert_post(post_id, tree_id, options['batch_size'])
+            total += converted
+        self.stdout.write(self.style.SUCCESS(f'Перестроено комментариев: {total}'))
+
+    @staticmethod
+    def convert_post(post_id, tree_id, batch_size):
+        """
+        Обход веток одной записи в глубину без рекурсии, запись в одной транзакции.
+        Возвращает (количество комментариев, последний выданный tree_id)
+        """
+        with transaction.atomic():
+            children = defaultdict(list)
+            for pk, parent_id in Comment.objects.filter(post_id=post_id).order_by('pk').values_list('pk', 'parent_id'):
+                children[parent_id].append(pk)
+
+            comments = {}
+            for root in children[None]:
+                tree_id += 1
+                counter = 0
+                stack = [(root, '', 0, False)]
+                while stack:
+                    pk, prefix, level, closing = stack.pop()
+                    counter += 1
+                    if closing:
+                        comments[pk].rght = counter
+                        continue
+                    path = prefix + Comment.path_segment(pk)
+                    comments[pk] = Comment(pk=pk, path=path, level=level, tree_id=tree_id, lft=counter)
+                    stack.append((pk, prefix, level, True))
+                    stack.extend((child, path, level + 1, False) for child in reversed(children[pk]))
+
+            Comment.objects.bulk_update(
+                comments.values(), ['path', 'level', 'tree_id', 'lft', 'rght'], batch_size=batch_size)
+        return len(comments), tree_id
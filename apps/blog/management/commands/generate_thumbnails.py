@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.accounts.models import Profile
+from apps.blog.models import Post
+from apps.services.page_cache import bump_page_versions
+from apps.services.thumbnails import generate_derivatives
+
+
+class Command(BaseCommand):
+    """
+    Создание уменьшенных копий для уже загруженных изображений записей и аватаров в несколько процессов.
+    Файлы, хэш которых совпадает с манифестом прошлой обработки, пропускаются
+    """
+    help = 'Создает WebP/JPEG копии изображений записей и аватаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Количество процессов')
+        parser.add_argument('--force', action='store_true', help='Пересоздать копии даже для неизмененных файлов')
+
+    def handle(self, *args, **options):
+        media_root = str(settings.MEDIA_ROOT)
+        jobs = {(name, 'post') for name in Post.objects.values_list('thumbnail', flat=True).distinct()}
+        jobs |= {(name, 'avatar') for name in Profile.objects.values_list('avatar', flat=True).distinct()}
+        jobs = [(name, kind) for name, kind in jobs if name and os.path.isfile(os.path.join(media_root, name))]
+
+        created = skipped = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(generate_derivatives, media_root, name, kind, options['force']): name
+                for name, kind in jobs
+            }
+            for future in as_completed(futures):
+                try:
+                    if future.result():
+                        created += 1
+                    else:
+                        skipped += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {error}')
+
+        if created:
+            bump_page_versions('site')  # закэшированные страницы ссылаются на оригиналы
+        self.stdout.write(self.style.SUCCESS(
+            f'Изображений: {len(jobs)}, обработано: {created}, без изменений: {skipped}, ошибок: {failed}'))
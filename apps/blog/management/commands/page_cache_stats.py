@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.services.page_cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    """
+    Счетчики кэша страниц для анонимных посетителей
+    """
+    help = 'Показывает попадания, отдачу устаревших страниц и промахи кэша страниц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счетчики после вывода')
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        total = sum(stats.values())
+        for stat, value in stats.items():
+            share = value / total * 100 if total else 0
+            self.stdout.write(f'{stat}: {value} ({share:.1f}%)')
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Счетчики обнулены'))
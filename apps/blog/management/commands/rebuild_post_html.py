@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from apps.blog.models import Post
+from apps.services.page_cache import bump_page_versions
+
+
+class Command(BaseCommand):
+    """
+    Заполнение очищенного анонса и текста (excerpt_html, text_html) у существующих записей пачками
+    """
+    help = 'Пересчитывает сохраненный HTML анонса и текста записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Количество записей в одной пачке')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fields = ('description', 'text', 'excerpt_html', 'text_html')
+        last_pk, checked, updated = 0, 0, 0
+
+        while True:
+            posts = list(Post.objects.filter(pk__gt=last_pk).order_by('pk').only(*fields)[:batch_size])
+            if not posts:
+                break
+            changed = []
+            for post in posts:
+                old = (post.excerpt_html, post.text_html)
+                post.render_html()
+                if (post.excerpt_html, post.text_html) != old:
+                    changed.append(post)
+            Post.objects.bulk_update(changed, ['excerpt_html', 'text_html'])
+            last_pk, checked, updated = posts[-1].pk, checked + len(posts), updated + len(changed)
+
+        # bulk_update не отправляет сигналы: сбрасываем кэш записей и страниц вручную
+        if updated:
+            Post.cached.bump()
+            bump_page_versions('site', 'lists')
+        self.stdout.write(self.style.SUCCESS(f'Проверено записей: {checked}, обновлено: {updated}'))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from apps.blog.models import Post, Rating, RatingRollup
+
+
+class Command(BaseCommand):
+    """
+    Пересчет денормализованных счетчиков рейтинга записей с нуля по голосам и их сверткам
+    """
+    help = 'Пересчитывает счетчики рейтинга (лайки, дизлайки, сумма) у всех записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество записей в одной транзакции')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        post_ids = list(Post.objects.order_by('pk').values_list('pk', flat=True))
+        fixed = 0
+
+        for start in range(0, len(post_ids), batch_size):
+            batch = post_ids[start:start + batch_size]
+            with transaction.atomic():
+                posts = list(Post.objects.select_for_update().filter(pk__in=batch).only(
+                    'rating_likes', 'rating_dislikes', 'rating_sum'))
+                totals = {
+                    row['post_id']: (row['likes'], row['dislikes'])
+                    for row in Rating.objects.filter(post_id__in=batch).order_by().values('post_id').annotate(
+                        likes=Count('pk', filter=Q(value=1)),
+                        dislikes=Count('pk', filter=Q(value=-1)),
+                    )
+                }
+                # Свернутые старые голоса (compact_ratings) тоже входят в счетчики
+                for row in RatingRollup.objects.filter(post_id__in=batch).order_by().values('post_id').annotate(
+                        likes=Sum('likes'), dislikes=Sum('dislikes')):
+                    likes, dislikes = totals.get(row['post_id'], (0, 0))
+                    totals[row['post_id']] = (likes + row['likes'], dislikes + row['dislikes'])
+                changed = []
+                for post in posts:
+                    likes, dislikes = totals.get(post.pk, (0, 0))
+                    if (post.rating_likes, post.rating_dislikes, post.rating_sum) != (likes, dislikes, likes - dislikes):
+                        post.rating_likes, post.rating_dislikes, post.rating_sum = likes, dislikes, likes - dislikes
+                        changed.append(post)
+                Post.objects.bulk_update(changed, ['rating_likes', 'rating_dislikes', 'rating_sum'])
+            fixed += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f'Проверено записей: {len(post_ids)}, исправлено: {fixed}'))
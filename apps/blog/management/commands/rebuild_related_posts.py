@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from taggit.models import TaggedItem
+
+from apps.blog.models import Post, RelatedPost
+from apps.services.categories import category_tree
+from apps.services.page_cache import bump_page_versions
+from apps.services.related import RelatedScorer, category_distances, post_content_type, save_related
+
+
+class Command(BaseCommand):
+    """
+    Полная перестройка похожих записей (после изменения дерева категорий, массовой загрузки, по расписанию).
+    Все опубликованные записи и их теги загружаются двумя запросами, сходство считается произведением
+    разреженной матрицы "запись x тег" на транспонированную по спискам записей тегов, списки записываются
+    пачками - только изменившиеся
+    """
+    help = 'Перестраивает таблицу похожих записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество записей в одной пачке')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        posts = {pk: (category_id, create) for pk, category_id, create in (
+            Post.custom.select_related(None).order_by('pk').values_list('pk', 'category_id', 'create'))}
+        tagged = TaggedItem.objects.filter(content_type=post_content_type(),
+                                           object_id__in=Post.custom.order_by().values('pk')) \
+            .values_list('object_id', 'tag_id').iterator(chunk_size=10000)
+        scorer = RelatedScorer(posts, tagged, len(posts), category_distances(category_tree.get().nodes))
+        loaded = time.perf_counter()
+
+        post_ids, changed = list(posts), 0
+        for start in range(0, len(post_ids), options['batch_size']):
+            batch = post_ids[start:start + options['batch_size']]
+            changed += len(save_related({pk: scorer.top(pk) for pk in batch}))
+        removed, _ = RelatedPost.objects.filter(~Q(post__status='published') | ~Q(related__status='published')).delete()
+
+        if changed or removed:
+            bump_page_versions('site')
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей: {len(posts)}, изменено списков: {changed}, удалено строк неопубликованных: {removed}, '
+            f'загрузка {loaded - started:.2f} с, расчет {time.perf_counter() - loaded:.2f} с'
+        ))
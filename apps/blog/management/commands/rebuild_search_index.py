@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.blog.models import Post
+from apps.services.page_cache import bump_page_versions
+from apps.services.search import drop_search_index, ensure_search_index, index_posts, optimize_search_index
+
+
+class Command(BaseCommand):
+    """
+    Полное перестроение поискового индекса: таблица FTS5 создается заново и заполняется
+    опубликованными записями пачками по pk (в памяти не больше одной пачки)
+    """
+    help = 'Перестраивает полнотекстовый индекс записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество записей в одной пачке')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk, indexed = 0, 0
+
+        with transaction.atomic():
+            drop_search_index()
+            ensure_search_index()
+            while True:
+                posts = list(Post.custom.select_related(None).filter(pk__gt=last_pk).order_by('pk')
+                             .only('title', 'description', 'text', 'status')[:batch_size])
+                if not posts:
+                    break
+                index_posts(posts)
+                last_pk, indexed = posts[-1].pk, indexed + len(posts)
+            optimize_search_index()
+
+        bump_page_versions('lists')
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано записей: {indexed}'))
@@ -0,0 +1,31 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from taggit.models import TaggedItem
+
+from apps.blog.models import Post, TagCount
+from apps.services.page_cache import bump_page_versions
+from apps.services.tags import bump_tag_index_version
+
+
+class Command(BaseCommand):
+    """
+    Полный пересчет количества опубликованных записей у тегов одним агрегирующим запросом
+    (после массовых изменений мимо сигналов: queryset.update(status=...), загрузка данных)
+    """
+    help = 'Пересчитывает количество опубликованных записей у тегов'
+
+    def handle(self, *args, **options):
+        counts = (
+            TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Post),
+                                      object_id__in=Post.custom.order_by().values('pk'))
+            .order_by().values_list('tag_id').annotate(total=Count('pk'))
+        )
+        with transaction.atomic():
+            TagCount.objects.all().delete()
+            TagCount.objects.bulk_create([TagCount(tag_id=tag_id, posts=total) for tag_id, total in counts])
+
+        bump_tag_index_version()
+        bump_page_versions('site')
+        self.stdout.write(self.style.SUCCESS(f'Тегов с опубликованными записями: {TagCount.objects.count()}'))
@@ -1,16 +1,78 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from ckeditor.fields import RichTextField
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Value
 from django.core.validators import FileExtensionValidator
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
 # from mptt.fields import TreeForeignKey
 from mptt.models import MPTTModel, TreeForeignKey
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
 
+from apps.services.html import render_body, render_excerpt
+from apps.services.object_cache import CachedManager
+from apps.services.search import SEARCH_TABLE, Highlight, SearchDocumentField, Snippet, parse_query
 from apps.services.utils import unique_slugify
 
 
-class PostManager(models.Manager):
+class PostQuerySet(models.QuerySet):
+    """
+    Фильтры списков записей, при которых сортировка (-fixed, -create, -pk) идет
+    по частичному индексу post_published_list_idx без временного B-дерева
+    """
+    # Поля карточки записи в списках (blog/post_list.html) и навигации по курсору: без полного текста
+    # и без лишних колонок автора и категории
+    CARD_FIELDS = (
+        'title', 'slug', 'excerpt_html', 'thumbnail', 'create', 'fixed', 'rating_sum',
+        'author__username', 'category__title', 'category__slug',
+    )
+
+    def cards(self):
+        """
+        Проекция для карточек: только колонки, которые выводит список записей, и теги всей страницы одним запросом
+        """
+        return self.select_related('author', 'category').only(*self.CARD_FIELDS).prefetch_related('tags')
+
+    def in_category(self, category):
+        """
+        Записи категории и всех ее подкатегорий. Для листовой категории - равенство по индексу категории,
+        для ветки - проверка категории каждой записи при проходе индекса списка (EXISTS по PK)
+        """
+        if category.is_leaf_node():
+            return self.filter(category_id=category.pk)
+        return self.filter(Exists(Category.objects.filter(
+            pk=OuterRef('category_id'), tree_id=category.tree_id, lft__gte=category.lft, rght__lte=category.rght,
+        )))
+
+    def with_tag(self, tag):
+        """
+        Записи с тегом: проход индекса списка с проверкой по уникальному индексу taggit (content_type, object_id, tag)
+        """
+        return self.filter(Exists(TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model), object_id=OuterRef('pk'), tag=tag,
+        )))
+
+
+    def search(self, query):
+        """
+        Полнотекстовый поиск по индексу FTS5: релевантность search_score (больше - лучше),
+        название search_title и фрагмент текста search_snippet с метками совпадений
+        """
+        expression = parse_query(query)
+        if not expression:
+            # Пустой запрос: те же аннотации, чтобы сортировка и курсор по search_score оставались допустимыми
+            return self.none().annotate(search_score=Value(0.0), search_title=Value(''), search_snippet=Value(''))
+        return self.filter(search__document__match=expression).annotate(
+            search_score=-F('search__rank'), search_title=Highlight(), search_snippet=Snippet(),
+        )
+
+
+class PostManager(models.Manager.from_queryset(PostQuerySet)):
     """
     Кастомный менеджер для модели постов
     """
@@ -44,6 +106,8 @@ class Category(MPTTModel):
         verbose_name='Родительская категория'
     )
 
+    cached = CachedManager()  # кэш категории по slug/pk
+
     class MPTTMeta:
         """
         Сортировка по вложенности
@@ -82,8 +146,9 @@ class Post(models.Model):
     )
 
     title = models.CharField(verbose_name='Название записи', max_length=255)
-    slug = models.SlugField(verbose_name='URL', max_length=255, blank=True)  # используется unique_slugify()
-    # slug = models.SlugField(verbose_name='URL', max_length=255, blank=True, unique=True)
+    # slug = models.SlugField(verbose_name='URL', max_length=255, blank=True)
+    # Генерируется unique_slugify() один раз при создании, смена сохраняет старый адрес в SlugHistory
+    slug = models.SlugField(verbose_name='URL', max_length=255, blank=True, unique=True)
 
     # До использования CKEditor
     # description = models.TextField(verbose_name='Краткое описание', max_length=500)
@@ -91,6 +156,9 @@ class Post(models.Model):
 
     description = RichTextField(config_name='awesome_ckeditor', verbose_name='Краткое описание',                   max_length=500)
     text = RichTextField(config_name='awesome_ckeditor', verbose_name='Полный текст записи')
+    # Очищенный HTML, готовится при сохранении (apps/services/html.py), шаблоны выводят его без обработки
+    excerpt_html = models.TextField(verbose_name='Анонс (HTML)', blank=True, editable=False)
+    text_html = models.TextField(verbose_name='Текст (HTML)', blank=True, editable=False)
 
     category = TreeForeignKey(to=Category, on_delete=models.PROTECT, related_name='posts', verbose_name='Категория')
     # Если первичную модель Category описать ниже вторичной Post, то тогда ее нужно взять в кавычки 'Category'
@@ -111,18 +179,43 @@ class Post(models.Model):
                                 related_name='updater_posts', blank=True)
     fixed = models.BooleanField(verbose_name='Прикреплено', default=False)
 
+    # Денормализованные счетчики рейтинга, поддерживаются моделью Rating в той же транзакции
+    rating_likes = models.PositiveIntegerField(verbose_name='Лайки', default=0, editable=False)
+    rating_dislikes = models.PositiveIntegerField(verbose_name='Дизлайки', default=0, editable=False)
+    rating_sum = models.IntegerField(verbose_name='Рейтинг', default=0, editable=False)
+    # Счетчик просмотров и затухающая популярность, их пачками увеличивает ViewCounter (apps/services/post_views.py)
+    views = models.PositiveIntegerField(verbose_name='Просмотры', default=0, editable=False)
+    popularity = models.FloatField(verbose_name='Популярность', default=0, editable=False)
+    popularity_updated = models.FloatField(verbose_name='Пересчет популярности (Unix время)', default=0,
+                                           editable=False)
+
     objects = models.Manager()
     custom = PostManager()
+    # кэш записи по slug/pk для страницы записи (вместе с автором, категорией и тегами)
+    cached = CachedManager(related=('author', 'category'), prefetch=('tags',))
 
     tags = TaggableManager()  # тегирование
 
     class Meta:
         db_table = 'blog_post'
         ordering = ['-fixed', '-create']
-        indexes = [models.Index(fields=['-fixed', '-create', 'status'])]
+        # Частичные индексы только по опубликованным записям в порядке списков (Post.custom + курсор -fixed, -create, -pk):
+        # главная и теги, страницы категорий, RSS лента
+        indexes = [
+            models.Index(fields=['-fixed', '-create', '-id'], condition=Q(status='published'),
+                         name='post_published_list_idx'),
+            models.Index(fields=['category', '-fixed', '-create', '-id'], condition=Q(status='published'),
+                         name='post_published_category_idx'),
+            models.Index(fields=['-update'], condition=Q(status='published'), name='post_published_feed_idx'),
+            models.Index(fields=['-popularity_updated'], condition=Q(status='published'),
+                         name='post_published_popular_idx'),
+        ]
         verbose_name = 'Статья'
         verbose_name_plural = 'Статьи'
 
+    # Поля, которые меняются только приращениями в БД: сохранение записи их не перезаписывает
+    COUNTER_FIELDS = ('rating_likes', 'rating_dislikes', 'rating_sum', 'views', 'popularity', 'popularity_updated')
+
     def __str__(self):
         return self.title
 
@@ -132,18 +225,98 @@ class Post(models.Model):
         """
         return reverse('blog:post_detail', kwargs={'slug': self.slug})
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_slug = getattr(instance, 'slug', None) if 'slug' in field_names else None
+        instance._loaded_status = getattr(instance, 'status', None) if 'status' in field_names else None
+        instance._loaded_category_id = getattr(instance, 'category_id', None) if 'category_id' in field_names else None
+        instance._loaded_thumbnail = instance.__dict__['thumbnail'] if 'thumbnail' in field_names else None
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        """
+        Дозагрузка отложенного поля (или перечитывание записи) обновляет и его значение из БД для field_changed
+        """
+        super().refresh_from_db(using, fields)
+        for attname in ('slug', 'status', 'category_id'):
+            if fields is None or attname in fields:
+                setattr(self, f'_loaded_{attname}', getattr(self, attname))
+        if fields is None or 'thumbnail' in fields:
+            self._loaded_thumbnail = self.thumbnail.name
+
     def save(self, *args, **kwargs):
         """
-        Сохранение полей модели при их отсутствии заполнения
+        Сохранение полей модели при их отсутствии заполнения.
+        SLUG создается один раз; при его смене старый адрес сохраняется в истории для 301 редиректа.
+        Существующая запись сохраняется без COUNTER_FIELDS, чтобы не затереть голоса и просмотры, записанные после
+        ее загрузки, и без отложенных полей (.only()/.defer()), чтобы не загружать их перед сохранением
+        """
+        if not self.slug:
+            self.slug = unique_slugify(self, self.title)
+        rendered = self.render_html(kwargs.get('update_fields'))
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], *rendered}
+        elif not self._state.adding and not kwargs.get('force_insert'):
+            skipped = {*self.COUNTER_FIELDS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.attname not in skipped]
+        old_slug = getattr(self, '_loaded_slug', None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old_slug != self.slug:
+                SlugHistory.objects.filter(slug=self.slug).delete()
+                if old_slug:
+                    SlugHistory.objects.update_or_create(slug=old_slug, defaults={'post': self})
+        self._loaded_slug = self.slug
+        self._loaded_status = self.status
+        self._loaded_category_id = self.category_id
+        if 'thumbnail' not in self.get_deferred_fields():
+            self._loaded_thumbnail = self.thumbnail.name
+
+    def field_changed(self, attname):
+        """
+        Изменилось ли поле (slug, status, category_id) с загрузки из БД или прошлого сохранения.
+        Отложенное (.only()/.defer()) и не присвоенное поле не изменилось и не загружается
         """
-        self.slug = unique_slugify(self, self.title)
-        super().save(*args, **kwargs)
+        if attname in self.get_deferred_fields():
+            return False
+        return getattr(self, attname) != getattr(self, f'_loaded_{attname}', None)
+
+    def render_html(self, update_fields=None):
+        """
+        Подготовка очищенного анонса и текста; при save(update_fields=...) - только если меняются исходные поля.
+        Возвращает имена пересчитанных полей
+        """
+        rendered = []
+        if update_fields is None or 'description' in update_fields:
+            self.excerpt_html = render_excerpt(self.description)
+            rendered.append('excerpt_html')
+        if update_fields is None or 'text' in update_fields:
+            self.text_html = render_body(self.text)
+            rendered.append('text_html')
+        return rendered
 
     def get_sum_rating(self):
         """
-        Подсчет суммы рейтинга
+        Сумма рейтинга (хранимый счетчик, без обращения к таблице рейтинга)
         """
-        return sum([rating.value for rating in self.ratings.all()])
+        return self.rating_sum
+
+    @classmethod
+    def update_rating(cls, post_id, likes=0, dislikes=0):
+        """
+        Атомарное изменение счетчиков рейтинга записи на указанные приращения.
+        UPDATE не отправляет post_save, поэтому кэш объекта записи сбрасывается после фиксации транзакции
+        """
+        if not likes and not dislikes:
+            return
+        cls.objects.filter(pk=post_id).update(
+            rating_likes=models.F('rating_likes') + likes,
+            rating_dislikes=models.F('rating_dislikes') + dislikes,
+            rating_sum=models.F('rating_sum') + likes - dislikes,
+        )
+        transaction.on_commit(lambda: cls.cached.invalidate_pks([post_id]))
 
 
 class Comment(MPTTModel):
@@ -163,24 +336,80 @@ class Comment(MPTTModel):
     time_update = models.DateTimeField(verbose_name='Время обновления', auto_now=True)
     status = models.CharField(choices=STATUS_OPTIONS, default='published', verbose_name='Статус поста', max_length=10)
     parent = TreeForeignKey('self', verbose_name='Родительский комментарий', null=True, blank=True, related_name='children', on_delete=models.CASCADE)
+    # Материализованный путь: pk всех предков и самого комментария сегментами фиксированной длины
+    path = models.CharField(verbose_name='Путь в ветке', max_length=512, blank=True, default='', editable=False)
 
-    class MTTMeta:
-        """
-        Сортировка по вложенности
-        """
-        order_insertion_by = ('-time_create',)
+    # Порядок вставки MPTT не задается (order_insertion_by): ответ добавляется последним ребенком,
+    # а новый корневой комментарий - новым деревом, без сдвига tree_id остальных веток
+
+    PATH_STEP = 8  # длина сегмента пути: pk в base36 с ведущими нулями
+    MAX_PATH_DEPTH = 512 // PATH_STEP  # уровней в пути длиной max_length поля path, глубже ответы не принимаются
 
     class Meta:
         """
         Сортировка, название модели в админ панели, таблица в данными
         """
         ordering = ['-time_create']
+        indexes = [models.Index(fields=['post', 'path'])]
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
     def __str__(self):
         return f'{self.author}:{self.content}'
 
+    @classmethod
+    def path_segment(cls, pk):
+        """
+        Сегмент материализованного пути для pk
+        """
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+        segment = ''
+        while pk:
+            pk, rest = divmod(pk, 36)
+            segment = digits[rest] + segment
+        return segment.rjust(cls.PATH_STEP, '0')
+
+    def save(self, *args, **kwargs):
+        """
+        В режиме хранения COMMENTS_TREE_STORAGE = 'path' новый комментарий добавляется
+        за O(1) без пересчета lft/rght всей ветки под блокировкой
+        """
+        if settings.COMMENTS_TREE_STORAGE == 'path' and self._state.adding:
+            return self.append_by_path()
+        return super().save(*args, **kwargs)
+
+    def append_by_path(self):
+        """
+        Вставка комментария с материализованным путем. Заполняются только parent, level и path:
+        lft/rght остаются нулями, tree_id - 0, поэтому API MPTT (get_descendants, get_children, перенос узлов
+        в админке, node_moved) в режиме 'path' не поддерживаются; вернуть их можно командой convert_comment_tree.
+        Ответ глубже MAX_PATH_DEPTH уровней не помещается в path - ValueError (форма проверяет это заранее)
+        """
+        parent = None
+        if self.parent_id:
+            parent = Comment.objects.filter(pk=self.parent_id).values('path', 'level', 'tree_id').get()
+        self.level = parent['level'] + 1 if parent else 0
+        if self.level >= self.MAX_PATH_DEPTH:
+            raise ValueError(f'Ответ глубже {self.MAX_PATH_DEPTH} уровней не поддерживается')
+        self.tree_id = parent['tree_id'] if parent else 0
+        self.lft = self.rght = 0
+
+        with transaction.atomic():
+            # Model.save() вместо MPTTModel.save(): ветка не перенумеровывается, сигналы отправляет Django
+            models.Model.save(self, force_insert=True)
+            self.path = (parent['path'] if parent else '') + self.path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+    def get_path_ancestor_ids(self):
+        """
+        pk предков по материализованному пути (от корня), для выборки одним запросом по pk
+        """
+        step = self.PATH_STEP
+        return [int(self.path[i:i + step], 36) for i in range(0, len(self.path) - step, step)]
+
+
+_rating_counters_kept = ContextVar('rating_counters_kept', default=False)
+
 
 class Rating(models.Model):
     """
@@ -202,3 +431,162 @@ class Rating(models.Model):
     def __str__(self):
         return self.post.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Запоминаем загруженные из БД значение и запись, чтобы при сохранении знать изменение голоса
+        """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_value = instance.__dict__.get('value')
+        instance._loaded_post_id = instance.__dict__.get('post_id')
+        return instance
+
+    @staticmethod
+    @contextmanager
+    def keeping_counters():
+        """
+        Удаление голосов без изменения счетчиков и страниц записей - для сервисов, которые считают счетчики сами
+        (буфер голосов, свертка истории): внутри блока сигналы post_delete голосов их не трогают.
+            with Rating.keeping_counters():
+                Rating.objects.filter(pk__in=pks).delete()
+        """
+        token = _rating_counters_kept.set(True)
+        try:
+            yield
+        finally:
+            _rating_counters_kept.reset(token)
+
+    @staticmethod
+    def counters_kept():
+        return _rating_counters_kept.get()
+
+    @staticmethod
+    def counter_deltas(old_value, new_value):
+        """
+        Приращения (лайки, дизлайки) при смене голоса old_value -> new_value, None - голоса нет
+        """
+        likes = (new_value == 1) - (old_value == 1)
+        dislikes = (new_value == -1) - (old_value == -1)
+        return likes, dislikes
+
+    def save(self, *args, **kwargs):
+        """
+        Сохранение голоса вместе с обновлением счетчиков записи в одной транзакции.
+        Голос, перенесенный на другую запись, снимается со старой и добавляется новой.
+        Удаление голоса уменьшает счетчики в сигнале post_delete (см. signals.py), чтобы учитывались и каскадные
+        удаления
+        """
+        old_value = getattr(self, '_loaded_value', None) if not self._state.adding else None
+        old_post_id = getattr(self, '_loaded_post_id', None) if not self._state.adding else None
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old_post_id is not None and old_post_id != self.post_id:
+                Post.update_rating(old_post_id, *self.counter_deltas(old_value, None))
+                old_value = None
+            Post.update_rating(self.post_id, *self.counter_deltas(old_value, self.value))
+        self._loaded_value = self.value
+        self._loaded_post_id = self.post_id
+
+
+
+class SlugHistory(models.Model):
+    """
+    Прежние SLUG записей: старые ссылки отвечают 301 редиректом на текущий адрес
+    """
+    post = models.ForeignKey(to=Post, verbose_name='Запись', on_delete=models.CASCADE, related_name='slug_history')
+    slug = models.SlugField(verbose_name='Прежний URL', max_length=255, unique=True)
+    time_create = models.DateTimeField(verbose_name='Время изменения', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Прежний URL записи'
+        verbose_name_plural = 'Прежние URL записей'
+
+    def __str__(self):
+        return self.slug
+
+
+class PostSearch(models.Model):
+    """
+    Полнотекстовый индекс опубликованных записей (виртуальная таблица SQLite FTS5, rowid = id записи).
+    Таблицу создает (после migrate) и обновляет apps.services.search, модель нужна для соединения в запросах
+    """
+    post = models.OneToOneField(to=Post, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING,
+                                related_name='search')
+    title = models.TextField()
+    body = models.TextField()
+    document = SearchDocumentField(db_column=SEARCH_TABLE)  # скрытая колонка для MATCH
+    rank = models.FloatField()  # скрытая колонка FTS5: bm25 (меньше - релевантнее)
+
+    class Meta:
+        managed = False
+        db_table = SEARCH_TABLE
+
+
+class TagCount(models.Model):
+    """
+    Количество опубликованных записей с тегом: меняется на приращения сигналами тегов и статуса записей,
+    полностью пересчитывается командой recount_tags
+    """
+    tag = models.OneToOneField(to=Tag, primary_key=True, verbose_name='Тег', on_delete=models.CASCADE,
+                               related_name='post_count')
+    posts = models.PositiveIntegerField(verbose_name='Опубликованных записей', default=0)
+
+    class Meta:
+        verbose_name = 'Количество записей с тегом'
+        verbose_name_plural = 'Количество записей с тегами'
+
+    def __str__(self):
+        return f'{self.tag_id}: {self.posts}'
+
+
+class RelatedPost(models.Model):
+    """
+    Предвычисленные похожие записи: первые RELATED_POSTS_COUNT соседей записи по общим тегам
+    и близости категорий в дереве (apps.services.related)
+    """
+    post = models.ForeignKey(to=Post, verbose_name='Запись', on_delete=models.CASCADE, related_name='related_links')
+    related = models.ForeignKey(to=Post, verbose_name='Похожая запись', on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        indexes = [models.Index(fields=['post', '-score'], name='related_post_score_idx')]
+        constraints = [models.UniqueConstraint(fields=['post', 'related'], name='related_post_unique')]
+        verbose_name = 'Похожая запись'
+        verbose_name_plural = 'Похожие записи'
+
+    def __str__(self):
+        return f'{self.post_id} -> {self.related_id}: {self.score:.3f}'
+
+
+class RatingRollup(models.Model):
+    """
+    Свернутые старые голоса: количество лайков и дизлайков записи за день
+    """
+    post = models.ForeignKey(to=Post, verbose_name='Запись', on_delete=models.CASCADE, related_name='rating_rollups')
+    day = models.DateField(verbose_name='День')
+    likes = models.PositiveIntegerField(verbose_name='Лайки', default=0)
+    dislikes = models.PositiveIntegerField(verbose_name='Дизлайки', default=0)
+
+    class Meta:
+        unique_together = ('post', 'day')
+        verbose_name = 'Свертка рейтинга'
+        verbose_name_plural = 'Свертки рейтинга'
+
+    def __str__(self):
+        return f'{self.post_id}:{self.day}'
+
+
+class RatingVoter(models.Model):
+    """
+    Хэши IP адресов свернутых голосов - защита от повторного голосования после свертки
+    """
+    post = models.ForeignKey(to=Post, verbose_name='Запись', on_delete=models.CASCADE, related_name='rating_voters')
+    ip_hash = models.BigIntegerField(verbose_name='Хэш IP адреса')
+
+    class Meta:
+        unique_together = ('post', 'ip_hash')
+        verbose_name = 'Проголосовавший'
+        verbose_name_plural = 'Проголосовавшие'
+
+    def __str__(self):
+        return f'{self.post_id}:{self.ip_hash}'
@@ -0,0 +1,310 @@
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, post_migrate, pre_delete, m2m_changed
+from django.dispatch import receiver
+from mptt.signals import node_moved
+from taggit.models import Tag, TaggedItem
+
+from apps.services.autocomplete import autocomplete
+from apps.services.categories import bump_category_tree_version
+from apps.services.comments import bump_comments_version
+from apps.services.page_cache import bump_page_versions, invalidate_post_pages, post_group
+from apps.services.related import schedule_related_ids, schedule_related_update
+from apps.services.search import ensure_search_index, index_posts, remove_post
+from apps.services.tags import change_tag_counts, record_tag_changes, tag_cache
+from apps.services.thumbnails import get_derivatives, schedule_derivatives
+from .models import Comment, Category, Post, Rating, RelatedPost
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(node_moved, sender=Comment)
+def invalidate_comment_thread(sender, instance, **kwargs):
+    """
+    Новая версия комментариев записи при добавлении, изменении, переносе или удалении комментария
+    """
+    bump_comments_version(instance.post_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+@receiver(post_delete, sender=Post)
+def invalidate_category_tree(sender, **kwargs):
+    """
+    Новая версия дерева категорий при сохранении, переносе (в т.ч. drag-and-drop в админке) и удалении
+    категорий, а также при удалении записей (счетчики записей в сайдбаре)
+    """
+    bump_category_tree_version()
+
+
+@receiver(post_save, sender=Post)
+def invalidate_category_tree_on_post_change(sender, instance, created, **kwargs):
+    """
+    Счетчики записей в сайдбаре меняются только при создании записи, смене категории или статуса
+    """
+    if created or instance.field_changed('category_id') or instance.field_changed('status'):
+        bump_category_tree_version()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages_on_post_change(sender, instance, **kwargs):
+    """
+    Изменение записи меняет списки, ее страницу и счетчики категорий в сайдбаре всех страниц.
+    При смене SLUG сбрасывается и страница по старому адресу (теперь там редирект)
+    """
+    slugs = {instance.slug, getattr(instance, '_loaded_slug', None) or instance.slug}
+    bump_page_versions('site', 'lists', *(post_group(slug) for slug in slugs))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_post_page_on_comment_change(sender, instance, **kwargs):
+    """
+    Комментарии видны только на странице записи
+    """
+    invalidate_post_pages(instance.post_id, lists=False)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_post_pages_on_rating_change(sender, instance, signal, **kwargs):
+    """
+    Голоса (сохраненные через ORM) меняют страницу записи и карточку в списках; перенесенный голос - и прежней записи.
+    Удаление внутри Rating.keeping_counters() страницы не сбрасывает (счетчики не меняются или их сбрасывает сервис)
+    """
+    if signal is post_delete and Rating.counters_kept():
+        return
+    invalidate_post_pages(instance.post_id)
+    old_post_id = getattr(instance, '_loaded_post_id', None)
+    if old_post_id is not None and old_post_id != instance.post_id:
+        invalidate_post_pages(old_post_id)
+
+
+@receiver(post_delete, sender=Rating)
+def update_rating_counters_on_delete(sender, instance, origin=None, **kwargs):
+    """
+    Удаленный голос (в т.ч. каскадом при удалении пользователя) уменьшает счетчики записи в той же транзакции.
+    При удалении самих записей счетчики не пересчитываются. Сервисы, которые считают счетчики сами
+    (буфер голосов, свертка истории), удаляют голоса внутри Rating.keeping_counters()
+    """
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is Post or Rating.counters_kept():
+        return
+    Post.update_rating(instance.post_id,
+                       *Rating.counter_deltas(getattr(instance, '_loaded_value', instance.value), None))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def invalidate_all_pages(sender, **kwargs):
+    """
+    Категории есть в сайдбаре каждой страницы (теги - см. invalidate_cached_posts_on_tag_change)
+    """
+    bump_page_versions('site')
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_post_pages_on_tags_change(sender, instance, action, **kwargs):
+    """
+    Изменение тегов записи (post.tags.add/remove/set/clear); запись в кэше объектов хранит свои теги
+    """
+    if action.startswith('post_') and isinstance(instance, Post):
+        invalidate_post_pages(instance.pk, instance.slug)
+        Post.cached.invalidate(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_cached_object(sender, instance, **kwargs):
+    """
+    Сброс объекта в кэше объектов по slug/pk
+    """
+    sender.cached.invalidate(instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_cached_tag(sender, instance, **kwargs):
+    tag_cache.invalidate(instance)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def invalidate_cached_categories(sender, **kwargs):
+    """
+    Изменение одной категории сдвигает lft/rght соседних, а записи в кэше хранят свою категорию,
+    поэтому сбрасываются все категории и записи
+    """
+    Category.cached.bump()
+    Post.cached.bump()
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_posts_on_author_change(sender, update_fields=None, **kwargs):
+    """
+    Записи в кэше хранят автора; обновление last_login при входе на них не влияет
+    """
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        Post.cached.bump()
+
+
+@receiver(post_save, sender=Post)
+def generate_post_thumbnails(sender, instance, **kwargs):
+    """
+    Уменьшенные копии изображения записи в фоне; когда они готовы, страницы с записью перестраиваются.
+    Сохранение без смены изображения (в т.ч. общего default.jpg, у которого копии уже есть) файлы не читает
+    """
+    if 'thumbnail' in instance.get_deferred_fields():
+        return
+    name = instance.thumbnail.name
+    if name == getattr(instance, '_loaded_thumbnail', None) \
+            or (name == Post._meta.get_field('thumbnail').default and get_derivatives(name)):
+        return
+    schedule_derivatives(instance.thumbnail, 'post',
+                         on_ready=lambda: invalidate_post_pages(instance.pk, instance.slug))
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    """
+    Таблица полнотекстового индекса (FTS5) не описывается миграциями и создается после migrate
+    """
+    if sender.name == 'apps.blog':
+        ensure_search_index(using)
+
+
+SEARCH_FIELDS = {'title', 'description', 'text', 'status'}
+
+
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    """
+    Запись переиндексируется в той же транзакции, что и сохранение; сохранение только
+    счетчиков (рейтинг и т.п.) индекс не трогает
+    """
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        index_posts([instance])
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_post(instance.pk)
+
+
+AUTOCOMPLETE_KINDS = {Post: 'post', Category: 'category', Tag: 'tag'}
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def update_autocomplete(sender, instance, signal, update_fields=None, **kwargs):
+    """
+    Подсказки поиска: название, slug или статус изменились - объект обновляется в индексе в памяти
+    """
+    if update_fields is None or {'title', 'name', 'slug', 'status'} & set(update_fields):
+        autocomplete.update_instance(AUTOCOMPLETE_KINDS[sender], instance, deleted=signal is post_delete)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_tag_counts_on_tags_change(sender, instance, action, pk_set, **kwargs):
+    """
+    Количество опубликованных записей у добавленных и снятых тегов. Для clear теги запоминаются до удаления
+    """
+    if not isinstance(instance, Post):
+        return
+    if action == 'pre_clear':
+        instance._cleared_tag_ids = list(instance.tags.values_list('pk', flat=True))
+        return
+    deltas = {'post_add': (pk_set, 1), 'post_remove': (pk_set, -1),
+              'post_clear': (instance.__dict__.pop('_cleared_tag_ids', ()), -1)}
+    if action in deltas and instance.status == 'published':
+        tag_ids, delta = deltas[action]
+        if tag_ids:
+            change_tag_counts(tag_ids, delta)
+
+
+@receiver(post_save, sender=Post)
+def update_tag_counts_on_status_change(sender, instance, created, **kwargs):
+    """
+    Публикация записи или снятие с публикации меняет количество у всех ее тегов
+    """
+    if created or not instance.field_changed('status'):
+        return
+    was_published = getattr(instance, '_loaded_status', None) == 'published'
+    if was_published == (instance.status == 'published'):
+        return
+    change_tag_counts(instance.tags.values_list('pk', flat=True), -1 if was_published else 1)
+
+
+@receiver(pre_delete, sender=Post)
+def update_tag_counts_on_post_delete(sender, instance, **kwargs):
+    """
+    Связи с тегами удаляются каскадом без m2m_changed, поэтому количество уменьшается до удаления
+    """
+    if Post.objects.filter(pk=instance.pk, status='published').exists():
+        change_tag_counts(instance.tags.values_list('pk', flat=True), -1)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def update_tag_index(sender, instance, **kwargs):
+    """
+    Тег перечитывается в картах тегов всех процессов после фиксации транзакции
+    """
+    tag_id = instance.pk
+    transaction.on_commit(lambda: record_tag_changes([tag_id]))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def invalidate_cached_posts_on_tag_change(sender, instance, created=False, **kwargs):
+    """
+    Записи в кэше объектов хранят названия своих тегов: при переименовании или удалении тега
+    сбрасываются только записи с этим тегом и страницы (теги есть в списках, на страницах записей и в облаке).
+    Новый тег еще ни у кого не стоит - сбрасывать нечего
+    """
+    if created:
+        return
+    post_ids = list(TaggedItem.objects.filter(tag_id=instance.pk, content_type=ContentType.objects.get_for_model(Post))
+                    .values_list('object_id', flat=True))
+
+    def invalidate():
+        Post.cached.invalidate_pks(post_ids)
+        bump_page_versions('site')
+
+    if post_ids:
+        transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Post)
+def update_related_on_post_change(sender, instance, created, **kwargs):
+    """
+    Похожие записи зависят от категории и статуса записи (и от тегов - см. ниже)
+    """
+    if created or instance.field_changed('status') or instance.field_changed('category_id'):
+        schedule_related_update(instance)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_related_on_tags_change(sender, instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, Post):
+        schedule_related_update(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def update_related_on_post_delete(sender, instance, **kwargs):
+    """
+    Строки со ссылкой на удаляемую запись удаляются каскадом - списки этих записей пересчитываются
+    """
+    post_ids = list(RelatedPost.objects.filter(related=instance).values_list('post_id', flat=True))
+    if post_ids:
+        schedule_related_ids(post_ids)
@@ -0,0 +1,66 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from apps.services.categories import category_tree
+from apps.services.fragments import hole_punching, render_user_fragment, user_fragment_placeholder
+from apps.services.post_views import popular_posts_html
+from apps.services.tags import tag_index
+from apps.services.thumbnails import responsive_sources
+
+register = template.Library()
+
+
+@register.simple_tag
+def category_sidebar():
+    """
+    Готовый блок дерева категорий из памяти процесса
+    """
+    return category_tree.get().sidebar_html
+
+
+@register.simple_tag
+def tag_cloud():
+    """
+    Готовое облако тегов из памяти процесса
+    """
+    return tag_index.get().cloud_html
+
+
+@register.simple_tag
+def popular_posts():
+    """
+    Готовый блок популярных сейчас записей из общего кэша
+    """
+    return popular_posts_html()
+
+
+@register.simple_tag(takes_context=True)
+def user_fragment(context, name, **params):
+    """
+    Персональный фрагмент страницы: сразу в шаблоне или заглушкой для подгрузки через JS,
+    чтобы сама страница оставалась общей для всех пользователей и кэшировалась
+    """
+    if hole_punching():
+        return user_fragment_placeholder(name, params)
+    return render_user_fragment(context['request'], name, params)
+
+
+@register.simple_tag
+def responsive_image(field_file, sizes='100vw', **attrs):
+    """
+    Изображение с уменьшенными копиями: <picture> с srcset WebP и JPEG и ленивой загрузкой.
+    Пока копии не готовы, выводится оригинал. Пример:
+    {% responsive_image post.thumbnail sizes='33vw' alt=post.title class='card-img-top' %}
+    """
+    if not field_file:
+        return ''
+    attributes = format_html_join(' ', '{}="{}"', attrs.items())
+    sources = responsive_sources(field_file)
+    if sources is None:
+        return format_html('<img src="{}" loading="lazy" decoding="async" {}>', field_file.url, attributes)
+    srcset, fallback = sources
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" loading="lazy" decoding="async" {}></picture>',
+        srcset['webp'], sizes, fallback, srcset['jpg'], sizes, attributes,
+    )
@@ -1,3 +1,932 @@
-from django.test import TestCase
+import hashlib
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .forms import CommentCreateForm
+from .models import Category, Comment, Post, Rating, RatingRollup, RelatedPost, TagCount
+from .views import PostByTagListView, PostFromCategory, PostListView
+from ..accounts.models import Profile
+from ..services import related
+from ..services.autocomplete import PrefixIndex
+from ..services.categories import CategoryTree, get_category_tree_version
+from ..services.comments import load_comment_page, load_comment_tree, render_comment_thread
+from ..services.html import render_body
+from ..services.mixins import CursorPaginationMixin
+from ..services.page_cache import bump_page_versions, cached_page
+from ..services.post_views import ViewCounter, popular_posts
+from ..services.presence import PresenceTracker, online_status
+from ..services.ratings import cast_vote
+from ..services.thumbnails import derivative_url, generate_derivatives, get_derivatives, responsive_sources
+from ..services.tiered_cache import TieredCache
+from ..services.utils import reserve_slugs
+from ..services.vote_buffer import VoteBuffer
+
+
+@override_settings(RELATED_POSTS_BACKGROUND=False, PAGE_CACHE_BACKGROUND_REBUILD=False)
+class BlogTestCase(TestCase):
+    """
+    Фоновые пересчеты (похожие записи, перестроение страниц) выполняются сразу: соединение другого потока не видит данных теста
+    и блокирует тестовую БД
+    """
+
+
+@override_settings(RELATED_POSTS_BACKGROUND=False, PAGE_CACHE_BACKGROUND_REBUILD=False)
+class BlogTransactionTestCase(TransactionTestCase):
+    """
+    То же для тестов с настоящими транзакциями
+    """
+
+
+class ListingQueryPlanTest(BlogTestCase):
+    """
+    Запросы списков записей идут по частичным индексам опубликованных записей
+    без временного B-дерева для сортировки (EXPLAIN QUERY PLAN, SQLite)
+    """
+    ordering = [f'-{field}' for field in CursorPaginationMixin.cursor_fields]
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author')
+        cls.root = Category.objects.create(title='Root', slug='root', description='-')
+        cls.leaf = Category.objects.create(title='Leaf', slug='leaf', description='-', parent=cls.root)
+        for number in range(30):
+            post = Post.objects.create(
+                title=f'Post {number}', description='-', text='-', author=author,
+                category=cls.leaf if number % 2 else cls.root,
+                status='draft' if number % 5 == 0 else 'published',
+            )
+            if number % 3 == 0:
+                post.tags.add('python')
+
+    def get_queryset(self, view_class, **kwargs):
+        view = view_class()
+        view.setup(RequestFactory().get('/'), **kwargs)
+        return view.get_queryset()
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexedWithoutSort(self, queryset, index):
+        plan = self.query_plan(queryset)
+        self.assertTrue(any(index in step for step in plan), plan)
+        self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+    def cursor_queryset(self, view_class, **kwargs):
+        """
+        Вторая страница навигации по курсору (условие "после последней записи")
+        """
+        queryset = self.get_queryset(view_class, **kwargs).order_by(*self.ordering)
+        mixin = CursorPaginationMixin()
+        token = mixin.encode_cursor(queryset[2])
+        return queryset.filter(mixin.cursor_filter(token, 'lt'))[:3]
+
+    def test_home(self):
+        queryset = self.get_queryset(PostListView)
+        self.assertIndexedWithoutSort(queryset.order_by(*self.ordering)[:3], 'post_published_list_idx')
+        self.assertIndexedWithoutSort(queryset[:3], 'post_published_list_idx')  # режим OFFSET (Meta.ordering)
+        self.assertIndexedWithoutSort(self.cursor_queryset(PostListView), 'post_published_list_idx')
+
+    def test_leaf_category(self):
+        queryset = self.get_queryset(PostFromCategory, slug='leaf').order_by(*self.ordering)[:3]
+        self.assertIndexedWithoutSort(queryset, 'post_published_category_idx')
+        self.assertIndexedWithoutSort(self.cursor_queryset(PostFromCategory, slug='leaf'),
+                                      'post_published_category_idx')
+
+    def test_category_subtree(self):
+        queryset = self.get_queryset(PostFromCategory, slug='root').order_by(*self.ordering)[:3]
+        self.assertIndexedWithoutSort(queryset, 'post_published_list_idx')
+        self.assertEqual(len(self.get_queryset(PostFromCategory, slug='root')), 24)
+
+    def test_tag(self):
+        queryset = self.get_queryset(PostByTagListView, tag='python').order_by(*self.ordering)[:3]
+        self.assertIndexedWithoutSort(queryset, 'post_published_list_idx')
+        self.assertIndexedWithoutSort(self.cursor_queryset(PostByTagListView, tag='python'),
+                                      'post_published_list_idx')
+
+    def test_feed(self):
+        self.assertIndexedWithoutSort(Post.custom.order_by('-update')[:5], 'post_published_feed_idx')
+
+    def test_listings_skip_drafts(self):
+        for view_class, kwargs in ((PostListView, {}), (PostFromCategory, {'slug': 'root'}),
+                                   (PostByTagListView, {'tag': 'python'})):
+            statuses = set(self.get_queryset(view_class, **kwargs).values_list('status', flat=True))
+            self.assertEqual(statuses, {'published'})
+
+
+class PostSearchTest(BlogTestCase):
+    """
+    Индекс FTS5 обновляется сигналами записей, результаты ранжируются и подсвечиваются
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        cls.post = Post.objects.create(title='Кэширование в Django', description='<p>Кэш <b>страниц</b></p>',
+                                       text='<p>Текст</p><p>про <script>alert(1)</script>SQLite &amp; Redis</p>',
+                                       author=author, category=category)
+        cls.other = Post.objects.create(title='Другое', description='-', text='<p>Немного про кэширование</p>',
+                                        author=author, category=category)
+
+    def search(self, query):
+        return list(Post.custom.search(query).order_by('-search_score', '-pk').values_list('pk', flat=True))
+
+    def test_ranking_and_word_forms(self):
+        self.assertEqual(self.search('кэширов'), [self.post.pk, self.other.pk])  # совпадение в названии выше
+        self.assertEqual(self.search('redis'), [self.post.pk])
+        self.assertEqual(self.search('alert'), [])  # содержимое скриптов не индексируется
+        self.assertEqual(self.search('" OR NEAR('), [])
+
+    def test_signals_keep_index_in_sync(self):
+        self.other.title = 'Новое название'
+        self.other.save()
+        self.assertEqual(self.search('новое'), [self.other.pk])
+        self.other.status = 'draft'
+        self.other.save()
+        self.assertEqual(self.search('новое'), [])
+        self.post.delete()
+        self.assertEqual(self.search('redis'), [])
+
+    def test_view_highlights_and_escapes(self):
+        response = self.client.get('/search/', {'q': 'sqlite'})
+        self.assertContains(response, '<mark>SQLite</mark> &amp; Redis')
+        self.assertNotContains(response, '<script>alert')
+
+
+class PrefixIndexTest(BlogTestCase):
+    """
+    Подсказки по началу любого слова названия, в т.ч. в транслитерации; изменения не нарушают порядок индекса
+    """
+
+    def setUp(self):
+        self.index = PrefixIndex([(1, 'Кэширование в Django', 'a'), (2, 'Ёлка: Python и SQLite', 'b')])
+
+    def search(self, prefix):
+        return [pk for pk, _label, _slug in self.index.search(prefix, 5)]
+
+    def assertSorted(self):
+        for block in (self.index.main, self.index.recent):
+            keys = [block.key(offset) for offset in block.offsets]
+            self.assertEqual(keys, sorted(keys))
+
+    def test_prefixes(self):
+        self.assertEqual(self.search('кэш'), [1])
+        self.assertEqual(self.search('keshir'), [1])
+        self.assertEqual(self.search('django'), [1])
+        self.assertEqual(self.search('елка python'), [2])
+        self.assertEqual(self.search('yolka'), [2])
+        self.assertEqual(self.search('sqlite'), [2])
+        self.assertEqual(self.search('ython'), [])
+
+    def test_add_and_remove(self):
+        self.index.add(1, 'Индексы SQLite', 'a')
+        self.index.add(3, 'Кэш страниц', 'c')
+        self.assertSorted()
+        self.assertEqual(self.search('кэш'), [3])
+        self.assertEqual(sorted(self.search('sqlite')), [1, 2])
+        self.index.remove(2)
+        self.assertSorted()
+        self.assertEqual(self.search('sqlite'), [1])
+        self.assertEqual((self.index.dead, len(self.index.recent_rows)), (2, 2))
+        self.index.compact()
+        self.assertSorted()
+        self.assertEqual(sorted(self.search('sqlite')), [1])
+        self.assertEqual(len(self.index.main.offsets), 8)  # по два слова в двух вариантах у записей 1 и 3
+
+
+class TagCountTest(BlogTestCase):
+    """
+    Количество опубликованных записей у тегов меняется на приращения при изменении тегов, статуса и удалении
+    """
+
+    def setUp(self):
+        author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        self.posts = [Post.objects.create(title=f'Post {number}', description='-', text='-', author=author,
+                                          category=category) for number in range(3)]
+        for post in self.posts:
+            post.tags.add('python', 'django')
+
+    def counts(self):
+        return dict(TagCount.objects.values_list('tag__name', 'posts'))
+
+    def test_incremental_counts(self):
+        self.assertEqual(self.counts(), {'python': 3, 'django': 3})
+        self.posts[0].tags.remove('django')
+        self.posts[1].tags.clear()
+        self.assertEqual(self.counts(), {'python': 2, 'django': 1})
+        self.posts[2].status = 'draft'
+        self.posts[2].save()
+        self.posts[2].tags.add('sqlite')  # у черновика не учитывается
+        self.assertEqual(self.counts(), {'python': 1, 'django': 0})
+        self.posts[0].delete()
+        self.posts[2].status = 'published'
+        self.posts[2].save()
+        self.assertEqual(self.counts(), {'python': 1, 'django': 1, 'sqlite': 1})
+
+
+class RelatedPostTest(BlogTestCase):
+    """
+    Похожие записи пересчитываются после фиксации транзакции при изменении тегов, статуса и удалении записи
+    """
+
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+        self.category = Category.objects.create(title='Root', slug='root', description='-')
+        self.other = Category.objects.create(title='Other', slug='other', description='-')
+
+    def create(self, number, category, *tags):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(title=f'Post {number}', description='-', text='-', author=self.author,
+                                       category=category)
+            post.tags.add(*tags)
+        return post
+
+    def related(self, post):
+        return list(RelatedPost.objects.filter(post=post).order_by('-score').values_list('related_id', flat=True))
+
+    def test_incremental_updates(self):
+        first = self.create(1, self.category, 'python', 'django')
+        second = self.create(2, self.other, 'python', 'django')
+        third = self.create(3, self.other, 'python')
+        self.assertEqual(self.related(first), [second.pk, third.pk])  # два общих тега весят больше одного
+        self.assertEqual(self.related(third), [second.pk, first.pk])  # та же категория добавляет сходство
+        with self.captureOnCommitCallbacks(execute=True):
+            second.status = 'draft'
+            second.save()
+        self.assertEqual(self.related(first), [third.pk])
+        self.assertEqual(self.related(second), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            third.delete()
+        self.assertEqual(self.related(first), [])
+
+    def test_background_retry(self):
+        """
+        Занятая БД - повтор; неудавшийся пересчет добавляется к следующему
+        """
+        error = OperationalError('database table is locked')
+        with mock.patch('apps.services.related.update_related', side_effect=[error, None]) as update, \
+                mock.patch('apps.services.related.time.sleep'), self.assertLogs('apps.services.related', 'WARNING'):
+            related._update_in_background([1])
+        self.assertEqual(update.call_count, 2)
+        with mock.patch('apps.services.related.update_related', side_effect=error), \
+                mock.patch('apps.services.related.time.sleep'), self.assertLogs('apps.services.related', 'ERROR'):
+            related._update_in_background([2])
+        with mock.patch('apps.services.related.update_related') as update:
+            related._update_in_background([3])
+        update.assert_called_once_with({2, 3})
+
+
+class ViewCounterTest(BlogTestCase):
+    """
+    Просмотры копятся в памяти без роботов, автора и повторов и сбрасываются в БД одним UPDATE
+    """
+    browser = 'Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0'
+
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        self.posts = [Post.objects.create(title=f'Post {number}', description='-', text='-', author=self.author,
+                                          category=category) for number in range(2)]
+        self.counter = ViewCounter(flush_interval=3600)
+        self.factory = RequestFactory()
+
+    def hit(self, post, user_agent=browser, ip='10.0.0.1', user=None):
+        request = self.factory.get(post.get_absolute_url(), HTTP_USER_AGENT=user_agent, REMOTE_ADDR=ip)
+        request.user = user or AnonymousUser()
+        self.counter.hit(request, post.slug)
+
+    def test_filtered_buffered_hits(self):
+        first, second = self.posts
+        self.hit(first)
+        self.hit(first)  # повтор того же посетителя
+        self.hit(first, ip='10.0.0.2')
+        self.hit(first, user_agent='Googlebot/2.1')
+        self.hit(first, user_agent='')
+        self.hit(first, user=self.author)  # автор своей записи
+        self.hit(second, ip='10.0.0.3')
+        self.assertEqual(Post.objects.get(pk=first.pk).views, 0)  # до сброса БД не трогаем
+
+        with self.assertNumQueries(1):  # один UPDATE счетчиков, кэш страниц и объектов не сбрасывается
+            self.assertEqual(self.counter.flush(), 3)
+        self.assertEqual(dict(Post.objects.values_list('pk', 'views')), {first.pk: 2, second.pk: 1})
+        self.assertEqual([post.pk for post in popular_posts()], [first.pk, second.pk])
+
+        Post.update_rating(first.pk, likes=1)
+        first.title = 'Renamed'
+        first.save()  # сохранение записи не затирает сброшенные просмотры и голоса
+        self.assertEqual(Post.objects.values_list('views', 'rating_sum').get(pk=first.pk), (2, 1))
+
+
+class HTMLSanitizerTest(BlogTestCase):
+    """
+    Ссылки с неразрешенной или неразбираемой схемой отбрасываются без ошибки
+    """
+
+    def test_unsafe_urls(self):
+        self.assertEqual(render_body('<a href="http://[">x</a><a href="javascript:alert(1)">y</a>'), '<a>x</a><a>y</a>')
+        self.assertEqual(render_body('<a href="https://example.com">z</a>'), '<a href="https://example.com">z</a>')
+
+    def test_image_size_from_style(self):
+        self.assertIn('width="300" height="200"',
+                      render_body('<img src="/x.png" style="max-width:10px; width: 300px;height:200px">'))
+        self.assertNotIn('width=', render_body('<img src="/x.png" style="max-width:10px;max-height:20px">'))
+
+
+class VoteBufferTest(BlogTransactionTestCase):
+    """
+    Сброс буфера голосов: счетчики по текущим строкам Rating, голос за удаленную запись не блокирует остальные
+    (настоящие транзакции - внешние ключи SQLite проверяются при фиксации)
+    """
+
+    def setUp(self):
+        author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        self.posts = [Post.objects.create(title=f'Post {number}', description='-', text='-', author=author,
+                                          category=category) for number in range(2)]
+
+    def counters(self, post):
+        return Post.objects.values_list('rating_likes', 'rating_dislikes', 'rating_sum').get(pk=post.pk)
+
+    def test_two_buffers_same_voter(self):
+        first, second = VoteBuffer(), VoteBuffer()
+        first.vote(self.posts[0].pk, 1, '10.0.0.1')
+        second.vote(self.posts[0].pk, 1, '10.0.0.1')  # другой процесс, тот же IP, base=None у обоих
+        first.flush()
+        second.flush()
+        self.assertEqual(self.counters(self.posts[0]), (1, 0, 1))
+        self.assertEqual(Rating.objects.count(), 1)
+
+    def test_failing_vote_is_dropped(self):
+        buffer = VoteBuffer()
+        buffer.vote(self.posts[0].pk, 1, '10.0.0.1')
+        buffer.vote(self.posts[1].pk, -1, '10.0.0.1')
+        self.posts[0].delete()
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.counters(self.posts[1]), (0, 1, -1))
+        self.assertEqual(buffer.flush(), 0)  # отброшенный голос не остается в буфере
+
+    def test_removed_vote_counted_once(self):
+        buffer = VoteBuffer()
+        buffer.vote(self.posts[0].pk, 1, '10.0.0.1')
+        buffer.flush()
+        self.assertEqual(buffer.vote(self.posts[0].pk, 1, '10.0.0.1'), ('deleted', 0))  # повторный голос снимает
+        buffer.flush()
+        self.assertEqual(self.counters(self.posts[0]), (0, 0, 0))  # post_delete не уменьшил счетчик второй раз
+        self.assertFalse(Rating.objects.exists())
+
+
+class RatingCounterTest(BlogTestCase):
+    """
+    Счетчики записи: перенос голоса на другую запись и каскадное удаление голосов вместе с пользователем
+    """
+
+    def setUp(self):
+        author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        self.posts = [Post.objects.create(title=f'Post {number}', description='-', text='-', author=author,
+                                          category=category) for number in range(2)]
+
+    def counters(self):
+        return list(Post.objects.order_by('pk').values_list('rating_likes', 'rating_dislikes', 'rating_sum'))
+
+    def test_move_and_cascade(self):
+        voter = User.objects.create(username='voter')
+        rating = Rating.objects.create(post=self.posts[0], user=voter, value=1, ip_address='10.0.0.1')
+        rating = Rating.objects.get(pk=rating.pk)
+        rating.post, rating.value = self.posts[1], -1
+        rating.save()
+        self.assertEqual(self.counters(), [(0, 0, 0), (0, 1, -1)])
+        voter.delete()
+        self.assertEqual(self.counters(), [(0, 0, 0), (0, 0, 0)])
+
+
+class PageCacheTest(BlogTestCase):
+    """
+    Кэш страниц: устаревшая копия отдается сразу и перестраивается один раз, пока держится блокировка;
+    страницу без копии при чужой блокировке запрос ждет, а не отрисовывает
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().get('/page/')
+        self.renders = 0
+
+    def render(self):
+        self.renders += 1
+        return HttpResponse(f'render {self.renders}')
+
+    def get(self):
+        response = cached_page(self.request, ('lists',), 300, self.render)
+        return response['X-Page-Cache'], response.content.decode()
+
+    def test_stale_served_while_rebuilt(self):
+        self.assertEqual(self.get(), ('miss', 'render 1'))
+        self.assertEqual(self.get(), ('hit', 'render 1'))
+        bump_page_versions('lists')
+        with mock.patch('apps.services.page_cache._submit_rebuild') as submit:
+            self.assertEqual(self.get(), ('stale', 'render 1'))
+            self.assertEqual(self.get(), ('stale', 'render 1'))
+        submit.assert_called_once()  # второй запрос не забрал блокировку
+        cache.clear()
+        self.get()
+        bump_page_versions('lists')
+        self.assertEqual(self.get(), ('stale', 'render 2'))  # перестроение (в тесте - сразу) после отдачи
+        self.assertEqual(self.get(), ('hit', 'render 3'))
+
+    def test_cold_miss_waits_for_lock_holder(self):
+        key = 'page:' + hashlib.md5(b'/page/').hexdigest()
+        cache.add(f'{key}:lock', 1)
+
+        def other_request_renders(seconds):
+            cache.set(key, {'versions': (0,), 'expires': time.time() + 300, 'content': b'other',
+                            'status': 200, 'content_type': 'text/html'})
+
+        with mock.patch('apps.services.page_cache.time.sleep', side_effect=other_request_renders):
+            self.assertEqual(self.get(), ('hit', 'other'))
+        self.assertEqual(self.renders, 0)
+
+
+class RatingCompactionTest(BlogTestCase):
+    """
+    Свертка старых голосов: строки переносятся в дневные агрегаты и хэши IP, счетчики записи не меняются,
+    а повторный голос с IP из свернутой истории не принимается
+    """
+
+    def test_compact_keeps_counters(self):
+        author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        post = Post.objects.create(title='Post', description='-', text='-', author=author, category=category)
+        Rating.objects.create(post=post, value=1, ip_address='10.0.0.1')
+        Rating.objects.create(post=post, value=-1, ip_address='10.0.0.2')
+        Rating.objects.create(post=post, value=1, ip_address='10.0.0.3')
+        Rating.objects.exclude(ip_address='10.0.0.3').update(time_create=timezone.now() - timedelta(days=400))
+
+        call_command('compact_ratings', days=365, stdout=StringIO())
+        self.assertEqual(list(Rating.objects.values_list('ip_address', flat=True)), ['10.0.0.3'])
+        self.assertEqual(list(RatingRollup.objects.values_list('likes', 'dislikes')), [(1, 1)])
+        self.assertEqual(Post.objects.values_list('rating_likes', 'rating_dislikes', 'rating_sum').get(), (2, 1, 1))
+        self.assertEqual(cast_vote(post.pk, 1, '10.0.0.1'), ('locked', 1))
+
+
+class ObjectCacheTest(BlogTestCase):
+    """
+    Кэш объектов: повторное чтение профиля (с пользователем) без запросов, изменение пользователя сбрасывает профиль
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_profile_with_user(self):
+        user = User.objects.create(username='reader')
+        slug = user.profile.slug
+        Profile.cached.get_cached(slug=slug)
+        with self.assertNumQueries(0):
+            self.assertEqual(Profile.cached.get_cached(slug=slug).user.username, 'reader')
+        user.username = 'writer'
+        user.save()
+        self.assertEqual(Profile.cached.get_cached(slug=slug).user.username, 'writer')
+
+
+@override_settings(COMMENTS_TREE_STORAGE='path')
+class CommentPathTest(BlogTestCase):
+    """
+    Дерево комментариев материализованным путем: вставка без MPTT, ответы по диапазону пути,
+    convert_comment_tree восстанавливает поля MPTT, слишком глубокий ответ не принимается
+    """
+
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        self.post = Post.objects.create(title='Post', description='-', text='-', author=self.author,
+                                        category=category)
+
+    def comment(self, parent=None):
+        return Comment.objects.create(post=self.post, author=self.author, content='-', parent=parent)
+
+    def test_paths_and_conversion(self):
+        root = self.comment()
+        first, second = self.comment(root), self.comment(root)
+        nested = self.comment(first)
+        self.assertEqual(nested.path, root.path + first.path[-Comment.PATH_STEP:] + Comment.path_segment(nested.pk))
+        self.assertEqual(nested.get_path_ancestor_ids(), [root.pk, first.pk])
+        replies, _cursor = load_comment_page(self.post.pk, root.pk)
+        self.assertEqual([(reply.pk, reply.reply_count) for reply in replies], [(first.pk, 1), (second.pk, 0)])
+
+        call_command('convert_comment_tree', stdout=StringIO())
+        root.refresh_from_db()
+        self.assertEqual(list(root.get_descendants().values_list('pk', flat=True)),
+                         [first.pk, nested.pk, second.pk])
+
+    def test_depth_limit(self):
+        parent = None
+        for _level in range(Comment.MAX_PATH_DEPTH):
+            parent = self.comment(parent)
+        form = CommentCreateForm({'content': '-', 'parent': parent.pk})
+        self.assertIn('parent', form.errors)
+        with self.assertRaises(ValueError):
+            self.comment(parent)
+
+
+class CastVoteTest(BlogTestCase):
+    """
+    Голос одним запросом: новый добавляется, противоположный заменяет, повторный такой же снимает голос
+    """
+
+    def test_vote_toggle(self):
+        author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        post = Post.objects.create(title='Post', description='-', text='-', author=author, category=category)
+        counters = Post.objects.filter(pk=post.pk).values_list('rating_likes', 'rating_dislikes', 'rating_sum')
+
+        self.assertEqual(cast_vote(post.pk, 1, '10.0.0.1'), ('created', 1))
+        self.assertEqual(cast_vote(post.pk, 1, '10.0.0.2'), ('created', 2))
+        self.assertEqual(cast_vote(post.pk, -1, '10.0.0.1'), ('updated', 0))
+        self.assertEqual(counters.get(), (1, 1, 0))
+        self.assertEqual(cast_vote(post.pk, -1, '10.0.0.1'), ('deleted', 1))
+        self.assertEqual(counters.get(), (1, 0, 1))
+        self.assertEqual(list(Rating.objects.values_list('ip_address', 'value')), [('10.0.0.2', 1)])
+        with self.assertRaises(Post.DoesNotExist):
+            cast_vote(post.pk + 1, 1, '10.0.0.1')
+
+
+@override_settings(COMMENTS_LAZY_LOAD=False)
+class CommentTreeTest(BlogTestCase):
+    """
+    Ветка комментариев записи: один запрос в порядке обхода дерева, отрисованный HTML из кэша
+    до нового комментария
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        self.post = Post.objects.create(title='Post', description='-', text='-', author=self.author,
+                                        category=category)
+
+    def comment(self, content, parent=None):
+        return Comment.objects.create(post=self.post, author=self.author, content=content, parent=parent)
+
+    def test_tree_and_cached_html(self):
+        first = self.comment('first')
+        reply = self.comment('reply', first)
+        nested = self.comment('nested', reply)
+        second = self.comment('second')
+        with self.assertNumQueries(1):
+            comments = load_comment_tree(self.post)
+        self.assertEqual(comments, [first, reply, nested, second])
+        self.assertEqual([comment.closing_tags.count('</ul>') for comment in comments], [0, 0, 3, 1])
+
+        html = render_comment_thread(self.post)
+        with self.assertNumQueries(0):
+            self.assertEqual(render_comment_thread(self.post), html)
+        self.comment('third')
+        self.assertIn('third', render_comment_thread(self.post))
+
+
+@override_settings(COMMENTS_PAGE_SIZE=2)
+class CommentThreadApiTest(BlogTestCase):
+    """
+    Ветка комментариев по частям: корневые комментарии страницами по курсору, ответы - отдельным запросом,
+    reply_count - число прямых ответов, некорректный курсор - 400
+    """
+
+    def test_pages_and_replies(self):
+        author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        post = Post.objects.create(title='Post', description='-', text='-', author=author, category=category)
+        roots = [Comment.objects.create(post=post, author=author, content=f'root {number}') for number in range(3)]
+        reply = Comment.objects.create(post=post, author=author, content='reply', parent=roots[0])
+        Comment.objects.create(post=post, author=author, content='nested', parent=reply)
+        url = reverse('blog:comment_thread_view', kwargs={'pk': post.pk})
+
+        page = self.client.get(url).json()
+        self.assertEqual([(item['id'], item['reply_count']) for item in page['comments']],
+                         [(roots[0].pk, 1), (roots[1].pk, 0)])
+        page = self.client.get(url, {'cursor': page['next_cursor']}).json()
+        self.assertEqual([item['id'] for item in page['comments']], [roots[2].pk])
+        self.assertIsNone(page['next_cursor'])
+        replies = self.client.get(url, {'parent': roots[0].pk}).json()['comments']
+        self.assertEqual([(item['id'], item['reply_count']) for item in replies], [(reply.pk, 1)])
+        self.assertEqual(self.client.get(url, {'cursor': 'x'}).status_code, 400)
+
+
+class CategoryTreeTest(BlogTestCase):
+    """
+    Дерево категорий в памяти процесса: счетчики записей вместе с подкатегориями, перестроение
+    только при смене общей версии
+    """
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create(username='author')
+        self.root = Category.objects.create(title='Root', slug='root', description='-')
+        self.leaf = Category.objects.create(title='Leaf', slug='leaf', description='-', parent=self.root)
+        for category, status in ((self.root, 'published'), (self.leaf, 'published'), (self.leaf, 'draft')):
+            Post.objects.create(title='Post', description='-', text='-', author=author, category=category,
+                                status=status)
+
+    @mock.patch('apps.services.categories.CATEGORY_TREE_CHECK_INTERVAL', 0)
+    def test_counts_and_rebuild(self):
+        tree = CategoryTree()
+        self.assertEqual([(node.slug, node.post_count) for node in tree.get().nodes], [('root', 2), ('leaf', 1)])
+        with self.assertNumQueries(0):
+            tree.get()
+        Category.objects.create(title='Other', slug='other', description='-')
+        self.assertEqual([node.slug for node in tree.get().nodes], ['other', 'root', 'leaf'])
+        self.assertIn('href="/category/leaf/"', tree.sidebar_html)
+
+
+class CategoryListingTest(BlogTestCase):
+    """
+    Записи категории вместе с подкатегориями одним запросом; дерево в сайдбаре сбрасывается
+    только при смене категории или статуса записи
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author')
+        self.root = Category.objects.create(title='Root', slug='root', description='-')
+        self.leaf = Category.objects.create(title='Leaf', slug='leaf', description='-', parent=self.root)
+        self.other = Category.objects.create(title='Other', slug='other', description='-')
+
+    def create(self, category):
+        return Post.objects.create(title='Post', description='-', text='-', author=self.author, category=category)
+
+    def test_subtree_posts(self):
+        in_root, in_leaf, _elsewhere = self.create(self.root), self.create(self.leaf), self.create(self.other)
+        root, leaf = Category.objects.get(slug='root'), Category.objects.get(slug='leaf')  # lft/rght и tree_id из БД
+        with self.assertNumQueries(1):
+            self.assertEqual({post.pk for post in Post.custom.in_category(root)}, {in_root.pk, in_leaf.pk})
+        self.assertEqual([post.pk for post in Post.custom.in_category(leaf)], [in_leaf.pk])
+
+    def test_tree_version_bumps(self):
+        post = self.create(self.leaf)
+        version = get_category_tree_version()
+        post.title = 'Renamed'
+        post.save()
+        Post.objects.only('title').get(pk=post.pk).save()
+        self.assertEqual(get_category_tree_version(), version)
+        post.category = self.other
+        post.save()
+        self.assertEqual(get_category_tree_version(), version + 1)
+
+
+@override_settings(POSTS_PAGINATION='cursor')
+class CursorPaginationTest(BlogTestCase):
+    """
+    Навигация по курсору: вперед (after) и назад (before) без пропусков и повторов при одинаковом времени
+    добавления (порядок уточняет pk), некорректный курсор - 404
+    """
+
+    def setUp(self):
+        author = User.objects.create(username='author')
+        category = Category.objects.create(title='Root', slug='root', description='-')
+        for number in range(5):
+            Post.objects.create(title=f'Post {number}', description='-', text='-', author=author, category=category)
+        Post.objects.update(create=timezone.now())  # одинаковое время у всех записей
+        Post.objects.filter(title='Post 3').update(fixed=True)
+        self.expected = list(Post.custom.order_by('-fixed', '-create', '-pk').values_list('pk', flat=True))
+
+    def page(self, **params):
+        view = PostListView()
+        view.setup(RequestFactory().get('/', params))
+        _paginator, page, rows, _is_paginated = view.paginate_queryset(view.get_queryset(), 2)
+        return page, [post.pk for post in rows]
+
+    def test_forward_and_back(self):
+        page, seen = self.page()
+        pages = [seen]
+        while page.next_cursor:
+            page, rows = self.page(after=page.next_cursor)
+            pages.append(rows)
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual(pages[-1], self.expected[4:])
+
+        page, rows = self.page(before=page.previous_cursor)
+        self.assertEqual(rows, pages[-2])
+        page, rows = self.page(before=page.previous_cursor)
+        self.assertEqual(rows, pages[0])
+        self.assertIsNone(page.previous_cursor)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(Http404):
+            self.page(after='not-a-cursor')
+
+
+class UserFragmentsTest(BlogTestCase):
+    """
+    Персональные фрагменты: параметры приводятся к объявленным типам, некорректные - 400;
+    при PAGE_CACHE_HOLE_PUNCHING авторизованный пользователь получает общую страницу из кэша
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reader')
+        self.url = reverse('blog:user_fragments')
+
+    def test_params(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, {'names': 'profile_edit', 'param-user_id': self.user.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Редактировать профиль', response.json()['profile_edit'])
+        self.assertIn('private', response['Cache-Control'])
+        for params in ({'param-user_id': 'abc'}, {'param-user_id': '-1'}, {}):
+            response = self.client.get(self.url, {'names': 'profile_edit', **params})
+            self.assertEqual(response.status_code, 400, params)
+
+    @override_settings(PAGE_CACHE_HOLE_PUNCHING=True)
+    def test_shared_page_for_logged_in_user(self):
+        self.client.get('/')
+        self.client.force_login(self.user)
+        response = self.client.get('/')
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertNotContains(response, 'reader')
+
+
+class TieredCacheTest(BlogTestCase):
+    """
+    Двухуровневый кэш: копия в памяти процесса выбрасывается, когда ключ меняет другой процесс
+    (два экземпляра бэкенда над одним файлом SQLite), add и incr атомарны в общем хранилище
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        params = {'OPTIONS': {'SYNC_INTERVAL': 0, 'LOCAL_MAX_ENTRIES': 10}}
+        location = os.path.join(directory.name, 'cache.sqlite3')
+        self.first, self.second = TieredCache(location, params), TieredCache(location, params)
+
+    def test_cross_process_invalidation(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')  # теперь и в памяти второго процесса
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+        self.second.set('other', 1)
+        self.first.clear()
+        self.assertIsNone(self.second.get('other'))
+
+    def test_add_and_incr(self):
+        self.assertTrue(self.first.add('counter', 1))
+        self.assertFalse(self.second.add('counter', 5))
+        self.assertEqual(self.second.incr('counter'), 2)
+        self.assertEqual(self.first.get('counter'), 2)
+        with self.assertRaises(ValueError):
+            self.first.incr('missing')
+
+
+class PresenceTrackerTest(BlogTestCase):
+    """
+    Присутствие: повторные отметки в пределах интервала не копятся, сброс - один UPDATE last_login
+    и одна запись в кэш, после него пользователь онлайн по кэшу
+    """
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('apps.services.presence.flusher')
+        self.flusher = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batched_heartbeats(self):
+        users = [User.objects.create(username=f'user{number}') for number in range(2)]
+        tracker = PresenceTracker(timeout=300, heartbeat_interval=60, flush_interval=3600)
+        for user in users + users:
+            tracker.heartbeat(user.pk)
+        self.flusher.register.assert_called_once_with(tracker, 3600)
+        self.assertEqual(len(tracker.pending([user.pk for user in users])), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(tracker.flush(), 2)
+        self.assertEqual(tracker.flush(), 0)
+        self.assertEqual(User.objects.filter(last_login__isnull=False).count(), 2)
+        self.assertEqual(online_status([users[0].pk, users[1].pk + 1]), {users[0].pk: True, users[1].pk + 1: False})
+
+
+class SlugHistoryTest(BlogTestCase):
+    """
+    SLUG создается один раз и не повторяется; при смене старый адрес отвечает 301 на новый
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author')
+        self.category = Category.objects.create(title='Root', slug='root', description='-')
+
+    def create(self, title):
+        return Post.objects.create(title=title, description='-', text='-', author=self.author, category=self.category)
+
+    def test_unique_and_stable(self):
+        first, second = self.create('Привет мир'), self.create('Привет мир')
+        self.assertEqual((first.slug, second.slug), ('privet-mir', 'privet-mir-2'))
+        first.title = 'Другое название'
+        first.save()
+        self.assertEqual(first.slug, 'privet-mir')
+        self.assertEqual(reserve_slugs(Post, ['Привет мир', 'Привет мир', 'Новая']),
+                         ['privet-mir-3', 'privet-mir-4', 'novaya'])
+
+    def test_old_slug_redirects(self):
+        post = self.create('Old title')
+        old_url = post.get_absolute_url()
+        post.slug = 'new-title'
+        post.save()
+        response = self.client.get(old_url)
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], post.get_absolute_url())
+        self.assertEqual(self.client.get(post.get_absolute_url()).status_code, 200)
+        post.slug = 'old-title'  # возврат к прежнему адресу убирает его из истории
+        post.save()
+        self.assertEqual(list(post.slug_history.values_list('slug', flat=True)), ['new-title'])
+
+
+class PostCardProjectionTest(BlogTestCase):
+    """
+    Списки записей выбирают только колонки карточки: полный текст не читается,
+    а отрисовка списка не догружает отложенные поля по записи
+    """
+
+    def setUp(self):
+        self.author = User.objects.create(username='author')
+        self.category = Category.objects.create(title='Root', slug='root', description='-')
+
+    def add_posts(self, count):
+        for number in range(count):
+            post = Post.objects.create(title=f'Post {number}', description='-', text='-', author=self.author,
+                                       category=self.category)
+            post.tags.add('python')
+
+    def list_queries(self):
+        self.client.get('/')  # прогрев сайдбара (дерево категорий, облако тегов)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/').status_code, 200)
+        return len(queries)
+
+    def test_cards(self):
+        sql = str(Post.custom.cards().query)
+        self.assertNotIn('"text"', sql)
+        self.assertNotIn('"text_html"', sql)
+        self.add_posts(2)
+        queries = self.list_queries()
+        self.add_posts(4)
+        self.assertEqual(self.list_queries(), queries)
+
+
+class ThumbnailTest(BlogTestCase):
+    """
+    Уменьшенные копии изображений: манифест с фактическими ширинами, srcset и пропуск неизмененных аватаров
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        os.makedirs(os.path.join(self.media_root, 'images'))
+        Image.new('RGB', (200, 100), 'red').save(os.path.join(self.media_root, 'images', 'photo.png'))
+
+    def test_derivatives(self):
+        self.assertTrue(generate_derivatives(self.media_root, 'images/photo.png', 'post'))
+        self.assertFalse(generate_derivatives(self.media_root, 'images/photo.png', 'post'))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'images', 'photo.post-200.webp')))
+        # Изображение уже самой маленькой ширины: одна копия его собственной ширины
+        self.assertEqual(get_derivatives('images/photo.png')['widths'], [200])
+
+        thumbnail = Post(thumbnail='images/photo.png').thumbnail
+        srcset, fallback = responsive_sources(thumbnail)
+        self.assertEqual(srcset['webp'], '/media/images/photo.post-200.webp 200w')
+        self.assertEqual(fallback, '/media/images/photo.post-200.jpg')
+        self.assertEqual(derivative_url(thumbnail, 640), '/media/images/photo.post-200.jpg')
+        self.assertEqual(derivative_url(Post(thumbnail='images/other.png').thumbnail, 640), '/media/images/other.png')
+
+    def test_unchanged_avatar_skipped(self):
+        user = User.objects.create(username='reader')
+        with mock.patch('apps.accounts.signals.schedule_derivatives') as schedule:
+            profile = Profile.objects.get(user=user)
+            profile.save()
+            Profile.objects.only('pk', 'user', 'slug').get(pk=profile.pk).save()
+            schedule.assert_not_called()
+            profile.avatar = 'images/photo.png'
+            profile.save()
+            profile.save()
+        schedule.assert_called_once()
@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import PostListView, PostDetailView, PostFromCategory, PostCreateView, PostUpdateView, CommentCreateView, \
-    PostByTagListView, RatingCreateView
+    PostByTagListView, PostSearchView, AutocompleteView, RatingCreateView, CommentThreadView, \
+    UserFragmentsView
 
 app_name = 'blog'
 
@@ -10,7 +11,11 @@ urlpatterns = [
     path('post/<str:slug>/', PostDetailView.as_view(), name='post_detail'),
     path('post/<str:slug>/update/', PostUpdateView.as_view(), name='post_update'),
     path('post/<int:pk>/comments/create/', CommentCreateView.as_view(), name='comment_create_view'),
+    path('post/<int:pk>/comments/', CommentThreadView.as_view(), name='comment_thread_view'),
     path('post/tags/<str:tag>/', PostByTagListView.as_view(), name='post_by_tags'),
     path('category/<str:slug>/', PostFromCategory.as_view(), name="post_by_category"),
+    path('search/', PostSearchView.as_view(), name='search'),
+    path('search/autocomplete/', AutocompleteView.as_view(), name='autocomplete'),
     path('rating/', RatingCreateView.as_view(), name='rating'),
+    path('fragments/', UserFragmentsView.as_view(), name='user_fragments'),
 ]
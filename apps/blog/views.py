@@ -1,4 +1,7 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_cache_control
 from django.shortcuts import redirect, render
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
@@ -10,10 +13,21 @@ from taggit.models import Tag
 
 from .forms import PostCreateForm, PostUpdateForm, CommentCreateForm
 from .models import Post, Category, Comment, Rating
-from ..services.mixins import AuthorRequiredMixin
-
-
-class PostByTagListView(ListView):
+from ..services.autocomplete import autocomplete
+from ..services.comments import render_comment_thread, load_comment_page, serialize_comment
+from ..services.fragments import USER_FRAGMENTS, render_user_fragment
+from ..services.mixins import AuthorRequiredMixin, CursorPaginationMixin, AnonymousPageCacheMixin
+from ..services.page_cache import post_group
+from ..services.post_views import current_views, view_counter
+from ..services.ratings import parse_vote, cast_vote
+from ..services.related import related_posts
+from ..services.search import highlight_html
+from ..services.tags import tag_index
+from ..services.utils import get_client_ip
+from ..services.vote_buffer import get_vote_buffer
+
+
+class PostByTagListView(AnonymousPageCacheMixin, CursorPaginationMixin, ListView):
     """
     Фильтрация по тегу
     """
@@ -24,8 +38,11 @@ class PostByTagListView(ListView):
     tag = None
 
     def get_queryset(self):
-        self.tag = Tag.objects.get(slug=self.kwargs['tag'])
-        queryset = Post.objects.filter(tags__slug=self.tag.slug)
+        try:
+            self.tag = tag_index.get().tag(self.kwargs['tag'])
+        except Tag.DoesNotExist:
+            raise Http404('Тег не найден')
+        queryset = Post.custom.cards().with_tag(self.tag)
         return queryset
 
     def get_context_data(self, **kwargs):
@@ -34,12 +51,12 @@ class PostByTagListView(ListView):
         return context
 
 
-class PostListView(ListView):
+class PostListView(AnonymousPageCacheMixin, CursorPaginationMixin, ListView):
     model = Post
     template_name = 'blog/post_list.html'
     context_object_name = 'posts'
     paginate_by = 3
-    queryset = Post.custom.all()  # Переопределение вызова модели
+    queryset = Post.custom.cards()  # Переопределение вызова модели: опубликованные записи, только поля карточки
 
     # get_context_data - может использоваться для передачи содержимого или параметров вне модели в шаблон
     def get_context_data(self, **kwargs):
@@ -72,45 +89,103 @@ class PostListView(ListView):
         return context
 
 
-class PostDetailView(DetailView):
+class PostDetailView(AnonymousPageCacheMixin, DetailView):
     model = Post
     # По умолчанию DetailView ищет шаблон с префиксом имени модели и суффиксом _detail.html
     template_name = 'blog/post_detail.html'
     context_object_name = 'post'  # переопределим имя Queryset по умолчанию
 
+    def get_object(self, queryset=None):
+        """
+        Запись из кэша объектов по slug (с автором и категорией)
+        """
+        try:
+            return Post.cached.get_cached(slug=self.kwargs['slug'])
+        except Post.DoesNotExist:
+            raise Http404('Запись не найдена')
+
+    def get(self, request, *args, **kwargs):
+        """
+        Старый адрес записи (SLUG из истории) - постоянный редирект на текущий
+        """
+        try:
+            return super().get(request, *args, **kwargs)
+        except Http404:
+            post = Post.objects.filter(slug_history__slug=self.kwargs['slug']).only('slug').first()
+            if post is None:
+                raise
+            return redirect(post, permanent=True)
+
+    def dispatch(self, request, *args, **kwargs):
+        """
+        Просмотр учитывается и для страницы из кэша: счетчик стоит перед кэшем страниц и копит просмотры в памяти
+        """
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            view_counter.hit(request, self.kwargs['slug'])
+        return response
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = self.object.title  # Переопределяем get_context_data для добавления в него ключа 'title'
         context['form'] = CommentCreateForm  # вывод нашей формы в шаблон, используя переменную {{ form }}
+        context['comments_thread'] = render_comment_thread(self.object)  # ветка комментариев из кэша
+        context['related_posts'] = related_posts(self.object)  # предвычисленные похожие записи, один запрос
+        context['views'] = current_views(self.object.pk)  # счетчик, сброшенный после кэширования объекта
         return context
 
+    def get_page_cache_groups(self):
+        return 'site', post_group(self.kwargs['slug'])
+
 
-class PostFromCategory(ListView):
+class PostFromCategory(AnonymousPageCacheMixin, CursorPaginationMixin, ListView):
     model = Post
     template_name = 'blog/post_list.html'
     context_object_name = 'posts'
     category = None
     paginate_by = 2
-    queryset = Post.custom.all()  # Переопределение вызова модели
+    queryset = Post.custom.cards()  # Переопределение вызова модели: опубликованные записи, только поля карточки
 
     def get_queryset(self):
+        """
+        Опубликованные записи категории и всех ее подкатегорий одним запросом
+        """
+        try:
+            self.category = Category.cached.get_cached(slug=self.kwargs['slug'])
+        except Category.DoesNotExist:
+            raise Http404('Категория не найдена')
+        return super().get_queryset().in_category(self.category)
 
-        # Так тоже можно
-        # self.category = Category.objects.get(slug=self.kwargs['slug'])
-        # queryset = super().get_queryset().filter(status='published')
-        # queryset = queryset.filter(category__slug=self.category.slug)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['title'] = f'Записи из категории: {self.category.title}'
+        return context
 
-        self.category = Category.objects.get(slug=self.kwargs['slug'])
-        queryset = Post.objects.filter(category__slug=self.category.slug)
 
-        if not queryset:
-            sub_cat = Category.objects.filter(parent=self.category)
-            queryset = Post.objects.filter(category__in=sub_cat)
-        return queryset
+class PostSearchView(AnonymousPageCacheMixin, CursorPaginationMixin, ListView):
+    """
+    Поиск по записям (?q=): результаты по убыванию релевантности, совпадения подсвечены
+    """
+    model = Post
+    template_name = 'blog/post_list.html'
+    context_object_name = 'posts'
+    paginate_by = 10
+    cursor_fields = ('search_score', 'pk')
+    cursor_types = (float, int)
+    query = ''
+
+    def get_queryset(self):
+        self.query = self.request.GET.get('q', '').strip()[:200]
+        return Post.custom.cards().search(self.query).order_by('-search_score', '-pk')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['title'] = f'Записи из категории: {self.category.title}'
+        context['title'] = f'Поиск: {self.query}' if self.query else 'Поиск'
+        context['search_query'] = self.query
+        context['posts'] = list(context['posts'])
+        for post in context['posts']:
+            post.search_title = highlight_html(post.search_title)
+            post.search_snippet = highlight_html(post.search_snippet)
         return context
 
 
@@ -201,16 +276,7 @@ class CommentCreateView(LoginRequiredMixin, CreateView):
         comment.save()
 
         if self.is_ajax():
-            return JsonResponse({
-                'is_child': comment.is_child_node(),
-                'id': comment.id,
-                'author': comment.author.username,
-                'parent_id': comment.parent_id,
-                'time_create': comment.time_create.strftime('%Y-%b-%d %H:%M:%S'),
-                'avatar': comment.author.profile.avatar.url,
-                'content': comment.content,
-                'get_absolute_url': comment.author.profile.get_absolute_url()
-            }, status=200)
+            return JsonResponse({'is_child': comment.is_child_node(), **serialize_comment(comment)}, status=200)
 
         return redirect(comment.post.get_absolute_url())
 
@@ -218,33 +284,76 @@ class CommentCreateView(LoginRequiredMixin, CreateView):
         return JsonResponse({'error': 'Необходимо авторизоваться для добавления комментариев'}, status=400)
 
 
+class CommentThreadView(View):
+    """
+    Представление: страница корневых комментариев записи или ответов на комментарий (?parent=id)
+    в виде JSON, постраничная навигация по курсору (?cursor=...)
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            parent_id = int(request.GET['parent']) if request.GET.get('parent') else None
+            cursor = request.GET.get('cursor') or None
+            comments, next_cursor = load_comment_page(self.kwargs.get('pk'), parent_id, cursor)
+        except ValueError:
+            return JsonResponse({'error': 'Некорректные параметры запроса'}, status=400)
+
+        return JsonResponse({
+            'comments': [serialize_comment(comment) for comment in comments],
+            'next_cursor': next_cursor,
+        })
+
+
 class RatingCreateView(View):
+    """
+    Представление: голосование за запись через JS (лайк - дизлайк)
+    """
     model = Rating
 
     def post(self, request, *args, **kwargs):
-        post_id = request.POST.get('post_id')
-        value = int(request.POST.get('value'))
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        ip = x_forwarded_for.split(',')[0] if x_forwarded_for else request.META.get('REMOTE_ADDR')
-        ip_address = ip
-        user = request.user if request.user.is_authenticated else None
-
-        rating, created = self.model.objects.get_or_create(
-           post_id=post_id,
-            ip_address=ip_address,
-            defaults={'value': value, 'user': user},
-        )
-
-        if not created:
-            if rating.value == value:
-                rating.delete()
-                return JsonResponse({'status': 'deleted', 'rating_sum': rating.post.get_sum_rating()})
-            else:
-                rating.value = value
-                rating.user = user
-                rating.save()
-                return JsonResponse({'status': 'updated', 'rating_sum': rating.post.get_sum_rating()})
-        return JsonResponse({'status': 'created', 'rating_sum': rating.post.get_sum_rating()})
+        vote = parse_vote(request.POST.get('post_id'), request.POST.get('value'))
+        if vote is None:
+            return JsonResponse({'error': 'Некорректные данные голоса'}, status=400)
+        post_id, value = vote
+        user_id = request.user.id if request.user.is_authenticated else None
+
+        # В режиме буфера голос пишется в БД фоновым сбросом, сумма считается по буферу
+        engine = get_vote_buffer().vote if settings.RATING_BUFFER_ENABLED else cast_vote
+        try:
+            status, rating_sum = engine(post_id, value, get_client_ip(request), user_id)
+        except Post.DoesNotExist:
+            return JsonResponse({'error': 'Запись не найдена'}, status=404)
+        return JsonResponse({'status': status, 'rating_sum': rating_sum})
+
+
+class AutocompleteView(View):
+    """
+    Подсказки поиска при вводе (?q=): названия записей, категорий и тегов из индекса в памяти процесса
+    """
+
+    def get(self, request, *args, **kwargs):
+        response = JsonResponse({'suggestions': autocomplete.suggest(request.GET.get('q', '')[:100])})
+        patch_cache_control(response, public=True, max_age=60)
+        return response
+
+
+class UserFragmentsView(View):
+    """
+    Представление: персональные фрагменты страницы (шапка пользователя, сообщения, форма комментария)
+    одним JSON ответом для заполнения общей закэшированной страницы через JS
+    """
+
+    def get(self, request, *args, **kwargs):
+        names = [name for name in request.GET.get('names', '').split(',') if name in USER_FRAGMENTS]
+        params = {key[len('param-'):]: value for key, value in request.GET.items() if key.startswith('param-')}
+        try:
+            fragments = {name: render_user_fragment(request, name, params) for name in names}
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        get_token(request)  # cookie csrftoken для форм во фрагментах и AJAX запросов страницы
+        response = JsonResponse(fragments)
+        patch_cache_control(response, private=True, no_store=True)
+        return response
 
 
 def tr_handler404(request, exception):
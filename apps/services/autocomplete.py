@@ -0,0 +1,294 @@
+import bisect
+import re
+import threading
+from array import array
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.urls import reverse
+from pytils.translit import TRANSTABLE
+
+AUTOCOMPLETE_VERSION_KEY = 'autocomplete-version'
+AUTOCOMPLETE_KEY_LENGTH = 32  # символов ключа: длиннее префиксы не набирают
+AUTOCOMPLETE_MAX_WORDS = 8  # с начала скольких слов названия ищется префикс
+AUTOCOMPLETE_MIN_LENGTH = 2  # подсказки начиная с двух символов
+# Перестроение индекса: мертвого текста больше доли индекса (но не меньше минимума) или недавних объектов
+# больше AUTOCOMPLETE_RECENT_MAX (блок недавних перестраивается при каждом изменении, ~10 мс на 500 названий)
+AUTOCOMPLETE_COMPACT_RATIO = 0.1
+AUTOCOMPLETE_COMPACT_MIN = 1000
+AUTOCOMPLETE_RECENT_MAX = 500
+# Таблица транслитерации pytils для str.translate (pytils.translify делает replace на каждую букву)
+TRANSLIT_TABLE = str.maketrans(dict(reversed(TRANSTABLE)))
+
+# Источники подсказок: модель, поле названия, маршрут страницы и фильтр (только опубликованные записи)
+AUTOCOMPLETE_SOURCES = {
+    'post': ('blog.Post', 'title', 'blog:post_detail', {'status': 'published'}),
+    'category': ('blog.Category', 'title', 'blog:post_by_category', {}),
+    'tag': ('taggit.Tag', 'name', 'blog:post_by_tags', {}),
+}
+
+
+def normalize(text):
+    """
+    Нижний регистр, ё -> е, слова через один пробел без знаков препинания
+    """
+    return ' '.join(re.findall(r'\w+', text.lower().replace('ё', 'е')))
+
+
+def index_variants(text):
+    """
+    Нормализованное название и его транслитерация по таблице pytils (если отличается)
+    """
+    normalized = normalize(text)
+    transliterated = normalize(text.lower().translate(TRANSLIT_TABLE))
+    return (normalized,) if transliterated == normalized else (normalized, transliterated)
+
+
+def word_starts(text):
+    """
+    Позиции начала первых AUTOCOMPLETE_MAX_WORDS слов каждой строки текста
+    """
+    starts, line_start = [], 0
+    for line in text.split('\n'):
+        position = line_start
+        for word in line.split(' ')[:AUTOCOMPLETE_MAX_WORDS]:
+            if word:
+                starts.append(position)
+            position += len(word) + 1
+        line_start += len(line) + 1
+    return starts
+
+
+def bisect_left_by_key(items, target, key):
+    """
+    bisect.bisect_left(items, target, key=key) без параметра key (он появился только в Python 3.10)
+    """
+    low, high = 0, len(items)
+    while low < high:
+        middle = (low + high) // 2
+        if key(items[middle]) < target:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class PrefixBlock:
+    """
+    Компактный неизменяемый префиксный индекс: нормализованные названия записаны подряд в одну строку corpus
+    (через перевод строки), а отсортированный массив offsets (array('q')) хранит позиции начала слов,
+    упорядоченные по тексту с этой позиции - урезанный суффиксный массив. Префикс ищется бинарным поиском
+    по offsets, затем читаются соседние позиции, пока не наберется limit разных объектов: O(log n + limit).
+    Владелец позиции определяется бинарным поиском по началам названий (starts/owners).
+    Объект, убранный из entries (discard), при поиске пропускается, его текст остается до перестроения
+    """
+
+    def __init__(self, rows=()):
+        self.entries = {}  # id -> (название, slug)
+        parts, offsets = [], array('q')
+        self.starts, self.owners = array('q'), array('q')
+        position = 0
+        for pk, label, slug in rows:
+            text = '\n'.join(index_variants(label)) + '\n'
+            offsets.extend(position + start for start in word_starts(text))
+            self.entries[pk] = (label, slug)
+            self.starts.append(position)
+            self.owners.append(pk)
+            parts.append(text)
+            position += len(text)
+        self.corpus = ''.join(parts)
+        self.offsets = array('q', sorted(offsets, key=self.key))
+
+    def key(self, offset, length=AUTOCOMPLETE_KEY_LENGTH):
+        """
+        Текст с позиции до конца строки названия (не длиннее length): порядок не зависит от соседних названий
+        """
+        end = self.corpus.find('\n', offset, offset + length)
+        return self.corpus[offset:end if end != -1 else offset + length]
+
+    def owner(self, offset):
+        return self.owners[bisect.bisect_right(self.starts, offset) - 1]
+
+    def discard(self, pk):
+        return self.entries.pop(pk, None) is not None
+
+    def search(self, prefix, limit):
+        found = {}
+        length = len(prefix)
+        position = bisect_left_by_key(self.offsets, prefix, key=lambda offset: self.key(offset, length))
+        while len(found) < limit and position < len(self.offsets) \
+                and self.corpus.startswith(prefix, self.offsets[position]):
+            pk = self.owner(self.offsets[position])
+            entry = self.entries.get(pk)
+            if entry is not None and pk not in found:
+                found[pk] = entry
+            position += 1
+        return [(pk, label, slug) for pk, (label, slug) in found.items()]
+
+
+class PrefixIndex:
+    """
+    Изменяемый префиксный индекс из двух блоков: основной (все объекты на момент построения) и небольшой
+    блок недавно добавленных и измененных объектов, который перестраивается целиком при каждом изменении.
+    Так добавление не копирует основной corpus. Удаленные и измененные объекты основного блока становятся
+    мертвым текстом; когда мертвых или недавних объектов больше порога (needs_compaction), индекс нужно
+    перестроить - compact() в памяти или полной загрузкой из БД
+    """
+
+    def __init__(self, rows=()):
+        self.main = PrefixBlock(rows)
+        self.recent_rows = {}  # id -> (название, slug) добавленных после построения
+        self.recent = PrefixBlock()
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.main.entries) + len(self.recent_rows)
+
+    @property
+    def needs_compaction(self):
+        return len(self.recent_rows) > AUTOCOMPLETE_RECENT_MAX \
+            or self.dead > max(AUTOCOMPLETE_COMPACT_MIN, len(self.main.entries) * AUTOCOMPLETE_COMPACT_RATIO)
+
+    def add(self, pk, label, slug):
+        if self.main.discard(pk):
+            self.dead += 1
+        self.recent_rows[pk] = (label, slug)
+        self._rebuild_recent()
+
+    def remove(self, pk):
+        if self.main.discard(pk):
+            self.dead += 1
+        if self.recent_rows.pop(pk, None) is not None:
+            self._rebuild_recent()
+
+    def compact(self):
+        """
+        Один основной блок из живых объектов, без мертвого текста
+        """
+        rows = {**self.main.entries, **self.recent_rows}
+        self.main = PrefixBlock((pk, label, slug) for pk, (label, slug) in rows.items())
+        self.recent_rows, self.recent, self.dead = {}, PrefixBlock(), 0
+
+    def _rebuild_recent(self):
+        self.recent = PrefixBlock((pk, label, slug) for pk, (label, slug) in self.recent_rows.items())
+
+    def search(self, prefix, limit):
+        """
+        Совпадения обоих блоков по алфавиту нормализованного названия, не больше limit
+        """
+        found = self.main.search(prefix, limit)
+        if self.recent_rows:
+            found = sorted(found + self.recent.search(prefix, limit), key=lambda item: normalize(item[1]))[:limit]
+        return found
+
+
+class Autocomplete:
+    """
+    Подсказки поиска по названиям записей, категорий и тегов из индексов в памяти процесса.
+    Индексы строятся при первом запросе к процессу и обновляются сигналами моделей после фиксации транзакции.
+    Изменения из других процессов видны по версии в общем кэше: при ее расхождении индексы
+    перестраиваются в фоновом потоке, а до замены отвечают прежние
+    """
+
+    def __init__(self, limit=5):
+        self.limit = limit
+        self.indexes = None
+        self.version = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._rebuilding = False
+
+    @staticmethod
+    def load(kind):
+        model_label, field, _route, filters = AUTOCOMPLETE_SOURCES[kind]
+        model = apps.get_model(model_label)
+        return model._base_manager.filter(**filters).values_list('pk', field, 'slug').iterator(chunk_size=5000)
+
+    def build(self):
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        version = cache.get(AUTOCOMPLETE_VERSION_KEY, 0)
+        indexes = {kind: PrefixIndex(self.load(kind)) for kind in AUTOCOMPLETE_SOURCES}
+        with self._lock:
+            self.indexes, self.version = indexes, version
+
+    def rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def rebuild():
+            try:
+                self.build()
+            finally:
+                self._rebuilding = False
+                connection.close()  # соединение с БД, открытое потоком
+
+        threading.Thread(target=rebuild, name='autocomplete-rebuild', daemon=True).start()
+
+    def ensure_fresh(self):
+        if self.indexes is None:
+            with self._build_lock:
+                if self.indexes is None:
+                    self._build()
+        elif cache.get(AUTOCOMPLETE_VERSION_KEY, 0) != self.version:
+            self.rebuild_in_background()
+
+    def suggest(self, query, limit=None):
+        """
+        Подсказки для введенного текста: [{'type', 'title', 'url'}], не больше limit каждого типа
+        """
+        prefix = normalize(query or '')[:AUTOCOMPLETE_KEY_LENGTH]
+        if len(prefix) < AUTOCOMPLETE_MIN_LENGTH:
+            return []
+        self.ensure_fresh()
+        with self._lock:  # update() меняет индексы из другого потока
+            found = {kind: index.search(prefix, limit or self.limit) for kind, index in self.indexes.items()}
+        suggestions = []
+        for kind, items in found.items():
+            route = AUTOCOMPLETE_SOURCES[kind][2]
+            suggestions.extend({'type': kind, 'title': label, 'url': reverse(route, args=[slug])}
+                               for _pk, label, slug in items)
+        return suggestions
+
+    def update(self, kind, pk, label=None, slug=None):
+        """
+        Изменение одного объекта (label=None - удаление) в индексе процесса и новая общая версия для остальных.
+        Если версия сдвинулась больше чем на единицу, были изменения из других процессов, или в индексе накопилось
+        много мертвого текста - индекс перестраивается
+        """
+        try:
+            version = cache.incr(AUTOCOMPLETE_VERSION_KEY)
+        except ValueError:
+            cache.add(AUTOCOMPLETE_VERSION_KEY, 0, None)
+            version = cache.incr(AUTOCOMPLETE_VERSION_KEY)
+        if self.indexes is None:
+            return
+        with self._lock:
+            index = self.indexes[kind]
+            if label is None:
+                index.remove(pk)
+            else:
+                index.add(pk, label, slug)
+            in_sync, self.version = self.version == version - 1, version
+            compact = index.needs_compaction
+        if not in_sync or compact:
+            self.rebuild_in_background()
+
+    def update_instance(self, kind, instance, deleted=False):
+        """
+        Обновление из сигналов моделей после фиксации транзакции; объект, не проходящий фильтр источника
+        (неопубликованная запись), удаляется из подсказок
+        """
+        _model, field, _route, filters = AUTOCOMPLETE_SOURCES[kind]
+        visible = not deleted and all(getattr(instance, name) == value for name, value in filters.items())
+        label, pk, slug = getattr(instance, field) if visible else None, instance.pk, instance.slug
+        transaction.on_commit(lambda: self.update(kind, pk, label, slug))
+
+
+autocomplete = Autocomplete(limit=getattr(settings, 'AUTOCOMPLETE_LIMIT', 5))
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from apps.blog.models import Category, Post
+
+CATEGORY_TREE_VERSION_KEY = 'category-tree-version'
+CATEGORY_TREE_CHECK_INTERVAL = 1  # как часто (сек) процесс сверяет свою копию с общей версией
+
+
+class CategoryTree:
+    """
+    Дерево категорий, предвычисленное в памяти процесса: узлы в порядке обхода с готовыми URL,
+    количеством опубликованных записей (вместе с подкатегориями) и отрисованный блок сайдбара.
+    Копия сверяется с общей версией в кэше, которую меняют сигналы сохранения, переноса и удаления
+    категорий, поэтому сбрасывается во всех процессах.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0
+        self.nodes = []
+        self.sidebar_html = ''
+
+    def get(self):
+        """
+        Актуальное дерево (перестраивается только при смене общей версии)
+        """
+        now = time.monotonic()
+        if now - self._checked >= CATEGORY_TREE_CHECK_INTERVAL:
+            version = get_category_tree_version()
+            if version != self._version:
+                with self._lock:
+                    if version != self._version:
+                        self._build(version)
+            self._checked = now
+        return self
+
+    def _build(self, version):
+        nodes = list(Category.objects.order_by('tree_id', 'lft'))
+        for node, next_node in zip(nodes, nodes[1:] + [None]):
+            next_level = next_node.level if next_node is not None else 0
+            node.url = node.get_absolute_url()
+            # После узла открывается список детей или закрываются законченные уровни
+            node.after = mark_safe('<ul>' if next_level > node.level else '</ul>' * (node.level - next_level))
+        self._count_posts(nodes)
+        self.sidebar_html = render_to_string('blog/categories/category_tree.html', {'categories': nodes})
+        self.nodes = nodes
+        self._version = version
+
+    @staticmethod
+    def _count_posts(nodes):
+        """
+        Количество опубликованных записей в категории и всех ее потомках: один агрегирующий запрос,
+        затем суммирование снизу вверх (обратный порядок обхода - дети раньше родителей)
+        """
+        direct = dict(
+            Post.custom.order_by().values_list('category_id').annotate(total=Count('pk'))
+        )
+        by_id = {node.pk: node for node in nodes}
+        for node in nodes:
+            node.post_count = direct.get(node.pk, 0)
+        for node in reversed(nodes):
+            if node.parent_id in by_id:
+                by_id[node.parent_id].post_count += node.post_count
+
+
+category_tree = CategoryTree()
+
+
+def get_category_tree_version():
+    return cache.get_or_set(CATEGORY_TREE_VERSION_KEY, 1, None)
+
+
+def bump_category_tree_version():
+    """
+    Новая версия дерева категорий - все процессы перестроят свои копии
+    """
+    try:
+        cache.incr(CATEGORY_TREE_VERSION_KEY)
+    except ValueError:
+        cache.set(CATEGORY_TREE_VERSION_KEY, 2, None)
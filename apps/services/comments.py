@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from apps.blog.models import Comment
+from apps.services.thumbnails import derivative_url
+
+COMMENTS_CACHE_TIMEOUT = 60 * 60  # профили авторов в ветке могут меняться, поэтому не бессрочно
+
+
+def comments_version_key(post_id):
+    return f'comments-version-{post_id}'
+
+
+def get_comments_version(post_id):
+    """
+    Текущая версия комментариев записи (часть ключа кэша отрисованной ветки)
+    """
+    return cache.get_or_set(comments_version_key(post_id), 1, None)
+
+
+def bump_comments_version(post_id):
+    """
+    Новая версия комментариев записи - ранее отрисованные ветки больше не используются
+    """
+    try:
+        cache.incr(comments_version_key(post_id))
+    except ValueError:
+        cache.set(comments_version_key(post_id), 2, None)
+
+
+def path_storage():
+    """
+    Дерево комментариев хранится материализованным путем (COMMENTS_TREE_STORAGE = 'path'), а не MPTT
+    """
+    return settings.COMMENTS_TREE_STORAGE == 'path'
+
+
+def subtree_filter(path):
+    """
+    Условие выборки всех потомков узла по индексу (post, path): диапазон вместо LIKE
+    """
+    return {'path__gt': path, 'path__lt': path + '~'}
+
+
+def load_comment_tree(post):
+    """
+    Все комментарии записи одним запросом (с автором и профилем) в порядке обхода дерева.
+    Вместо рекурсии у каждого узла есть closing_tags - сколько веток закрывается после него
+    """
+    tree_order = ('path',) if path_storage() else ('tree_id', 'lft')
+    comments = list(
+        Comment.objects.filter(post=post)
+        .select_related('author', 'author__profile')
+        .order_by(*tree_order)
+    )
+    for node, next_node in zip(comments, comments[1:] + [None]):
+        next_level = next_node.level if next_node is not None else 0
+        node.closing_tags = mark_safe('</ul>' * (node.level - next_level + 1))
+    return comments
+
+
+def load_comment_page(post_id, parent_id=None, cursor=None, limit=None):
+    """
+    Страница корневых комментариев записи или прямых ответов на комментарий parent_id.
+    MPTT: корни по tree_id, ответы по диапазону lft/rght внутри tree_id (курсор - lft).
+    Материализованный путь: корни по pk, ответы по диапазону пути (курсор - path).
+    Возвращает (комментарии с reply_count - числом прямых ответов, курсор следующей страницы или None),
+    для некорректного курсора - ValueError
+    """
+    limit = limit or settings.COMMENTS_PAGE_SIZE
+    by_path = path_storage()
+    queryset = Comment.objects.filter(post_id=post_id).select_related('author', 'author__profile')
+    if parent_id is None:
+        cursor_field = 'pk' if by_path else 'tree_id'
+        queryset = queryset.filter(level=0)
+    else:
+        parent = Comment.objects.filter(pk=parent_id, post_id=post_id).values(
+            'tree_id', 'lft', 'rght', 'level', 'path').first()
+        if parent is None:
+            return [], None
+        if by_path:
+            cursor_field = 'path'
+            queryset = queryset.filter(level=parent['level'] + 1, **subtree_filter(parent['path']))
+        else:
+            cursor_field = 'lft'
+            queryset = queryset.filter(
+                tree_id=parent['tree_id'], lft__gt=parent['lft'], rght__lt=parent['rght'], level=parent['level'] + 1)
+    if cursor is not None:
+        cursor = str(cursor) if cursor_field == 'path' else int(cursor)
+        queryset = queryset.filter(**{f'{cursor_field}__gt': cursor})
+
+    comments = list(queryset.order_by(cursor_field)[:limit + 1])
+    next_cursor = getattr(comments[limit - 1], cursor_field) if len(comments) > limit else None
+    comments = comments[:limit]
+    set_reply_counts(comments)
+    return comments, next_cursor
+
+
+def set_reply_counts(comments):
+    """
+    Количество прямых ответов (их и подгружает кнопка "Ответы") для страницы комментариев одним запросом
+    по индексу parent_id - одинаково для MPTT и материализованного пути
+    """
+    if not comments:
+        return
+    counts = dict(
+        Comment.objects.filter(parent_id__in=[comment.pk for comment in comments])
+        .order_by()
+        .values('parent_id')
+        .annotate(total=Count('pk'))
+        .values_list('parent_id', 'total')
+    )
+    for comment in comments:
+        comment.reply_count = counts.get(comment.pk, 0)
+
+
+def serialize_comment(comment):
+    """
+    Комментарий в виде словаря для JSON ответов
+    """
+    return {
+        'id': comment.id,
+        'author': comment.author.username,
+        'author_id': comment.author_id,
+        'parent_id': comment.parent_id,
+        'time_create': comment.time_create.strftime('%Y-%b-%d %H:%M:%S'),
+        'avatar': derivative_url(comment.author.profile.avatar, 100),
+        'content': comment.content,
+        'get_absolute_url': comment.author.profile.get_absolute_url(),
+        'reply_count': getattr(comment, 'reply_count', 0),
+    }
+
+
+def render_comment_thread(post):
+    """
+    Отрисованная ветка комментариев записи из кэша, ключ зависит от версии комментариев.
+    При COMMENTS_LAZY_LOAD отрисовывается только первая страница корневых комментариев,
+    остальное подгружается через JS по запросу читателя
+    """
+    lazy = settings.COMMENTS_LAZY_LOAD
+    cache_key = f'comments-html-{post.pk}-{get_comments_version(post.pk)}-{"lazy" if lazy else "full"}'
+    html = cache.get(cache_key)
+    if html is None:
+        context = {'lazy': lazy}
+        if lazy:
+            context['comments'], context['next_cursor'] = load_comment_page(post.pk)
+            for node in context['comments']:
+                node.closing_tags = mark_safe('</ul>')
+        else:
+            context['comments'] = load_comment_tree(post)
+        html = render_to_string('blog/comments/comments_thread.html', context)
+        cache.set(cache_key, html, COMMENTS_CACHE_TIMEOUT)
+    return html
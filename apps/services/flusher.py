@@ -0,0 +1,73 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher:
+    """
+    Один фоновый поток процесса, который вызывает flush() зарегистрированных буферов (счетчик просмотров,
+    отметки присутствия) каждый их интервал, даже если в процесс больше не приходят запросы.
+    При завершении процесса поток останавливается и буферы сбрасываются последний раз (atexit).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._targets = {}  # буфер -> (интервал, time.monotonic() следующего сброса)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def register(self, target, interval):
+        """
+        Периодический сброс буфера; поток запускается при первой регистрации
+        """
+        with self._lock:
+            if target in self._targets:
+                return
+            self._targets[target] = (interval, time.monotonic() + interval)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='periodic-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Остановка потока и финальный сброс всех буферов
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        with self._lock:
+            targets = list(self._targets)
+        for target in targets:
+            self._flush(target)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due = [target for target, (_interval, next_at) in self._targets.items() if next_at <= now]
+                for target in due:
+                    interval = self._targets[target][0]
+                    self._targets[target] = (interval, now + interval)
+                wait = min(next_at for _interval, next_at in self._targets.values()) - now
+            for target in due:
+                self._flush(target)
+            if self._stopped.wait(max(wait, 0.1)):
+                return
+
+    @staticmethod
+    def _flush(target):
+        try:
+            target.flush()
+        except Exception:
+            logger.exception('Ошибка периодического сброса %s', type(target).__name__)
+        finally:
+            close_old_connections()
+
+
+flusher = PeriodicFlusher()
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.html import format_html, format_html_join
+
+def positive_int(value):
+    """
+    pk объекта из параметра запроса: целое больше нуля (как конвертер <int:...> в адресах)
+    """
+    number = int(value)
+    if number <= 0:
+        raise ValueError(value)
+    return number
+
+
+# Персональные фрагменты страниц: имя -> (шаблон, параметры и их типы).
+# Параметры фрагмента приводятся к типу и передаются в контекст шаблона
+USER_FRAGMENTS = {
+    'header_user': ('includes/header_user.html', {}),
+    'messages': ('includes/messages.html', {}),
+    'comment_form': ('blog/comments/comment_form.html', {'post_id': positive_int}),
+    'profile_edit': ('accounts/profile_edit_link.html', {'user_id': positive_int}),
+}
+
+
+def clean_fragment_params(name, params):
+    """
+    Объявленные параметры фрагмента, приведенные к своим типам; лишние отбрасываются.
+    Отсутствующий или некорректный параметр - ValueError
+    """
+    cleaned = {}
+    for param, kind in USER_FRAGMENTS[name][1].items():
+        if param not in params:
+            raise ValueError(f'Фрагмент {name}: нет параметра {param}')
+        try:
+            cleaned[param] = kind(params[param])
+        except (TypeError, ValueError):
+            raise ValueError(f'Фрагмент {name}: некорректный параметр {param}')
+    return cleaned
+
+
+def hole_punching():
+    """
+    Страницы отдаются общей оболочкой, персональные фрагменты подгружаются через JS
+    """
+    return settings.PAGE_CACHE_HOLE_PUNCHING
+
+
+def render_user_fragment(request, name, params):
+    """
+    Отрисовка персонального фрагмента для пользователя запроса (ValueError - см. clean_fragment_params)
+    """
+    from apps.blog.forms import CommentCreateForm
+
+    context = clean_fragment_params(name, params)
+    if name == 'comment_form':
+        context['form'] = CommentCreateForm
+    elif name == 'profile_edit':
+        context['is_owner'] = request.user.is_authenticated and request.user.pk == context['user_id']
+    return render_to_string(USER_FRAGMENTS[name][0], context, request=request)
+
+
+def user_fragment_placeholder(name, params):
+    """
+    Пустой блок-заглушка в общей оболочке страницы, заполняется fragments.js
+    """
+    attrs = format_html_join(' ', 'data-param-{}="{}"', ((key, value) for key, value in params.items()))
+    return format_html('<div data-user-fragment="{}" {}></div>', name, attrs)
@@ -0,0 +1,189 @@
+import os
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils.text import Truncator
+
+POST_EXCERPT_LENGTH = 500  # символов текста в анонсе (description ограничен 500 символами разметки)
+
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'code', 'div', 'em', 'figcaption', 'figure', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
+    'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'sup', 'table', 'tbody', 'td', 'th', 'thead',
+    'tr', 'u', 'ul',
+}
+EXCERPT_TAGS = ALLOWED_TAGS - {'img', 'figure', 'figcaption', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'hr'}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title', 'target'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+URL_SCHEMES = {'', 'http', 'https', 'mailto'}
+VOID_TAGS = {'br', 'hr', 'img'}
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'noscript', 'template'}
+# Размеры изображения из style редактора: только свойства width/height целиком (не max-width и т.п.)
+STYLE_SIZE = re.compile(r'(?:^|;)\s*(width|height)\s*:\s*(\d+)px')
+
+
+def image_size(src):
+    """
+    Размер загруженного изображения из MEDIA_ROOT по его адресу или None
+    """
+    if not src.startswith(settings.MEDIA_URL):
+        return None
+    path = os.path.join(settings.MEDIA_ROOT, src[len(settings.MEDIA_URL):])
+    try:
+        from PIL import Image
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, ValueError):
+        return None
+
+
+def safe_url(value):
+    """
+    Ссылка с разрешенной схемой; неразбираемый адрес (например, http://[) отбрасывается
+    """
+    try:
+        return urlsplit(value.strip()).scheme.lower() in URL_SCHEMES
+    except ValueError:
+        return False
+
+
+class HTMLSanitizer(HTMLParser):
+    """
+    Очистка HTML из CKEditor по белому списку тегов и атрибутов:
+    скрипты и обработчики событий удаляются, незакрытые теги закрываются,
+    изображения получают loading="lazy" и размеры (из style редактора или из файла)
+    """
+
+    def __init__(self, tags=ALLOWED_TAGS):
+        super().__init__(convert_charrefs=True)
+        self.tags = tags
+        self.output = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in self.tags:
+            return
+        attributes = self.clean_attributes(tag, dict(attrs))
+        if tag == 'img':
+            if not attributes.get('src'):
+                return
+            attributes.update(self.image_attributes(attrs, attributes))
+        rendered = ''.join(f' {name}="{escape(value)}"' for name, value in attributes.items())
+        self.output.append(f'<{tag}{rendered}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.open_tags and self.open_tags[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        while self.open_tags:
+            current = self.open_tags.pop()
+            self.output.append(f'</{current}>')
+            if current == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.output.append(escape(data, quote=False))
+
+    @staticmethod
+    def clean_attributes(tag, attrs):
+        attributes = {}
+        for name in ALLOWED_ATTRIBUTES.get(tag, ()):
+            value = attrs.get(name)
+            if value is None:
+                continue
+            if name in URL_ATTRIBUTES and not safe_url(value):
+                continue
+            attributes[name] = value
+        if tag == 'a' and attributes.get('target') == '_blank':
+            attributes['rel'] = 'noopener noreferrer'
+        return attributes
+
+    @staticmethod
+    def image_attributes(attrs, attributes):
+        extra = {'loading': 'lazy', 'decoding': 'async'}
+        if 'width' not in attributes or 'height' not in attributes:
+            sizes = dict(STYLE_SIZE.findall(dict(attrs).get('style') or ''))
+            if 'width' in sizes and 'height' in sizes:
+                extra.update(width=sizes['width'], height=sizes['height'])
+            else:
+                size = image_size(attributes['src'])
+                if size:
+                    extra.update(width=str(size[0]), height=str(size[1]))
+        return extra
+
+    def result(self):
+        self.close()
+        return ''.join(self.output + [f'</{tag}>' for tag in reversed(self.open_tags)])
+
+
+class TextExtractor(HTMLSanitizer):
+    """
+    Текст без разметки (для поискового индекса): теги заменяются пробелами, чтобы слова
+    соседних абзацев не склеивались, содержимое скриптов и стилей отбрасывается
+    """
+
+    def __init__(self):
+        super().__init__(tags=set())
+
+    def handle_starttag(self, tag, attrs):
+        super().handle_starttag(tag, attrs)
+        self.output.append(' ')
+
+    def handle_endtag(self, tag):
+        super().handle_endtag(tag)
+        self.output.append(' ')
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.output.append(data)
+
+    def result(self):
+        self.close()
+        return ' '.join(''.join(self.output).split())
+
+
+def plain_text(html):
+    extractor = TextExtractor()
+    extractor.feed(html or '')
+    return extractor.result()
+
+
+def sanitize_html(html, tags=ALLOWED_TAGS):
+    sanitizer = HTMLSanitizer(tags)
+    sanitizer.feed(html or '')
+    return sanitizer.result()
+
+
+def render_excerpt(html, length=POST_EXCERPT_LENGTH):
+    """
+    Анонс для карточек и RSS: очищенный HTML без изображений и таблиц, не длиннее length символов текста
+    """
+    return Truncator(sanitize_html(html, EXCERPT_TAGS)).chars(length, html=True)
+
+
+def render_body(html):
+    """
+    Полный текст для страницы записи: очищенный HTML с ленивой загрузкой изображений
+    """
+    return sanitize_html(html)
@@ -1,8 +1,19 @@
 # Abstract CBV mixin - дает миксинам доступа настраиваемую функциональность
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
 from django.contrib.auth.mixins import AccessMixin
 from django.contrib import messages
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404
 from django.shortcuts import redirect
 
+from apps.services.fragments import hole_punching
+from apps.services.page_cache import cached_page
+
 
 class AuthorRequiredMixin(AccessMixin):
     """
@@ -17,3 +28,143 @@ class AuthorRequiredMixin(AccessMixin):
                 messages.info(request, 'Изменение статьи доступно только автору!')
                 return redirect('home')
         return super().dispatch(request, *args, **kwargs)
+
+    def get_object(self, queryset=None):
+        """
+        Объект загружается один раз: проверка автора в dispatch и UpdateView используют одну копию
+        """
+        if queryset is not None:
+            return super().get_object(queryset)
+        if getattr(self, '_author_object', None) is None:
+            self._author_object = super().get_object()
+        return self._author_object
+
+
+class CursorPage:
+    """
+    Страница при навигации по курсору: записи и курсоры соседних страниц, без номера и общего количества
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginationMixin:
+    """
+    Навигация по курсору (keyset) для ListView записей: следующая страница выбирается
+    условием "после последней записи" по сортировке (-fixed, -create, -pk) и индексу,
+    без OFFSET и без COUNT(*) на каждой странице. Режим OFFSET - POSTS_PAGINATION = 'offset'.
+    Приблизительное общее количество кэшируется на approx_total_timeout секунд.
+    cursor_types - преобразование значений курсора из JSON для каждого поля cursor_fields.
+    """
+    cursor_fields = ('fixed', 'create', 'pk')
+    cursor_types = (bool, datetime.fromisoformat, int)
+    approx_total_timeout = 300
+
+    def get_cursor_pagination(self):
+        return settings.POSTS_PAGINATION == 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.get_cursor_pagination():
+            return super().paginate_queryset(queryset, page_size)
+
+        after, before = self.request.GET.get('after'), self.request.GET.get('before')
+        ordering = [f'-{field}' for field in self.cursor_fields]
+        if before:
+            queryset = queryset.filter(self.cursor_filter(before, 'gt')).order_by(*[field[1:] for field in ordering])
+            rows = list(queryset[:page_size + 1])
+            has_more, rows = len(rows) > page_size, rows[:page_size][::-1]
+            page = CursorPage(rows, next_cursor=self.encode_cursor(rows[-1]) if rows else None,
+                              previous_cursor=self.encode_cursor(rows[0]) if has_more else None)
+        else:
+            if after:
+                queryset = queryset.filter(self.cursor_filter(after, 'lt'))
+            rows = list(queryset.order_by(*ordering)[:page_size + 1])
+            has_more, rows = len(rows) > page_size, rows[:page_size]
+            page = CursorPage(rows, next_cursor=self.encode_cursor(rows[-1]) if has_more else None,
+                              previous_cursor=self.encode_cursor(rows[0]) if after and rows else None)
+        return None, page, page.object_list, page.has_other_pages()
+
+    def get_pagination_query(self):
+        """
+        Параметры запроса кроме номера страницы и курсора (например, ?q= поиска) для ссылок навигации
+        """
+        query = self.request.GET.copy()
+        for name in ('page', 'after', 'before'):
+            query.pop(name, None)
+        return query.urlencode()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.get_pagination_query()
+        context['pagination_query'] = f'&{query}' if query else ''
+        if self.get_cursor_pagination():
+            context['cursor_pagination'] = True
+            context['approx_total'] = cache.get_or_set(
+                f'approx-total-{self.request.path}?{query}', self.object_list.count, self.approx_total_timeout)
+        return context
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, field) for field in self.cursor_fields]
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def cursor_filter(self, token, lookup):
+        """
+        Условие cursor_fields < курсора (по умолчанию (fixed, create, pk)), разложенное в OR по префиксам,
+        чтобы использовать индекс
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(token.encode()))
+            if len(values) != len(self.cursor_fields):
+                raise ValueError
+            values = tuple(convert(value) for convert, value in zip(self.cursor_types, values))
+        except (ValueError, TypeError, KeyError):
+            raise Http404('Некорректный курсор страницы')
+        condition = Q()
+        for index, field in enumerate(self.cursor_fields):
+            equal = dict(zip(self.cursor_fields[:index], values[:index]))
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[index]})
+        return condition
+
+
+class AnonymousPageCacheMixin:
+    """
+    Кэш целых страниц для анонимных GET запросов. Ключ - URL со строкой запроса,
+    актуальность - версии групп страниц (page_cache_groups), которые меняют сигналы моделей.
+    Страницы с флеш-сообщениями не кэшируются и не отдаются из кэша.
+    При PAGE_CACHE_HOLE_PUNCHING страница не содержит персональных данных (они подгружаются
+    через JS), поэтому авторизованные пользователи получают ее из того же кэша.
+    """
+    page_cache_timeout = 300
+    page_cache_groups = ('site', 'lists')
+
+    def get_page_cache_groups(self):
+        return self.page_cache_groups
+
+    def dispatch(self, request, *args, **kwargs):
+        personal = not hole_punching() and (
+            request.user.is_authenticated
+            or 'messages' in request.COOKIES or '_messages' in getattr(request, 'session', {})
+        )
+        if request.method != 'GET' or personal:
+            return super().dispatch(request, *args, **kwargs)
+        return cached_page(request, self.get_page_cache_groups(), self.page_cache_timeout,
+                           lambda: super(AnonymousPageCacheMixin, self).dispatch(request, *args, **kwargs))
@@ -0,0 +1,134 @@
+from contextvars import ContextVar
+
+from django.core.cache import cache
+from django.db import models
+
+OBJECT_CACHE_TIMEOUT = 3600
+
+# Объекты, уже загруженные в рамках текущего запроса (заполняется между вызовами ObjectCacheMiddleware)
+_request_memo = ContextVar('object_cache_memo', default=None)
+
+
+class ObjectCacheMiddleware:
+    """
+    Память объектов на время запроса: один запрос не загружает один и тот же объект дважды
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _request_memo.set({})
+        try:
+            return self.get_response(request)
+        finally:
+            _request_memo.reset(token)
+
+
+class CachedManager(models.Manager):
+    """
+    Менеджер с read-through кэшем объектов по pk и slug: Model.cached.get_cached(slug=...).
+    Сначала память запроса, затем общий кэш, при промахе - запрос в БД с заполнением кэша.
+    Кэш сбрасывается сигналами: invalidate() - для одного объекта, bump() - для всех объектов модели
+    (например, при изменении связанных объектов, загруженных через select_related или prefetch_related).
+    """
+
+    def __init__(self, related=(), fields=('slug',), timeout=OBJECT_CACHE_TIMEOUT, prefetch=()):
+        super().__init__()
+        self.related = related
+        self.prefetch = prefetch
+        self.fields = fields
+        self.timeout = timeout
+
+    @classmethod
+    def for_model(cls, model, **options):
+        """
+        Кэш объектов чужой модели (например, taggit.Tag) без add_to_class: менеджер не попадает в состояние
+        модели, и makemigrations не создает миграций в сторонних приложениях
+        """
+        manager = cls(**options)
+        manager.model, manager.name = model, 'cached'
+        return manager
+
+    @property
+    def label(self):
+        return self.model._meta.label_lower
+
+    def _generation(self):
+        return self._memoized(f'object-generation:{self.label}',
+                              lambda: cache.get_or_set(f'object-generation:{self.label}', 1, None))
+
+    def _key(self, field, value):
+        return f'object:{self.label}:{self._generation()}:{field}:{value}'
+
+    @staticmethod
+    def _memoized(key, load):
+        memo = _request_memo.get()
+        if memo is None:
+            return load()
+        if key not in memo:
+            memo[key] = load()
+        return memo[key]
+
+    def get_cached(self, **lookup):
+        """
+        Объект по pk или одному из полей fields, при отсутствии - Model.DoesNotExist
+        """
+        (field, value), = lookup.items()
+        field = 'pk' if field in ('pk', self.model._meta.pk.name) else field
+        if field != 'pk' and field not in self.fields:
+            raise ValueError(f'Поле {field} не кэшируется для {self.label}')
+        return self._memoized(self._key(field, value), lambda: self._load(field, value))
+
+    def _load(self, field, value):
+        if field == 'pk':
+            obj = cache.get(self._key('pk', value))
+        else:
+            pk = cache.get(self._key(field, value))
+            obj = cache.get(self._key('pk', pk)) if pk is not None else None
+            if obj is not None and getattr(obj, field) != value:
+                obj = None  # поле объекта изменилось, старое значение больше не ведет к нему
+        if obj is None:
+            obj = self.get_queryset().select_related(*self.related).prefetch_related(*self.prefetch).get(
+                **{field: value})
+            cache.set_many({
+                self._key('pk', obj.pk): obj,
+                **{self._key(name, getattr(obj, name)): obj.pk for name in self.fields},
+            }, self.timeout)
+        return obj
+
+    def invalidate(self, instance):
+        """
+        Сброс кэша одного объекта (после сохранения или удаления)
+        """
+        self._delete([self._key('pk', instance.pk)] + [self._key(name, getattr(instance, name)) for name in self.fields])
+
+    def invalidate_pks(self, pks):
+        """
+        Сброс кэша объектов по pk после изменений мимо save() и сигналов (queryset.update(), сырой SQL)
+        """
+        keys = []
+        for pk, *values in self.model._base_manager.filter(pk__in=pks).values_list('pk', *self.fields):
+            keys.append(self._key('pk', pk))
+            keys.extend(self._key(name, value) for name, value in zip(self.fields, values))
+        self._delete(keys)
+
+    def _delete(self, keys):
+        cache.delete_many(keys)
+        memo = _request_memo.get()
+        if memo is not None:
+            for key in keys:
+                memo.pop(key, None)
+
+    def bump(self):
+        """
+        Сброс кэша всех объектов модели новой версией ключей
+        """
+        key = f'object-generation:{self.label}'
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, None)
+        memo = _request_memo.get()
+        if memo is not None:
+            memo.pop(key, None)
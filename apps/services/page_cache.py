@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+PAGE_CACHE_STATS = ('hit', 'stale', 'miss')
+PAGE_CACHE_REBUILD_LOCK_TIMEOUT = 30  # секунды, на которые один запрос забирает перестроение страницы
+PAGE_CACHE_STALE_FACTOR = 10  # во сколько раз дольше устаревшая страница хранится для отдачи во время перестроения
+PAGE_CACHE_COLD_WAIT = 2  # секунды, которые запрос ждет страницу, отрисовываемую другим запросом
+PAGE_CACHE_COLD_POLL = 0.05  # интервал проверки кэша во время ожидания
+
+_executor = None
+
+
+def version_key(group):
+    return f'page-version:{group}'
+
+
+def post_group(slug):
+    """
+    Группа страниц, зависящих от конкретной записи (ее детальная страница)
+    """
+    return f'post-{slug}'
+
+
+def bump_page_versions(*groups):
+    """
+    Новая версия групп страниц: закэшированные страницы этих групп становятся устаревшими
+    """
+    for group in groups:
+        try:
+            cache.incr(version_key(group))
+        except ValueError:
+            cache.set(version_key(group), 1, None)
+
+
+def invalidate_post_pages(post_id, slug=None, lists=True):
+    """
+    Сброс страниц, на которых видна запись: ее детальная страница и (lists) списки с ее карточкой
+    """
+    if slug is None:
+        from apps.blog.models import Post
+        slug = Post.objects.filter(pk=post_id).values_list('slug', flat=True).first()
+    groups = (['lists'] if lists else []) + ([post_group(slug)] if slug else [])
+    bump_page_versions(*groups)
+
+
+def record_stat(stat):
+    key = f'page-cache-stats:{stat}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_stats():
+    """
+    Счетчики попаданий, отдачи устаревших страниц и промахов кэша страниц
+    """
+    values = cache.get_many([f'page-cache-stats:{stat}' for stat in PAGE_CACHE_STATS])
+    return {stat: values.get(f'page-cache-stats:{stat}', 0) for stat in PAGE_CACHE_STATS}
+
+
+def reset_stats():
+    cache.delete_many([f'page-cache-stats:{stat}' for stat in PAGE_CACHE_STATS])
+
+
+def _from_entry(entry, state):
+    response = HttpResponse(entry['content'], status=entry['status'], content_type=entry['content_type'])
+    response['X-Page-Cache'] = state
+    return response
+
+
+def _render_and_store(key, versions, timeout, render):
+    """
+    Отрисовка страницы и сохранение в кэш (только 200 без cookies; иначе прежняя копия удаляется)
+    """
+    response = render()
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    if response.status_code == 200 and not response.cookies:
+        cache.set(key, {
+            'versions': versions,
+            'expires': time.time() + timeout,
+            'content': response.content,
+            'status': response.status_code,
+            'content_type': response['Content-Type'],
+        }, timeout * PAGE_CACHE_STALE_FACTOR)
+    else:
+        cache.delete(key)
+    return response
+
+
+def _rebuild_in_background(key, versions, timeout, render):
+    try:
+        _render_and_store(key, versions, timeout, render)
+    except Exception:
+        logger.exception('Не удалось перестроить страницу %s', key)
+    finally:
+        cache.delete(f'{key}:lock')
+        connection.close()  # соединение с БД, открытое потоком
+
+
+def _submit_rebuild(key, versions, timeout, render):
+    """
+    Перестроение устаревшей страницы в фоновом пуле потоков (при PAGE_CACHE_BACKGROUND_REBUILD = False - сразу)
+    """
+    global _executor
+    if not getattr(settings, 'PAGE_CACHE_BACKGROUND_REBUILD', True):
+        _rebuild_in_background(key, versions, timeout, render)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'PAGE_CACHE_REBUILD_WORKERS', 2),
+                                       thread_name_prefix='page-cache')
+    _executor.submit(_rebuild_in_background, key, versions, timeout, render)
+
+
+def _wait_for_entry(key):
+    """
+    Страницы еще нет в кэше, ее отрисовывает другой запрос: ожидание его копии не дольше PAGE_CACHE_COLD_WAIT
+    """
+    deadline = time.monotonic() + PAGE_CACHE_COLD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(PAGE_CACHE_COLD_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def cached_page(request, groups, timeout, render):
+    """
+    Страница из кэша по URL с учетом версий групп, от которых она зависит.
+    Свежая копия отдается сразу. Устаревшая (истек срок или сменилась версия группы) тоже отдается сразу,
+    а перестраивает ее фоновый поток, запущенный запросом, забравшим блокировку, - без лавины перестроений
+    и без ожидания отрисовки посетителем. Страницу, которой в кэше нет, отрисовывает запрос с блокировкой,
+    остальные недолго ждут его копию и только потом отрисовывают сами
+    """
+    key = 'page:' + hashlib.md5(request.get_full_path().encode()).hexdigest()
+    version_keys = [version_key(group) for group in groups]
+    current = cache.get_many(version_keys)
+    versions = tuple(current.get(version_key, 0) for version_key in version_keys)
+
+    entry = cache.get(key)
+    if entry is not None:
+        if entry['versions'] == versions and entry['expires'] > time.time():
+            record_stat('hit')
+            return _from_entry(entry, 'hit')
+        if cache.add(f'{key}:lock', 1, PAGE_CACHE_REBUILD_LOCK_TIMEOUT):
+            _submit_rebuild(key, versions, timeout, render)
+        record_stat('stale')
+        return _from_entry(entry, 'stale')
+
+    locked = cache.add(f'{key}:lock', 1, PAGE_CACHE_REBUILD_LOCK_TIMEOUT)
+    if not locked:
+        entry = _wait_for_entry(key)
+        if entry is not None:
+            record_stat('hit')
+            return _from_entry(entry, 'hit')
+    record_stat('miss')
+    try:
+        response = _render_and_store(key, versions, timeout, render)
+    finally:
+        if locked:
+            cache.delete(f'{key}:lock')
+    response['X-Page-Cache'] = 'miss'
+    return response
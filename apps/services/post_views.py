@@ -0,0 +1,149 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Exp
+from django.template.loader import render_to_string
+
+from apps.blog.models import Post
+from apps.services.flusher import flusher
+from apps.services.utils import get_client_ip, hash_ip
+
+POPULAR_POSTS_KEY = 'popular-posts-html'
+# Роботы и служебные клиенты по User-Agent (пустой User-Agent - тоже не браузер)
+BOT_USER_AGENT = re.compile(
+    r'bot|crawl|spider|slurp|archiver|preview|fetch|monitor|curl|wget|python|httpx|java/|go-http|headless|lighthouse',
+    re.IGNORECASE,
+)
+# Время жизни популярности: вклад просмотра убывает вдвое за полупериод, популярность = Σ n·exp(-возраст / τ)
+POPULARITY_HALF_LIFE = getattr(settings, 'POPULARITY_HALF_LIFE', 24 * 3600)
+POPULARITY_TAU = POPULARITY_HALF_LIFE / math.log(2)
+POPULARITY_WINDOW = POPULARITY_HALF_LIFE * 7  # за семь полупериодов вклад меньше 1% - старше не кандидаты
+
+
+def is_countable(request):
+    """
+    Дешевые проверки до буфера: только GET браузера, не предзагрузка и не робот по User-Agent
+    """
+    if request.method != 'GET':
+        return False
+    headers = request.headers
+    if 'prefetch' in headers.get('Sec-Purpose', headers.get('Purpose', '')):
+        return False
+    user_agent = headers.get('User-Agent', '')
+    return bool(user_agent) and not BOT_USER_AGENT.search(user_agent)
+
+
+class ViewCounter:
+    """
+    Счетчик просмотров записей без записи в БД на каждый просмотр.
+    Просмотры копятся в памяти процесса по slug (повтор одного посетителя в пределах dedup_interval не учитывается)
+    и раз в flush_interval сбрасываются одним UPDATE: приращение Post.views и затухающей по времени
+    популярности. Сбрасывает общий фоновый поток процесса (apps/services/flusher.py), запущенный первым просмотром,
+    и он же сбрасывает буфер при штатном завершении процесса; при падении теряется не больше одного окна.
+    Кэш страниц и объектов сброс не трогает: страница записи читает счетчик из БД при перестроении (current_views),
+    и число просмотров на ней отстает не больше чем на время жизни страницы в кэше
+    """
+
+    def __init__(self, flush_interval=30, dedup_interval=1800):
+        self.flush_interval = flush_interval
+        self.dedup_interval = dedup_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = Counter()  # slug -> просмотров, еще не сброшенных
+        self._seen = {}  # (slug, посетитель) -> time.monotonic() последнего учтенного просмотра
+        self._registered = False
+
+    def hit(self, request, slug):
+        """
+        Просмотр страницы записи: роботы, автор записи и повторы посетителя отсекаются до буфера
+        """
+        if not is_countable(request):
+            return
+        user = request.user
+        if user.is_authenticated:
+            try:
+                if Post.cached.get_cached(slug=slug).author_id == user.id:
+                    return
+            except Post.DoesNotExist:
+                return
+            visitor = user.id
+        else:
+            visitor = hash_ip(get_client_ip(request) or '')
+        now = time.monotonic()
+        with self._lock:
+            key = (slug, visitor)
+            if now - self._seen.get(key, -self.dedup_interval) < self.dedup_interval:
+                return
+            self._seen[key] = now
+            self._pending[slug] += 1
+        if not self._registered:
+            self._registered = True
+            flusher.register(self, self.flush_interval)
+
+    def flush(self):
+        """
+        Запись накопленных просмотров одним UPDATE: views += n, популярность затухает с прошлого пересчета
+        записи и увеличивается на n. Возвращает количество записанных просмотров
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+                cutoff = time.monotonic() - self.dedup_interval
+                self._seen = {key: seen for key, seen in self._seen.items() if seen > cutoff}
+            if pending:
+                now = time.time()
+                hits = Case(*(When(slug=slug, then=Value(count)) for slug, count in pending.items()),
+                            default=Value(0), output_field=IntegerField())
+                Post.objects.filter(slug__in=pending).update(
+                    views=F('views') + hits,
+                    popularity=F('popularity') * Exp((F('popularity_updated') - now) / POPULARITY_TAU) + hits,
+                    popularity_updated=now,
+                )
+            return sum(pending.values())
+        finally:
+            self._flush_lock.release()
+
+
+view_counter = ViewCounter(
+    flush_interval=getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 30),
+    dedup_interval=getattr(settings, 'VIEW_COUNT_DEDUP_INTERVAL', 1800),
+)
+
+
+def current_views(post_id):
+    """
+    Просмотры записи из БД (в кэше объектов счетчик не обновляется при сбросе)
+    """
+    return Post.objects.filter(pk=post_id).values_list('views', flat=True).first() or 0
+
+
+def popular_posts(count=5):
+    """
+    Самые популярные сейчас записи: популярность, приведенная к текущему моменту, среди записей,
+    просмотренных за последние POPULARITY_WINDOW секунд (частичный индекс по popularity_updated)
+    """
+    now = time.time()
+    return list(
+        Post.custom.select_related(None).filter(popularity_updated__gte=now - POPULARITY_WINDOW)
+        .annotate(popularity_now=F('popularity') * Exp((F('popularity_updated') - now) / POPULARITY_TAU))
+        .only('title', 'slug', 'views').order_by('-popularity_now')[:count]
+    )
+
+
+def popular_posts_html():
+    """
+    Готовый блок "Популярное сейчас" для сайдбара из общего кэша (пересчет не чаще раза в POPULAR_POSTS_TIMEOUT)
+    """
+    def render():
+        count = getattr(settings, 'POPULAR_POSTS_COUNT', 5)
+        return render_to_string('blog/posts/popular_posts.html', {'posts': popular_posts(count)})
+
+    return cache.get_or_set(POPULAR_POSTS_KEY, render, getattr(settings, 'POPULAR_POSTS_TIMEOUT', 60))
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+
+from apps.services.flusher import flusher
+
+ONLINE_COUNT_KEY = 'presence-online-count'
+
+
+def last_seen_key(user_id):
+    return f'last-seen-{user_id}'
+
+
+class PresenceTracker:
+    """
+    Учет присутствия пользователей без записи в БД на каждый запрос.
+    Отметки активности копятся в памяти процесса (не чаще раза в heartbeat_interval на пользователя)
+    и раз в flush_interval сбрасываются: в кэш одним set_many и в User.last_login одним UPDATE.
+    Сбрасывает общий фоновый поток процесса (apps/services/flusher.py), запущенный первой отметкой,
+    поэтому последние отметки простаивающего процесса тоже попадают в кэш; при завершении - финальный сброс.
+    """
+
+    def __init__(self, timeout=300, heartbeat_interval=60, flush_interval=30):
+        self.timeout = timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # user_id -> время последней активности, еще не сброшенное
+        self._seen = {}  # user_id -> time.monotonic() последней учтенной отметки
+        self._registered = False
+
+    def heartbeat(self, user_id):
+        """
+        Отметка активности пользователя
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._seen.get(user_id, -self.heartbeat_interval) >= self.heartbeat_interval:
+                self._seen[user_id] = now
+                self._pending[user_id] = timezone.now()
+        if not self._registered:
+            self._registered = True
+            flusher.register(self, self.flush_interval)
+
+    def flush(self):
+        """
+        Запись накопленных отметок в кэш и в last_login одной пачкой
+        """
+        if not self._flush_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                cutoff = time.monotonic() - self.timeout
+                self._seen = {user_id: seen for user_id, seen in self._seen.items() if seen > cutoff}
+            if pending:
+                cache.set_many({last_seen_key(user_id): seen for user_id, seen in pending.items()}, self.timeout)
+                User.objects.filter(pk__in=pending).update(last_login=timezone.now())
+            return len(pending)
+        finally:
+            self._flush_lock.release()
+
+    def pending(self, user_ids):
+        with self._lock:
+            return {user_id: self._pending[user_id] for user_id in user_ids if user_id in self._pending}
+
+
+presence = PresenceTracker(
+    timeout=getattr(settings, 'PRESENCE_TIMEOUT', 300),
+    heartbeat_interval=getattr(settings, 'PRESENCE_HEARTBEAT_INTERVAL', 60),
+    flush_interval=getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 30),
+)
+
+
+def online_status(user_ids):
+    """
+    Статус "онлайн" для набора пользователей одним обращением к кэшу: {user_id: bool}
+    """
+    user_ids = set(user_ids)
+    last_seen = {
+        int(key.rsplit('-', 1)[1]): seen
+        for key, seen in cache.get_many([last_seen_key(user_id) for user_id in user_ids]).items()
+    }
+    last_seen.update(presence.pending(user_ids))
+    cutoff = timezone.now() - timezone.timedelta(seconds=presence.timeout)
+    return {user_id: user_id in last_seen and last_seen[user_id] > cutoff for user_id in user_ids}
+
+
+def online_count():
+    """
+    Количество пользователей онлайн: по last_login, который сбрасывает PresenceTracker,
+    без перебора ключей кэша; результат кэшируется на интервал сброса
+    """
+    def count():
+        cutoff = timezone.now() - timezone.timedelta(seconds=presence.timeout)
+        return User.objects.filter(last_login__gt=cutoff).count()
+
+    return cache.get_or_set(ONLINE_COUNT_KEY, count, presence.flush_interval)
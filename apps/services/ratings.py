@@ -0,0 +1,90 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.blog.models import Post, Rating, RatingVoter
+from apps.services.page_cache import invalidate_post_pages
+from apps.services.utils import hash_ip
+
+RATING_VALUES = (1, -1)
+
+
+def parse_vote(post_id, value):
+    """
+    Проверка данных голоса без обращения к БД.
+    Возвращает (post_id, value) или None, если данные некорректны
+    """
+    try:
+        post_id, value = int(post_id), int(value)
+    except (TypeError, ValueError):
+        return None
+    if post_id <= 0 or value not in RATING_VALUES:
+        return None
+    return post_id, value
+
+
+def invalidate_post_counters(post_id):
+    """
+    Счетчики изменены сырым UPDATE без post_save: сбрасываем кэш объекта записи, из которого строится
+    ее страница, и сами страницы
+    """
+    Post.cached.invalidate_pks([post_id])
+    invalidate_post_pages(post_id)
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def cast_vote(post_id, value, ip_address, user_id=None):
+    """
+    Голос за запись одним конфликтоустойчивым запросом (INSERT ... ON CONFLICT DO UPDATE):
+    новый голос добавляется, противоположный заменяется, повторный такой же - снимается,
+    голос с IP из свернутой истории не принимается (статус locked).
+    Счетчики записи обновляются в той же транзакции, новая сумма возвращается через RETURNING,
+    без повторного чтения записи.
+    Возвращает (статус, сумма рейтинга), для несуществующей записи - Post.DoesNotExist
+    """
+    rating_table, post_table = _quote(Rating._meta.db_table), _quote(Post._meta.db_table)
+    voter_table = _quote(RatingVoter._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Первым идет запись: блокировка на запись берется сразу, без перехода чтение -> запись.
+        # Голос с IP из свернутой истории (RatingVoter) вставляется со значением 0 и сразу снимается
+        cursor.execute(
+            f'INSERT INTO {rating_table} (post_id, ip_address, value, user_id, time_create) '
+            f'VALUES (%s, %s, CASE WHEN EXISTS (SELECT 1 FROM {voter_table} WHERE post_id = %s AND ip_hash = %s) '
+            f'THEN 0 ELSE %s END, %s, %s) '
+            f'ON CONFLICT (post_id, ip_address) DO UPDATE SET '
+            f'value = CASE WHEN {rating_table}.value = excluded.value THEN 0 ELSE excluded.value END, '
+            f'user_id = excluded.user_id '
+            f'RETURNING id, value, time_create = %s',
+            [post_id, ip_address, post_id, hash_ip(ip_address), value, user_id, now, now],
+        )
+        rating_id, stored_value, created = cursor.fetchone()
+
+        if stored_value == 0:
+            cursor.execute(f'DELETE FROM {rating_table} WHERE id = %s', [rating_id])
+        if created and stored_value == 0:
+            # Этот IP уже голосовал до свертки истории - голос не принимается
+            status, old_value, value = 'locked', None, None
+        elif created:
+            status, old_value = 'created', None
+        elif stored_value == 0:
+            # Повторный такой же голос - снимаем его
+            status, old_value, value = 'deleted', value, None
+        else:
+            status, old_value = 'updated', -value
+
+        likes, dislikes = Rating.counter_deltas(old_value, value)
+        cursor.execute(
+            f'UPDATE {post_table} SET rating_likes = rating_likes + %s, rating_dislikes = rating_dislikes + %s, '
+            f'rating_sum = rating_sum + %s WHERE id = %s RETURNING rating_sum',
+            [likes, dislikes, likes - dislikes, post_id],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise Post.DoesNotExist(f'Запись {post_id} не найдена')
+        if status != 'locked':
+            transaction.on_commit(lambda: invalidate_post_counters(post_id))
+    return status, row[0]
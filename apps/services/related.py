@@ -0,0 +1,251 @@
+import heapq
+import logging
+import math
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from taggit.models import TaggedItem
+
+from apps.blog.models import Post, RelatedPost, TagCount
+from apps.services.categories import category_tree
+from apps.services.page_cache import bump_page_versions, post_group
+
+logger = logging.getLogger(__name__)
+
+RELATED_POSTS_COUNT = getattr(settings, 'RELATED_POSTS_COUNT', 5)
+# Теги, которые есть у большего числа записей, не различают записи (и дают квадратичный перебор пар)
+RELATED_MAX_TAG_POSTS = getattr(settings, 'RELATED_MAX_TAG_POSTS', 1000)
+# Вклад категории: RELATED_CATEGORY_WEIGHT / (1 + расстояние в дереве) для расстояния до RELATED_MAX_CATEGORY_DISTANCE
+RELATED_CATEGORY_WEIGHT = 1.0
+RELATED_MAX_CATEGORY_DISTANCE = 2
+# Кандидатов только по категории (без общих тегов) - столько самых новых записей каждой близкой категории
+RELATED_CATEGORY_CANDIDATES = RELATED_POSTS_COUNT * 4
+# Пересчет, не получивший блокировку БД (SQLite: database is locked), повторяется с паузой 0.5, 1, 2 с
+RELATED_UPDATE_RETRIES = 3
+
+
+def category_distances(nodes, max_distance=RELATED_MAX_CATEGORY_DISTANCE):
+    """
+    Для каждой категории - близкие категории с расстоянием в дереве (ребра родитель-ребенок), обход в ширину
+    """
+    neighbours = defaultdict(set)
+    for node in nodes:
+        if node.parent_id is not None:
+            neighbours[node.pk].add(node.parent_id)
+            neighbours[node.parent_id].add(node.pk)
+    distances = {}
+    for node in nodes:
+        found, frontier = {node.pk: 0}, [node.pk]
+        for distance in range(1, max_distance + 1):
+            frontier = [other for current in frontier for other in neighbours[current] if other not in found]
+            found.update((other, distance) for other in frontier)
+        distances[node.pk] = found
+    return distances
+
+
+class RelatedScorer:
+    """
+    Сходство записей: сумма IDF общих тегов (произведение разреженных матриц "запись x тег" A·W·Aᵀ
+    по спискам записей каждого тега) плюс близость категорий. Одинаково считает полную перестройку
+    (все записи) и обновление одной записи (записи ее тегов и близких категорий)
+    """
+
+    def __init__(self, posts, tagged, total, distances):
+        """
+        posts - {pk: (category_id, create)} опубликованных записей-кандидатов, tagged - пары (pk записи, pk тега)
+        с полными списками записей каждого тега, total - всего опубликованных записей
+        """
+        self.posts = posts
+        self.distances = distances
+        self.tags_of, self.postings = defaultdict(list), defaultdict(list)
+        for post_id, tag_id in tagged:
+            if post_id in posts:
+                self.tags_of[post_id].append(tag_id)
+                self.postings[tag_id].append(post_id)
+        self.idf = {tag_id: math.log(1 + total / len(post_ids)) for tag_id, post_ids in self.postings.items()
+                    if len(post_ids) <= RELATED_MAX_TAG_POSTS}
+        by_category = defaultdict(list)
+        for pk, (category_id, create) in posts.items():
+            by_category[category_id].append((create, pk))
+        self.recent = {category_id: [pk for _create, pk in heapq.nlargest(RELATED_CATEGORY_CANDIDATES, items)]
+                       for category_id, items in by_category.items()}
+
+    def top(self, pk, count=RELATED_POSTS_COUNT):
+        """
+        Лучшие count соседей записи: [(pk, сходство)], при равенстве - более новые
+        """
+        scores = defaultdict(float)
+        for tag_id in self.tags_of.get(pk, ()):
+            weight = self.idf.get(tag_id)
+            if weight:
+                for other in self.postings[tag_id]:
+                    scores[other] += weight
+        category_id = self.posts[pk][0]
+        near = self.distances.get(category_id, {category_id: 0})
+        candidates = set(scores).union(*(self.recent.get(other_category, ()) for other_category in near))
+        candidates.discard(pk)
+        for other in candidates:
+            distance = near.get(self.posts[other][0])
+            if distance is not None:
+                scores[other] += RELATED_CATEGORY_WEIGHT / (1 + distance)
+        scores.pop(pk, None)
+        best = heapq.nlargest(count, scores.items(), key=lambda item: (item[1], self.posts[item[0]][1]))
+        return [(other, round(score, 6)) for other, score in best if score > 0]
+
+
+def related_posts(post, count=RELATED_POSTS_COUNT):
+    """
+    Похожие записи для страницы записи: один запрос по индексу (post, -score) с присоединением записей
+    """
+    return [link.related for link in RelatedPost.objects.filter(post_id=post.pk, related__status='published')
+            .select_related('related').only('related__title', 'related__slug', 'related__create')
+            .order_by('-score')[:count]]
+
+
+def post_content_type():
+    return ContentType.objects.get_for_model(Post)
+
+
+def save_related(related):
+    """
+    Замена списков похожих записей {pk: [(pk, сходство)]}; возвращает pk записей, у которых список изменился
+    """
+    current = defaultdict(list)
+    for post_id, related_id, score in RelatedPost.objects.filter(post_id__in=related).order_by('post_id', '-score') \
+            .values_list('post_id', 'related_id', 'score'):
+        current[post_id].append((related_id, score))
+    changed = [pk for pk, items in related.items() if current.get(pk, []) != items]
+    if changed:
+        with transaction.atomic():
+            RelatedPost.objects.filter(post_id__in=changed).delete()
+            RelatedPost.objects.bulk_create([RelatedPost(post_id=pk, related_id=other, score=score)
+                                             for pk in changed for other, score in related[pk]])
+    return changed
+
+
+def scorer_for(post_ids):
+    """
+    Данные для пересчета нескольких записей: записи их тегов (теги из TagCount не чаще RELATED_MAX_TAG_POSTS)
+    и самые новые записи близких категорий
+    """
+    content_type = post_content_type()
+    published = Post.custom.order_by().values('pk')
+    distances = category_distances(category_tree.get().nodes)
+    own = list(Post.custom.select_related(None).filter(pk__in=post_ids).values_list('pk', 'category_id', 'create'))
+    categories = {other for _pk, category_id, _create in own
+                  for other in distances.get(category_id, {category_id: 0})}
+
+    tag_ids = set(TaggedItem.objects.filter(content_type=content_type, object_id__in=[pk for pk, *_rest in own])
+                  .values_list('tag_id', flat=True))
+    tag_ids -= set(TagCount.objects.filter(tag_id__in=tag_ids, posts__gt=RELATED_MAX_TAG_POSTS)
+                   .values_list('tag_id', flat=True))
+    tagged = list(TaggedItem.objects.filter(content_type=content_type, tag_id__in=tag_ids, object_id__in=published)
+                  .values_list('object_id', 'tag_id'))
+
+    posts = {pk: (category_id, create) for pk, category_id, create in own}
+    candidates = Post.custom.select_related(None).order_by()
+    # Самые новые записи каждой близкой категории одним запросом (нумерация внутри категории)
+    recent = candidates.filter(category_id__in=categories).annotate(
+        position=Window(RowNumber(), partition_by=F('category_id'), order_by=F('create').desc()),
+    ).filter(position__lte=RELATED_CATEGORY_CANDIDATES)
+    missing = {object_id for object_id, _tag_id in tagged} - posts.keys()
+    for queryset in (recent, candidates.filter(pk__in=missing)):
+        posts.update((pk, (category_id, create))
+                     for pk, category_id, create in queryset.values_list('pk', 'category_id', 'create'))
+    return RelatedScorer(posts, tagged, Post.custom.count(), distances)
+
+
+def update_related(post_ids):
+    """
+    Пересчет похожих записей для измененных записей и затронутых соседей: записей, у которых измененная
+    запись уже в списке, и ее новых соседей (сходство симметрично, она может войти в их списки).
+    Неопубликованные записи теряют свои списки, а из чужих списков их убирает пересчет соседей.
+    Списки записей, куда измененная запись могла бы войти, не будучи их соседом сама, уточняет полная перестройка
+    """
+    post_ids = set(post_ids)
+    affected = set(RelatedPost.objects.filter(related_id__in=post_ids).values_list('post_id', flat=True))
+    scorer = scorer_for(post_ids)
+    related = {pk: scorer.top(pk) for pk in post_ids if pk in scorer.posts}
+    RelatedPost.objects.filter(post_id__in=post_ids - related.keys()).delete()
+    affected |= {other for items in related.values() for other, _score in items}
+    affected -= post_ids
+    if affected:
+        scorer = scorer_for(affected)
+        related.update({pk: scorer.top(pk) for pk in affected if pk in scorer.posts})
+    changed = save_related(related)
+    slugs = Post.objects.filter(pk__in=changed).values_list('slug', flat=True)
+    bump_page_versions(*(post_group(slug) for slug in slugs))
+    return changed
+
+
+_executor = None
+_failed_ids = set()  # записи неудавшихся пересчетов, добавляются к следующему (только поток пересчета)
+
+
+def _update_in_background(post_ids):
+    """
+    Пересчет в фоновом потоке вместе с записями прошлых неудач. Занятая другим соединением БД - повтор с паузой,
+    после последней попытки или другой ошибки записи ждут следующего пересчета
+    """
+    post_ids = _failed_ids | set(post_ids)
+    _failed_ids.clear()
+    try:
+        for attempt in range(RELATED_UPDATE_RETRIES + 1):
+            try:
+                update_related(post_ids)
+                return
+            except OperationalError as error:
+                connection.close()
+                if attempt == RELATED_UPDATE_RETRIES:
+                    raise
+                logger.warning('БД занята при пересчете похожих записей (%s), повтор', error)
+                time.sleep(0.5 * 2 ** attempt)
+    except Exception:
+        logger.exception('Не удалось пересчитать похожие записи для %s, повтор со следующим пересчетом', post_ids)
+        _failed_ids.update(post_ids)
+    finally:
+        connection.close()  # соединение с БД, открытое потоком
+
+
+def submit_related_update(post_ids):
+    """
+    Пересчет в фоновом потоке процесса (один поток - пересчеты идут по очереди), запрос его не ждет.
+    При RELATED_POSTS_BACKGROUND = False - сразу (тесты: фоновое соединение не видит тестовой транзакции).
+    Недостающее при остановке процесса исправит rebuild_related_posts
+    """
+    global _executor
+    if not getattr(settings, 'RELATED_POSTS_BACKGROUND', True):
+        update_related(post_ids)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='related-posts')
+    _executor.submit(_update_in_background, list(post_ids))
+
+
+def schedule_related_ids(post_ids):
+    """
+    Пересчет записей после фиксации транзакции
+    """
+    transaction.on_commit(lambda: submit_related_update(post_ids))
+
+
+def schedule_related_update(post):
+    """
+    Пересчет записи после фиксации транзакции; несколько сигналов одной записи (сохранение и изменение тегов
+    формой) дают один пересчет
+    """
+    if getattr(post, '_related_update_scheduled', False):
+        return
+    post._related_update_scheduled = True
+
+    def run():
+        post._related_update_scheduled = False
+        submit_related_update([post.pk])
+
+    transaction.on_commit(run)
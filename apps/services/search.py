@@ -0,0 +1,122 @@
+import re
+
+from django.db import connections, models
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from apps.services.html import plain_text
+
+SEARCH_TABLE = 'blog_post_search'
+SEARCH_MAX_TERMS = 10  # слов запроса, остальные отбрасываются
+SEARCH_SNIPPET_TOKENS = 24  # слов в фрагменте текста с подсветкой
+# Вес совпадения в названии относительно текста при ранжировании bm25
+SEARCH_RANK = 'bm25(10.0, 1.0)'
+# Метки совпадений в highlight()/snippet(): символы, которых нет в тексте записей,
+# заменяются на <mark> уже после экранирования
+MARK_OPEN, MARK_CLOSE = '\x02', '\x03'
+
+
+class FullTextMatch(models.Lookup):
+    """
+    Условие "таблица MATCH запрос" по скрытой колонке FTS5 с именем таблицы
+    """
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class SearchDocumentField(models.TextField):
+    """
+    Скрытая колонка FTS5 (совпадает с именем таблицы) - только для фильтра __match
+    """
+
+
+SearchDocumentField.register_lookup(FullTextMatch)
+
+
+class Highlight(models.Func):
+    """
+    Название записи с метками совпадений
+    """
+    template = f"highlight({SEARCH_TABLE}, 0, char(2), char(3))"
+    output_field = models.TextField()
+
+
+class Snippet(models.Func):
+    """
+    Фрагмент текста записи вокруг совпадений с метками
+    """
+    template = f"snippet({SEARCH_TABLE}, 1, char(2), char(3), '…', {SEARCH_SNIPPET_TOKENS})"
+    output_field = models.TextField()
+
+
+def ensure_search_index(using='default'):
+    """
+    Создание виртуальной таблицы FTS5, если ее нет (таблица не описывается моделями,
+    создается после migrate сигналом post_migrate и командой rebuild_search_index)
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE])
+        if cursor.fetchone() is None:
+            cursor.execute(f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+                           f"title, body, tokenize = 'unicode61 remove_diacritics 2')")
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('rank', %s)", [SEARCH_RANK])
+
+
+def drop_search_index(using='default'):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+def search_document(post):
+    """
+    Текст записи для индекса: название и описание с полным текстом без разметки CKEditor
+    """
+    document = (post.title, f'{plain_text(post.description)}\n{plain_text(post.text)}')
+    return tuple(text.replace(MARK_OPEN, ' ').replace(MARK_CLOSE, ' ') for text in document)
+
+
+def index_posts(posts, using='default'):
+    """
+    Замена записей в индексе; неопубликованные записи из индекса удаляются
+    """
+    posts = list(posts)
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(post.pk,) for post in posts])
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE}(rowid, title, body) VALUES (%s, %s, %s)',
+            [(post.pk, *search_document(post)) for post in posts if post.status == 'published'],
+        )
+
+
+def remove_post(post_id, using='default'):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [post_id])
+
+
+def optimize_search_index(using='default'):
+    """
+    Слияние сегментов индекса FTS5 после массовой загрузки
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+
+
+def parse_query(query):
+    """
+    Запрос пользователя -> выражение FTS5: каждое слово в кавычках с поиском по префиксу
+    (находит словоформы: "питон" -> питона, питоне), все слова обязательны.
+    Операторы и спецсимволы синтаксиса FTS5 из ввода не передаются. Пустая строка - искать нечего
+    """
+    terms = re.findall(r'\w+', (query or '').lower())[:SEARCH_MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def highlight_html(text):
+    """
+    Экранированный текст с совпадениями в <mark>
+    """
+    return mark_safe(escape(text or '').replace(MARK_OPEN, '<mark>').replace(MARK_CLOSE, '</mark>'))
@@ -0,0 +1,186 @@
+import heapq
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.template.loader import render_to_string
+from taggit.models import Tag
+
+from apps.blog.models import TagCount
+from apps.services.object_cache import CachedManager
+from apps.services.page_cache import bump_page_versions
+
+TAG_INDEX_VERSION_KEY = 'tag-index-version'
+TAG_INDEX_CHECK_INTERVAL = 1  # как часто (сек) процесс сверяет свою копию с общей версией
+TAG_INDEX_CHANGES_TIMEOUT = 3600  # сколько хранится список изменившихся тегов каждой версии
+TAG_INDEX_MAX_CATCH_UP = 100  # отстав больше чем на столько версий, процесс перестраивает копию целиком
+TAG_CLOUD_SIZES = (80, 180)  # размер шрифта в облаке тегов, % (от самого редкого к самому частому)
+
+# Кэш тегов по slug/pk для фильтрации записей по тегу (модель taggit, поэтому менеджер не на модели)
+tag_cache = CachedManager.for_model(Tag)
+
+
+def tag_changes_key(version):
+    return f'tag-index-changes:{version}'
+
+
+class TagIndex:
+    """
+    Теги, предвычисленные в памяти процесса: карта slug -> тег с количеством опубликованных записей
+    (из TagCount, без подсчета по записям) и отрисованное облако тегов для сайдбара.
+    Каждое изменение тегов - новая общая версия в кэше со списком изменившихся pk: процесс перечитывает
+    только эти теги и перерисовывает облако, только если изменился его состав или размеры.
+    Целиком копия строится при первом обращении, при пропущенных версиях и после bump_tag_index_version()
+    """
+
+    def __init__(self, cloud_size=30):
+        self.cloud_size = cloud_size
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0
+        self.by_slug = {}
+        self.by_id = {}
+        self.cloud = ()
+        self.cloud_html = ''
+
+    def get(self, force=False):
+        """
+        Актуальная копия (меняется только при смене общей версии; force - сверка без ожидания интервала)
+        """
+        now = time.monotonic()
+        if force or now - self._checked >= TAG_INDEX_CHECK_INTERVAL:
+            version = get_tag_index_version()
+            if version != self._version:
+                with self._lock:
+                    if version != self._version:
+                        self._update(version)
+            self._checked = now
+        return self
+
+    def tag(self, slug):
+        """
+        Тег по slug из карты; тег, созданный после построения копии, берется из кэша объектов.
+        Неизвестный slug - Tag.DoesNotExist
+        """
+        tag = self.by_slug.get(slug)
+        return tag if tag is not None else tag_cache.get_cached(slug=slug)
+
+    def _update(self, version):
+        """
+        Догнать общую версию: применить списки изменившихся тегов или, если каких-то нет, построить заново
+        """
+        behind = version - self._version if self._version is not None else 0
+        if 0 < behind <= TAG_INDEX_MAX_CATCH_UP:
+            keys = [tag_changes_key(number) for number in range(self._version + 1, version + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) == len(keys):
+                self._apply({pk for tag_ids in changes.values() for pk in tag_ids})
+                self._version = version
+                return
+        self._build(version)
+
+    def _build(self, version):
+        by_slug, by_id = {}, {}
+        self._put(Tag.objects.values_list('pk', 'name', 'slug', 'post_count__posts'), by_slug, by_id)
+        self.by_slug, self.by_id = by_slug, by_id
+        self._render_cloud()
+        self._version = version
+
+    def _apply(self, tag_ids):
+        """
+        Перечитать изменившиеся теги (удаленные и переименованные убираются из карты по pk)
+        """
+        for pk in tag_ids:
+            old = self.by_id.pop(pk, None)
+            if old is not None and self.by_slug.get(old.slug) is old:
+                del self.by_slug[old.slug]
+        self._put(Tag.objects.filter(pk__in=tag_ids).values_list('pk', 'name', 'slug', 'post_count__posts'),
+                  self.by_slug, self.by_id)
+        self._render_cloud()
+
+    @staticmethod
+    def _put(rows, by_slug, by_id):
+        for pk, name, slug, posts in rows:
+            tag = Tag(pk=pk, name=name, slug=slug)
+            tag.post_count_value = posts or 0
+            by_slug[slug] = by_id[pk] = tag
+
+    def _render_cloud(self):
+        """
+        Облако перерисовывается, только если изменился состав или размеры тегов в нем
+        """
+        tags = self._cloud(self.by_slug.values())
+        cloud = tuple((tag.slug, tag.name, tag.size) for tag in tags)
+        if cloud != self.cloud:
+            self.cloud_html = render_to_string('blog/tags/tag_cloud.html', {'tags': tags})
+            self.cloud = cloud
+
+    def _cloud(self, tags):
+        """
+        Самые частые теги (только с опубликованными записями) по алфавиту; размер шрифта - по логарифму количества
+        """
+        tags = heapq.nlargest(self.cloud_size, (tag for tag in tags if tag.post_count_value),
+                              key=lambda tag: tag.post_count_value)
+        tags = sorted(tags, key=lambda tag: tag.name.lower())
+        if not tags:
+            return []
+        smallest, largest = TAG_CLOUD_SIZES
+        top = math.log(max(tag.post_count_value for tag in tags) + 1)
+        for tag in tags:
+            tag.size = round(smallest + (largest - smallest) * math.log(tag.post_count_value + 1) / top)
+        return tags
+
+
+tag_index = TagIndex(cloud_size=getattr(settings, 'TAG_CLOUD_SIZE', 30))
+
+
+def get_tag_index_version():
+    return cache.get_or_set(TAG_INDEX_VERSION_KEY, 1, None)
+
+
+def bump_tag_index_version():
+    """
+    Новая версия тегов без списка изменений - все процессы перестроят карту и облако целиком
+    """
+    try:
+        cache.incr(TAG_INDEX_VERSION_KEY)
+    except ValueError:
+        cache.set(TAG_INDEX_VERSION_KEY, 2, None)
+
+
+def record_tag_changes(tag_ids):
+    """
+    Новая версия тегов со списком изменившихся pk (после фиксации транзакции): процессы перечитают только их.
+    Обновляет копию этого процесса и возвращает True, если изменилось облако тегов
+    """
+    cloud_html = tag_index.get(force=True).cloud_html
+    try:
+        version = cache.incr(TAG_INDEX_VERSION_KEY)
+    except ValueError:
+        cache.add(TAG_INDEX_VERSION_KEY, 1, None)
+        version = cache.incr(TAG_INDEX_VERSION_KEY)
+    cache.set(tag_changes_key(version), list(tag_ids), TAG_INDEX_CHANGES_TIMEOUT)
+    return tag_index.get(force=True).cloud_html != cloud_html
+
+
+def change_tag_counts(tag_ids, delta):
+    """
+    Приращение количества опубликованных записей у тегов двумя запросами (создание недостающих строк и UPDATE).
+    После фиксации - новая версия тегов; страницы с облаком тегов в сайдбаре сбрасываются, только если облако изменилось
+    """
+    tag_ids = list(tag_ids)
+    if not tag_ids or not delta:
+        return
+    TagCount.objects.bulk_create([TagCount(tag_id=tag_id) for tag_id in tag_ids], ignore_conflicts=True)
+    TagCount.objects.filter(tag_id__in=tag_ids).update(posts=Greatest(F('posts') + delta, 0))
+
+    def publish():
+        if record_tag_changes(tag_ids):
+            bump_page_versions('site')
+
+    transaction.on_commit(publish)
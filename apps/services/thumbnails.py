@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Производные изображения: ширины (для avatar - квадрат со стороной) и форматы
+THUMBNAIL_VARIANTS = {
+    'post': {'widths': (320, 640, 960), 'square': False},
+    'avatar': {'widths': (100, 200), 'square': True},
+}
+THUMBNAIL_FORMATS = (('webp', 'WEBP', {'quality': 80, 'method': 4}),
+                     ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}))
+MANIFEST_SUFFIX = '.thumbs.json'
+
+
+def derivative_name(name, kind, width, extension):
+    """
+    Имя производного файла рядом с оригиналом: images/a/photo.png -> images/a/photo.post-320.webp
+    """
+    stem = os.path.splitext(name)[0]
+    return f'{stem}.{kind}-{width}.{extension}'
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def generate_derivatives(media_root, name, kind, force=False):
+    """
+    Уменьшенные копии одного изображения в WebP и JPEG. Пропускается, если хэш оригинала совпадает
+    с записанным в манифесте и все копии на месте. Возвращает True, если копии были созданы.
+    Не использует ORM и настройки Django, поэтому подходит для пула процессов
+    """
+    from PIL import Image, ImageOps
+
+    path = os.path.join(media_root, name)
+    manifest_path = path + MANIFEST_SUFFIX
+    digest = file_hash(path)
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest.get('hash') == digest and all(
+                os.path.exists(os.path.join(media_root, derivative_name(name, kind, width, extension)))
+                for width in manifest.get('widths', ()) for extension, _format, _options in THUMBNAIL_FORMATS):
+            return False
+
+    variant = THUMBNAIL_VARIANTS[kind]
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        limit = min(image.size) if variant['square'] else image.width
+        # Изображение не увеличивается: меньше всех ширин - одна копия его собственной ширины
+        targets = [width for width in variant['widths'] if width <= limit] or [limit]
+        widths = []
+        for target in targets:
+            if variant['square']:
+                resized = ImageOps.fit(image, (target, target), Image.LANCZOS)
+            else:
+                resized = image.copy()
+                resized.thumbnail((target, image.height), Image.LANCZOS)
+            width = resized.width  # фактическая ширина копии - в имени файла, манифесте и srcset
+            if width in widths:
+                continue
+            widths.append(width)
+            for extension, image_format, options in THUMBNAIL_FORMATS:
+                output = resized
+                if image_format == 'JPEG' and output.mode == 'RGBA':
+                    output = Image.new('RGB', resized.size, 'white')
+                    output.paste(resized, mask=resized.getchannel('A'))
+                output.save(os.path.join(media_root, derivative_name(name, kind, width, extension)),
+                            image_format, **options)
+
+    with open(manifest_path, 'w') as file:
+        json.dump({'hash': digest, 'kind': kind, 'widths': widths}, file)
+    return True
+
+
+@lru_cache(maxsize=2048)
+def _read_manifest(path, mtime):
+    with open(path) as file:
+        return json.load(file)
+
+
+def get_derivatives(name):
+    """
+    Готовые ширины производных копий по манифесту или None, если копий еще нет.
+    Манифест читается с диска только при изменении (кэш по времени модификации)
+    """
+    path = os.path.join(settings.MEDIA_ROOT, name) + MANIFEST_SUFFIX
+    try:
+        mtime = os.stat(path).st_mtime
+        return _read_manifest(path, mtime)
+    except (OSError, ValueError):
+        return None
+
+
+def responsive_sources(field_file):
+    """
+    srcset копий WebP и JPEG и URL самой большой копии JPEG, или None, если копий еще нет
+    """
+    manifest = field_file and get_derivatives(field_file.name)
+    if not manifest:
+        return None
+    widths = sorted(manifest['widths'])
+    url = field_file.storage.url
+    srcset = {
+        extension: ', '.join(
+            f'{url(derivative_name(field_file.name, manifest["kind"], width, extension))} {width}w' for width in widths)
+        for extension, _format, _options in THUMBNAIL_FORMATS
+    }
+    return srcset, url(derivative_name(field_file.name, manifest['kind'], widths[-1], 'jpg'))
+
+
+def derivative_url(field_file, width):
+    """
+    URL копии JPEG ближайшей ширины не меньше width (или самой большой), иначе URL оригинала
+    """
+    manifest = field_file and get_derivatives(field_file.name)
+    if not manifest:
+        return field_file.url if field_file else ''
+    widths = sorted(manifest['widths'])
+    best = next((candidate for candidate in widths if candidate >= width), widths[-1])
+    return field_file.storage.url(derivative_name(field_file.name, manifest['kind'], best, 'jpg'))
+
+
+_executor = None
+
+
+def schedule_derivatives(field_file, kind, on_ready=None):
+    """
+    Создание копий в фоновом пуле потоков после фиксации транзакции (загрузка не ждет обработки).
+    on_ready вызывается, если копии были созданы (например, для сброса кэша страниц)
+    """
+    global _executor
+    if not field_file or not os.path.exists(field_file.path):
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+                                       thread_name_prefix='thumbnails')
+    media_root, name = str(settings.MEDIA_ROOT), field_file.name
+
+    def done(future):
+        if future.exception():
+            logger.error('Не удалось создать копии %s: %s', name, future.exception())
+        elif future.result() and on_ready:
+            on_ready()
+
+    def submit():
+        _executor.submit(generate_derivatives, media_root, name, kind).add_done_callback(done)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,395 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+CACHE_LOCK_TIMEOUT = 30  # секунды жизни блокировки перестроения значения
+CACHE_LOCK_WAIT = 5  # сколько секунд get_or_set ждет значение, которое строит другой процесс
+CACHE_LOCK_POLL = 0.05
+SQLITE_MAX_PARAMS = 900  # с запасом ниже ограничения SQLite на число параметров запроса
+CLEAR_ALL = '*'  # запись журнала изменений: очищен весь кэш
+
+
+class CacheLock:
+    """
+    Блокировка от лавины перестроений: одно значение строит один процесс.
+    Запись блокировки хранится в общем хранилище со сроком жизни, снимается только владельцем.
+    """
+
+    def __init__(self, cache, key, timeout=CACHE_LOCK_TIMEOUT, version=None):
+        self.cache = cache
+        self.key = f'{key}:lock'
+        self.timeout = timeout
+        self.version = version
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+
+    def acquire(self, blocking=False, wait=CACHE_LOCK_WAIT):
+        deadline = time.monotonic() + wait
+        while True:
+            self.acquired = self.cache.add(self.key, self.token, self.timeout, self.version)
+            if self.acquired or not blocking or time.monotonic() >= deadline:
+                return self.acquired
+            time.sleep(CACHE_LOCK_POLL)
+
+    def release(self):
+        if self.acquired:
+            self.cache.delete_if_equal(self.key, self.token, self.version)
+            self.acquired = False
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class TieredCache(BaseCache):
+    """
+    Двухуровневый кэш: ограниченный LRU в памяти процесса перед общим для всех воркеров хранилищем SQLite.
+    Чтение сначала идет в память, промах - в SQLite с заполнением памяти.
+    Каждая запись в SQLite попадает в журнал изменений, по которому остальные процессы
+    не реже раза в SYNC_INTERVAL секунд выбрасывают устаревшие копии из памяти.
+
+    OPTIONS: MAX_ENTRIES, CULL_FREQUENCY - размер общего хранилища (как у встроенных бэкендов),
+    LOCAL_MAX_ENTRIES - размер LRU в памяти, SYNC_INTERVAL - допустимое отставание памяти от хранилища,
+    CHANGE_LOG_TTL - сколько секунд хранится журнал изменений.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = str(location)
+        self._local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        self._sync_interval = float(options.get('SYNC_INTERVAL', 0.2))
+        self._change_log_ttl = float(options.get('CHANGE_LOG_TTL', 60))
+        self._local = OrderedDict()  # ключ -> (pickle значения, срок годности или None)
+        self._lock = threading.RLock()
+        self._connections = threading.local()
+        self._pid = None
+        self._origin = None
+        self._last_change = None
+        self._synced = 0
+        self._writes = 0
+
+    # Общее хранилище
+
+    def _connection(self):
+        """
+        Соединение с SQLite на поток; после fork процесс начинает с пустой памятью и новыми соединениями
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._connections = threading.local()
+                    self._local.clear()
+                    self._origin = uuid.uuid4().hex
+                    self._last_change = None
+                    self._pid = pid
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self._path, timeout=20, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires);
+                CREATE TABLE IF NOT EXISTS cache_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, origin TEXT NOT NULL, ts REAL NOT NULL
+                );
+            """)
+            self._connections.connection = connection
+        return connection
+
+    def _write(self, statements, changed_keys):
+        """
+        Запись в хранилище и журнал изменений одной транзакцией.
+        statements - список (sql, параметры); возвращает rowcount последнего запроса
+        """
+        connection = self._connection()
+        rowcount = 0
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, params in statements:
+                rowcount = connection.execute(sql, params).rowcount
+            now = time.time()
+            connection.executemany(
+                'INSERT INTO cache_changes (key, origin, ts) VALUES (?, ?, ?)',
+                [(key, self._origin, now) for key in changed_keys],
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._cull()
+        return rowcount
+
+    def _cull(self):
+        """
+        Удаление просроченных записей, самых старых при переполнении и старого журнала изменений
+        """
+        connection = self._connection()
+        now = time.time()
+        connection.execute('DELETE FROM cache_entries WHERE expires <= ?', (now,))
+        connection.execute('DELETE FROM cache_changes WHERE ts < ?', (now - self._change_log_ttl,))
+        count = connection.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        if count > self._max_entries:
+            connection.execute(
+                'DELETE FROM cache_entries WHERE key IN '
+                '(SELECT key FROM cache_entries ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count - self._max_entries + (self._max_entries // self._cull_frequency if self._cull_frequency
+                                              else self._max_entries),),
+            )
+
+    def _fetch(self, keys):
+        """
+        Живые записи хранилища по ключам: {ключ: (pickle значения, срок годности)}
+        """
+        connection = self._connection()
+        now = time.time()
+        found = {}
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + SQLITE_MAX_PARAMS]
+            rows = connection.execute(
+                f'SELECT key, value, expires FROM cache_entries WHERE key IN ({",".join("?" * len(chunk))}) '
+                f'AND (expires IS NULL OR expires > ?)',
+                [*chunk, now],
+            )
+            found.update((key, (value, expires)) for key, value, expires in rows)
+        return found
+
+    # Память процесса
+
+    def _sync(self):
+        """
+        Выброс из памяти ключей, которые с прошлой синхронизации изменили другие процессы
+        """
+        now = time.monotonic()
+        if now - self._synced < self._sync_interval:
+            return
+        connection = self._connection()
+        with self._lock:
+            if self._last_change is None or now - self._synced > self._change_log_ttl:
+                # Первое обращение или журнал мог очиститься, пока процесс простаивал
+                self._local.clear()
+                self._last_change = connection.execute('SELECT COALESCE(MAX(id), 0) FROM cache_changes').fetchone()[0]
+            else:
+                rows = connection.execute(
+                    'SELECT id, key, origin FROM cache_changes WHERE id > ? ORDER BY id', (self._last_change,),
+                ).fetchall()
+                for change_id, key, origin in rows:
+                    if origin == self._origin:
+                        continue
+                    if key == CLEAR_ALL:
+                        self._local.clear()
+                    else:
+                        self._local.pop(key, None)
+                if rows:
+                    self._last_change = rows[-1][0]
+            self._synced = now
+
+    def _remember(self, key, value, expires):
+        with self._lock:
+            self._local[key] = (value, expires)
+            self._local.move_to_end(key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _recall(self, key):
+        """
+        Живая копия из памяти или None
+        """
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            if item[1] is not None and item[1] <= time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return item
+
+    def _forget(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    # API кэша Django
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._sync()
+        item = self._recall(key)
+        if item is None:
+            item = self._fetch([key]).get(key)
+            if item is None:
+                return default
+            self._remember(key, *item)
+        return pickle.loads(item[0])
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        self._sync()
+        result, missing = {}, []
+        for key in key_map:
+            item = self._recall(key)
+            if item is None:
+                missing.append(key)
+            else:
+                result[key_map[key]] = pickle.loads(item[0])
+        if missing:
+            for key, item in self._fetch(missing).items():
+                self._remember(key, *item)
+                result[key_map[key]] = pickle.loads(item[0])
+        return result
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._sync()
+        return self._recall(key) is not None or bool(self._fetch([key]))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = [
+            (self.make_and_validate_key(key, version=version), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires)
+            for key, value in data.items()
+        ]
+        if not rows:
+            return []
+        self._sync()
+        self._write(
+            [('INSERT INTO cache_entries (key, value, expires) VALUES (?, ?, ?) '
+              'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires', row)
+             for row in rows],
+            [key for key, _value, _expires in rows],
+        )
+        for row in rows:
+            self._remember(*row)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        value, expires = pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout)
+        self._sync()
+        added = self._write([(
+            'INSERT INTO cache_entries (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires '
+            'WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?',
+            (key, value, expires, time.time()),
+        )], [key]) == 1
+        if added:
+            self._remember(key, value, expires)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expires = self.get_backend_timeout(timeout)
+        touched = self._write([(
+            'UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (expires, key, time.time()),
+        )], [key]) == 1
+        self._forget(key)
+        return touched
+
+    def incr(self, key, delta=1, version=None):
+        """
+        Атомарное изменение числа в общем хранилище (счетчики версий и статистики)
+        """
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value, expires FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (key, time.time()),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            dumped = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            connection.execute('UPDATE cache_entries SET value = ? WHERE key = ?', (dumped, key))
+            connection.execute(
+                'INSERT INTO cache_changes (key, origin, ts) VALUES (?, ?, ?)', (key, self._origin, time.time()),
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        self._remember(key, dumped, row[1])
+        return value
+
+    def delete(self, key, version=None):
+        return self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        if not keys:
+            return False
+        self._forget(*keys)
+        deleted = 0
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + SQLITE_MAX_PARAMS]
+            deleted += self._write(
+                [(f'DELETE FROM cache_entries WHERE key IN ({",".join("?" * len(chunk))})', chunk)], chunk,
+            )
+        return deleted > 0
+
+    def delete_if_equal(self, key, value, version=None):
+        """
+        Удаление ключа, только если в нем все еще лежит value (снятие своей блокировки)
+        """
+        key = self.make_and_validate_key(key, version=version)
+        self._forget(key)
+        return self._write([(
+            'DELETE FROM cache_entries WHERE key = ? AND value = ?',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+        )], [key]) == 1
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self._write([('DELETE FROM cache_entries', ())], [CLEAR_ALL])
+
+    def lock(self, key, timeout=CACHE_LOCK_TIMEOUT, version=None):
+        """
+        Блокировка перестроения значения: with cache.lock(key) as acquired: ...
+        """
+        return CacheLock(self, key, timeout, version)
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Как в BaseCache, но дорогое значение (callable) строит один процесс,
+        остальные до CACHE_LOCK_WAIT секунд ждут его появления в хранилище
+        """
+        value = self.get(key, self._missing_key, version=version)
+        if value is not self._missing_key:
+            return value
+        if not callable(default):
+            self.add(key, default, timeout, version)
+            return self.get(key, default, version=version)
+
+        with self.lock(key, version=version) as acquired:
+            if not acquired:
+                deadline = time.monotonic() + CACHE_LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(CACHE_LOCK_POLL)
+                    value = self.get(key, self._missing_key, version=version)
+                    if value is not self._missing_key:
+                        return value
+            value = default()
+            self.set(key, value, timeout, version)
+            return value
@@ -1,4 +1,7 @@
+from hashlib import blake2b
 from uuid import uuid4
+
+from django.db.models import Q
 from pytils.translit import slugify
 
 """
@@ -6,12 +9,78 @@ pip install pytils
 Pytils это инструменты для работы с русскими строками 
 (транслитерация, числительные словами, русские даты и т.д.) 
 """
+def _slug_base(model, text, suffix_room=6):
+    """
+    Основа SLUG из текста с запасом длины под числовой суффикс
+    """
+    max_length = model._meta.get_field('slug').max_length
+    return (slugify(text) or uuid4().hex[:8])[:max_length - suffix_room].strip('-')
+
+
+def _prefix(base):
+    """
+    Условие "SLUG начинается с base" диапазоном, чтобы запрос шел по уникальному индексу
+    (LIKE в SQLite регистронезависимый и индекс не использует)
+    """
+    return Q(slug__gte=base, slug__lt=base + '\uffff')
+
+
+def _free_slug(base, taken):
+    """
+    Первый свободный вариант: base, base-2, base-3...
+    """
+    if base not in taken:
+        return base
+    number = 2
+    while f'{base}-{number}' in taken:
+        number += 1
+    return f'{base}-{number}'
+
+
 def unique_slugify(instance, slug):
     """
     Генератор уникальных SLUG для моделей, в случае существования такого SLUG.
+    Все занятые варианты с этой основой выбираются одним запросом по префиксу,
+    сам объект при пересохранении свой SLUG не занимает.
     """
     model = instance.__class__
-    unique_slug = slugify(slug)
-    while model.objects.filter(slug=unique_slug).exists():
-        unique_slug = f'{unique_slug}-{uuid4().hex[:8]}'
-    return unique_slug
+    base = _slug_base(model, slug)
+    queryset = model.objects.filter(_prefix(base)).order_by()
+    if instance.pk is not None:
+        queryset = queryset.exclude(pk=instance.pk)
+    taken = set(queryset.values_list('slug', flat=True))
+    return _free_slug(base, taken)
+
+
+def reserve_slugs(model, texts):
+    """
+    Уникальные SLUG для пачки новых объектов (импорт, bulk_create): занятые варианты всех основ
+    выбираются одним запросом, SLUG внутри пачки тоже не повторяются. Возвращает список в порядке texts
+    """
+    bases = [_slug_base(model, text) for text in texts]
+    prefixes = Q()
+    for base in set(bases):
+        prefixes |= _prefix(base)
+    taken = set(model.objects.filter(prefixes).order_by().values_list('slug', flat=True)) if bases else set()
+    slugs = []
+    for base in bases:
+        slug = _free_slug(base, taken)
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def get_client_ip(request):
+    """
+    IP адрес клиента с учетом прокси (X-Forwarded-For)
+    """
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    return x_forwarded_for.split(',')[0].strip() if x_forwarded_for else request.META.get('REMOTE_ADDR')
+
+
+def hash_ip(ip_address):
+    """
+    Компактный 64-битный хэш IP адреса (знаковое целое для BigIntegerField)
+    """
+    digest = blake2b(ip_address.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
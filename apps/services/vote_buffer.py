@@ -0,0 +1,206 @@
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from apps.blog.models import Post, Rating, RatingVoter
+from apps.services.flusher import flusher
+from apps.services.page_cache import invalidate_post_pages
+from apps.services.utils import hash_ip
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """
+    Буфер голосов рейтинга с отложенной записью (write-behind).
+    Голоса копятся в памяти процесса по ключу (post_id, ip), побеждает последний голос.
+    Общий фоновый поток процесса (apps/services/flusher.py) раз в flush_interval секунд применяет их к Rating
+    пачками (bulk insert/update/delete) и обновляет счетчики записей, а при штатном завершении процесса
+    сбрасывает буфер последний раз. При падении процесса теряется не больше одного окна между сбросами.
+    Изменения счетчиков считаются при сбросе по текущим строкам Rating, а не по значению, прочитанному
+    в буфер, поэтому несколько процессов с буферами не сбивают счетчики голосами с одного IP.
+    """
+
+    def __init__(self, flush_interval=5, batch_size=500):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()  # защита словарей буфера
+        self._flush_lock = threading.Lock()  # сброс и чтение из БД новых ключей не пересекаются
+        self._pending = {}  # (post_id, ip) -> {'rating_id', 'base', 'value', 'user_id', 'locked'}
+        self._scores = {}  # post_id -> сумма рейтинга в БД
+        self._deltas = defaultdict(int)  # post_id -> изменение суммы, еще не записанное в БД
+
+    def vote(self, post_id, value, ip_address, user_id=None):
+        """
+        Голос за запись с той же логикой, что и cast_vote(), но без записи в БД.
+        Возвращает (статус, актуальная сумма рейтинга с учетом буфера)
+        """
+        key = (post_id, ip_address)
+        with self._lock:
+            if key in self._pending:
+                return self._apply_vote(key, value, user_id)
+        with self._flush_lock:
+            self._load(key)
+            with self._lock:
+                return self._apply_vote(key, value, user_id)
+
+    def _apply_vote(self, key, value, user_id):
+        """
+        Применение голоса к записи буфера (вызывается под _lock)
+        """
+        post_id = key[0]
+        entry = self._pending[key]
+        if entry['locked']:
+            return 'locked', self._scores[post_id] + self._deltas[post_id]
+        current = entry['value']
+        if current == value:
+            status, new_value = 'deleted', None
+        elif current is None:
+            status, new_value = 'created', value
+        else:
+            status, new_value = 'updated', value
+        entry['value'], entry['user_id'] = new_value, user_id
+        self._deltas[post_id] += (new_value or 0) - (current or 0)
+        return status, self._scores[post_id] + self._deltas[post_id]
+
+    def _load(self, key):
+        """
+        Чтение из БД текущего голоса по ключу и суммы рейтинга записи (вызывается под _flush_lock)
+        """
+        post_id, ip_address = key
+        with self._lock:
+            if key in self._pending:
+                return
+            need_score = post_id not in self._scores
+
+        if need_score:
+            rating_sum = Post.objects.filter(pk=post_id).values_list('rating_sum', flat=True).first()
+            if rating_sum is None:
+                raise Post.DoesNotExist(f'Запись {post_id} не найдена')
+        rating_id, base = Rating.objects.filter(post_id=post_id, ip_address=ip_address).values_list(
+            'pk', 'value').first() or (None, None)
+        locked = base is None and RatingVoter.objects.filter(post_id=post_id, ip_hash=hash_ip(ip_address)).exists()
+
+        with self._lock:
+            if need_score:
+                self._scores.setdefault(post_id, rating_sum)
+            self._pending[key] = {
+                'rating_id': rating_id, 'base': base, 'value': base, 'user_id': None, 'locked': locked,
+            }
+
+    def flush(self):
+        """
+        Применение накопленных голосов к БД пачками по batch_size.
+        Пачка с нарушением целостности (например, голос за удаленную запись) пишется по одному голосу,
+        такие голоса отбрасываются; при остальных ошибках (БД недоступна) незаписанные голоса возвращаются в буфер
+        """
+        with self._flush_lock:
+            with self._lock:
+                items = list(self._pending.items())
+                self._pending, self._deltas = {}, defaultdict(int)
+            touched = {post_id for (post_id, _ip), _entry in items}
+
+            for start in range(0, len(items), self.batch_size):
+                chunk = items[start:start + self.batch_size]
+                try:
+                    self._apply(chunk)
+                except IntegrityError:
+                    self._apply_one_by_one(items, start, len(chunk))
+                except Exception:
+                    logger.exception('Не удалось записать голоса рейтинга, возвращаем их в буфер')
+                    self._restore(items[start:])
+                    raise
+
+            scores = dict(Post.objects.filter(pk__in=touched).values_list('pk', 'rating_sum'))
+            for post_id in touched:
+                invalidate_post_pages(post_id)
+            with self._lock:
+                self._scores = scores
+            return len(items)
+
+    def _apply_one_by_one(self, items, start, count):
+        """
+        Запись пачки по одному голосу: голоса с нарушением целостности отбрасываются, остальные пишутся
+        """
+        for position in range(start, start + count):
+            key = items[position][0]
+            try:
+                self._apply([items[position]])
+            except IntegrityError:
+                logger.warning('Голос %s не записан (нарушение целостности), отбрасываем', key)
+            except Exception:
+                logger.exception('Не удалось записать голоса рейтинга, возвращаем их в буфер')
+                self._restore(items[position:])
+                raise
+
+    def _apply(self, chunk):
+        """
+        Запись одной пачки голосов и изменений счетчиков в одной транзакции.
+        Строки записей блокируются первыми (сбросы разных процессов по одной записи идут по очереди),
+        затем читаются текущие голоса: изменения счетчиков - от них, а не от base, прочитанного в буфер
+        """
+        post_ids = {post_id for (post_id, _ip), _entry in chunk}
+        with transaction.atomic():
+            list(Post.objects.select_for_update().filter(pk__in=post_ids).values_list('pk', flat=True))
+            current = {
+                (post_id, ip_address): (pk, value)
+                for pk, post_id, ip_address, value in Rating.objects.filter(
+                    post_id__in=post_ids, ip_address__in={ip for (_post_id, ip), _entry in chunk},
+                ).values_list('pk', 'post_id', 'ip_address', 'value')
+            }
+            creates, updates, deletes = [], [], []
+            counters = defaultdict(lambda: [0, 0])
+            for key, entry in chunk:
+                post_id, ip_address = key
+                rating_id, base = current.get(key, (None, None))
+                value = entry['value']
+                if base is None and value is not None:
+                    creates.append(Rating(post_id=post_id, ip_address=ip_address, value=value,
+                                          user_id=entry['user_id']))
+                elif base is not None and value is None:
+                    deletes.append(rating_id)
+                elif base is not None and value != base:
+                    updates.append(Rating(pk=rating_id, value=value, user_id=entry['user_id']))
+                likes, dislikes = Rating.counter_deltas(base, value)
+                counters[post_id][0] += likes
+                counters[post_id][1] += dislikes
+
+            Rating.objects.bulk_create(creates)
+            Rating.objects.bulk_update(updates, ['value', 'user'])
+            with Rating.keeping_counters():  # счетчики уже посчитаны в counters, страницы сбрасывает flush
+                Rating.objects.filter(pk__in=deletes).delete()
+            for post_id, (likes, dislikes) in counters.items():
+                Post.update_rating(post_id, likes, dislikes)
+
+    def _restore(self, items):
+        """
+        Возврат незаписанных голосов в буфер (новые ключи не появляются, пока идет сброс)
+        """
+        with self._lock:
+            for key, entry in items:
+                self._pending[key] = entry
+                self._deltas[key[0]] += (entry['value'] or 0) - (entry['base'] or 0)
+
+
+_vote_buffer = None
+_vote_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """
+    Общий для процесса буфер голосов, настраивается через RATING_BUFFER_* в settings
+    """
+    global _vote_buffer
+    if _vote_buffer is None:
+        with _vote_buffer_lock:
+            if _vote_buffer is None:
+                buffer = VoteBuffer(
+                    flush_interval=getattr(settings, 'RATING_BUFFER_FLUSH_INTERVAL', 5),
+                    batch_size=getattr(settings, 'RATING_BUFFER_BATCH_SIZE', 500),
+                )
+                flusher.register(buffer, buffer.flush_interval)
+                _vote_buffer = buffer
+    return _vote_buffer
@@ -69,6 +69,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     'debug_toolbar.middleware.DebugToolbarMiddleware',  # Middleware Django Debug Toolbar
     'apps.accounts.middleware.ActiveUserMiddleware',  # Функционал статуса пользователей
+    'apps.services.object_cache.ObjectCacheMiddleware',  # Память объектов на время запроса
 ]
 
 ROOT_URLCONF = "blog_cbv.urls"
@@ -99,6 +100,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Ожидание снятия блокировки записи вместо мгновенной ошибки "database is locked"
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -173,9 +176,67 @@ INTERNAL_IPS = [
 ]
 
 # Файловая система кэширования для Middleware
+# Двухуровневый кэш: LRU в памяти процесса + общее для воркеров хранилище SQLite
+# (benchmark_cache сравнивает его с прежним FileBasedCache)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': (BASE_DIR / 'cache'),
+        'BACKEND': 'apps.services.tiered_cache.TieredCache',
+        'LOCATION': (BASE_DIR / 'cache' / 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'LOCAL_MAX_ENTRIES': 1000,  # записей в памяти каждого процесса
+            'SYNC_INTERVAL': 0.2,  # секунды, на которые память процесса может отстать от общего хранилища
+        },
     }
-}
\ No newline at end of file
+}
+
+# Буферизация голосов рейтинга: голоса копятся в памяти процесса и пишутся в БД пачками
+RATING_BUFFER_ENABLED = False
+RATING_BUFFER_FLUSH_INTERVAL = 5  # секунды между сбросами буфера в БД
+RATING_BUFFER_BATCH_SIZE = 500  # голосов в одной транзакции при сбросе
+RATING_COMPACT_AFTER_DAYS = 365  # compact_ratings сворачивает голоса старше этого возраста
+
+# Комментарии: на странице записи только первая страница корневых комментариев, остальное подгружается через JS
+COMMENTS_LAZY_LOAD = True
+COMMENTS_PAGE_SIZE = 20
+# Хранение дерева комментариев: 'mptt' (lft/rght) или 'path' (материализованный путь, вставка без перенумерации,
+# глубина до Comment.MAX_PATH_DEPTH, API MPTT и перенос комментариев в админке не поддерживаются).
+# Переключение режима - командой convert_comment_tree
+COMMENTS_TREE_STORAGE = 'mptt'
+
+# Постраничная навигация списков записей: 'cursor' (по курсору, без OFFSET и COUNT) или 'offset' (номера страниц)
+POSTS_PAGINATION = 'cursor'
+
+# Общая оболочка страниц для всех пользователей: шапка, сообщения и формы подгружаются через JS (/fragments/),
+# поэтому страницы авторизованных пользователей тоже отдаются из кэша страниц
+PAGE_CACHE_HOLE_PUNCHING = False
+# Устаревшие страницы отдаются сразу, а перестраиваются фоновым пулом потоков; False - сразу в потоке запроса (тесты)
+PAGE_CACHE_BACKGROUND_REBUILD = True
+PAGE_CACHE_REBUILD_WORKERS = 2
+
+# Присутствие пользователей: отметки активности копятся в памяти процесса и сбрасываются пачкой
+PRESENCE_TIMEOUT = 300  # секунды после последней активности, пока пользователь считается онлайн
+PRESENCE_HEARTBEAT_INTERVAL = 60  # не чаще одной отметки на пользователя за интервал
+PRESENCE_FLUSH_INTERVAL = 30  # секунды между сбросами отметок в кэш и last_login
+
+# Уменьшенные копии изображений (WebP/JPEG) создаются фоновым пулом потоков после загрузки
+THUMBNAIL_WORKERS = 2
+
+# Подсказки поиска при вводе: не больше стольких вариантов каждого типа (записи, категории, теги)
+AUTOCOMPLETE_LIMIT = 5
+
+# Облако тегов в сайдбаре: столько самых частых тегов (по количеству опубликованных записей)
+TAG_CLOUD_SIZE = 30
+
+# Похожие записи на странице записи: сколько выводить и теги с каким числом записей не учитывать
+RELATED_POSTS_COUNT = 5
+RELATED_MAX_TAG_POSTS = 1000
+# Пересчет похожих записей в фоновом потоке после сохранения; False - сразу в потоке запроса (тесты)
+RELATED_POSTS_BACKGROUND = True
+
+# Просмотры записей: копятся в памяти процесса и пишутся в БД пачками, популярность затухает со временем
+VIEW_COUNT_FLUSH_INTERVAL = 30  # секунды между сбросами просмотров в БД
+VIEW_COUNT_DEDUP_INTERVAL = 1800  # повторный просмотр посетителя за это время не учитывается
+POPULARITY_HALF_LIFE = 24 * 3600  # секунды, за которые вклад просмотра в популярность убывает вдвое
+POPULAR_POSTS_COUNT = 5  # записей в блоке "Популярное сейчас"
+POPULAR_POSTS_TIMEOUT = 60  # секунды кэширования блока "Популярное сейчас"
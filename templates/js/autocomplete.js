@@ -0,0 +1,66 @@
+// Подсказки поиска при вводе: названия записей, категорий и тегов (/search/autocomplete/?q=)
+const autocompleteInput = document.querySelector('[data-autocomplete]');
+const autocompleteMenu = document.querySelector('[data-autocomplete-menu]');
+const autocompleteLabels = {post: 'Запись', category: 'Категория', tag: 'Тег'};
+let autocompleteTimer = null;
+let autocompleteRequest = null;
+
+if (autocompleteInput && autocompleteMenu) {
+    autocompleteInput.addEventListener('input', () => {
+        clearTimeout(autocompleteTimer);
+        autocompleteTimer = setTimeout(loadSuggestions, 150);
+    });
+    autocompleteInput.addEventListener('keydown', e => {
+        if (e.key === 'Escape') {
+            hideSuggestions();
+        }
+    });
+    document.addEventListener('click', e => {
+        if (!autocompleteMenu.contains(e.target) && e.target !== autocompleteInput) {
+            hideSuggestions();
+        }
+    });
+}
+
+async function loadSuggestions() {
+    const query = autocompleteInput.value.trim();
+    if (query.length < 2) {
+        hideSuggestions();
+        return;
+    }
+    // Ответ на устаревший ввод отменяется
+    if (autocompleteRequest) {
+        autocompleteRequest.abort();
+    }
+    autocompleteRequest = new AbortController();
+    try {
+        const response = await fetch(`${autocompleteInput.dataset.autocomplete}?q=${encodeURIComponent(query)}`,
+            {signal: autocompleteRequest.signal});
+        const data = await response.json();
+        showSuggestions(data.suggestions);
+    }
+    catch (error) {
+        if (error.name !== 'AbortError') {
+            console.log(error)
+        }
+    }
+}
+
+function showSuggestions(suggestions) {
+    autocompleteMenu.replaceChildren(...suggestions.map(suggestion => {
+        const item = document.createElement('a');
+        item.className = 'dropdown-item';
+        item.href = suggestion.url;
+        item.textContent = suggestion.title;
+        const label = document.createElement('small');
+        label.className = 'text-muted ms-2';
+        label.textContent = autocompleteLabels[suggestion.type] || '';
+        item.append(label);
+        return item;
+    }));
+    autocompleteMenu.classList.toggle('show', suggestions.length > 0);
+}
+
+function hideSuggestions() {
+    autocompleteMenu.classList.remove('show');
+}
@@ -14,4 +14,4 @@ const getCookie = (name) => {
   return cookieValue;
 };
 
-const csrftoken = getCookie("csrftoken");
+let csrftoken = getCookie("csrftoken");
@@ -1,27 +1,170 @@
-const commentForm = document.forms.commentForm;
-const commentFormContent = commentForm.content;
-const commentFormParentInput = commentForm.parent;
-const commentFormSubmit = commentForm.commentSubmit;
-const commentPostId = commentForm.getAttribute('data-post-id');
+let commentForm = null;
+const commentsThread = document.querySelector('.nested-comments');
 
-commentForm.addEventListener('submit', createComment);
+bindCommentForm()
+loadMoreButtons()
+markOnlineUsers()
+// Форма комментария может прийти персональным фрагментом уже после загрузки страницы
+document.addEventListener('user-fragments-loaded', bindCommentForm);
 
-replyUser()
+function bindCommentForm() {
+    if (commentForm || !document.forms.commentForm) {
+        return;
+    }
+    commentForm = document.forms.commentForm;
+    commentForm.addEventListener('submit', createComment);
+    replyUser();
+}
+
+function escapeHtml(text) {
+    const element = document.createElement('div');
+    element.textContent = text;
+    return element.innerHTML;
+}
+
+function renderComment(comment) {
+    // Разметка комментария, как в шаблоне blog/comments/comments_thread.html
+    const repliesButton = comment.reply_count
+        ? `<button class="btn btn-sm btn-link btn-replies" data-comment-id="${comment.id}">Ответы (${comment.reply_count})</button>`
+        : '';
+    return `<ul id="comment-thread-${comment.id}">
+                <li class="card border-0">
+                    <div class="row">
+                        <div class="col-md-2">
+                            <img src="${comment.avatar}" style="width: 100px;height: 100px;object-fit: cover;" alt="${escapeHtml(comment.author)}"/>
+                        </div>
+                        <div class="col-md-10">
+                            <div class="card-body">
+                                <h6 class="card-title">
+                                    <a href="${comment.get_absolute_url}">${escapeHtml(comment.author)}</a>
+                                    <span class="badge bg-success d-none" data-online-user="${comment.author_id}">онлайн</span>
+                                </h6>
+                                <p class="card-text">
+                                    ${escapeHtml(comment.content)}
+                                </p>
+                                <a class="btn btn-sm btn-dark btn-reply" href="#commentForm" data-comment-id="${comment.id}" data-comment-username="${escapeHtml(comment.author)}">Ответить</a>
+                                ${repliesButton}
+                                <hr/>
+                                <time>${comment.time_create}</time>
+                            </div>
+                        </div>
+                    </div>
+                </li>
+            </ul>`;
+}
 
 function replyUser() {
-  document.querySelectorAll('.btn-reply').forEach(e => {
+  if (!commentForm) {
+    return;
+  }
+  document.querySelectorAll('.btn-reply:not([data-bound])').forEach(e => {
+    e.dataset.bound = '1';
     e.addEventListener('click', replyComment);
   });
 }
 
+function loadMoreButtons() {
+    document.querySelectorAll('.btn-replies:not([data-bound])').forEach(e => {
+        e.dataset.bound = '1';
+        e.addEventListener('click', loadReplies);
+    });
+    document.querySelectorAll('.btn-more-comments:not([data-bound])').forEach(e => {
+        e.dataset.bound = '1';
+        e.addEventListener('click', loadRootComments);
+    });
+}
+
+async function markOnlineUsers() {
+    // Статусы всех еще не проверенных авторов ветки одним запросом
+    const badges = document.querySelectorAll('[data-online-user]:not([data-checked])');
+    const ids = new Set(Array.from(badges, e => e.dataset.onlineUser));
+    if (!ids.size) {
+        return;
+    }
+    badges.forEach(e => e.dataset.checked = '1');
+    try {
+        const response = await fetch(`/online/?ids=${Array.from(ids).join(',')}`, {
+            headers: {'X-Requested-With': 'XMLHttpRequest'},
+        });
+        const data = await response.json();
+        const online = new Set(data.online.map(String));
+        badges.forEach(e => e.classList.toggle('d-none', !online.has(e.dataset.onlineUser)));
+    }
+    catch (error) {
+        console.log(error)
+    }
+}
+
+async function fetchComments(params) {
+    const postId = commentsThread.dataset.postId;
+    const response = await fetch(`/post/${postId}/comments/?${new URLSearchParams(params)}`, {
+        headers: {'X-Requested-With': 'XMLHttpRequest'},
+    });
+    return response.json();
+}
+
+async function loadReplies(event) {
+    // Ответы на комментарий подгружаются только когда читатель раскрывает ветку
+    const button = event.currentTarget;
+    const params = {parent: button.dataset.commentId};
+    if (button.dataset.cursor) {
+        params.cursor = button.dataset.cursor;
+    }
+    button.disabled = true;
+    try {
+        const data = await fetchComments(params);
+        const thread = document.querySelector(`#comment-thread-${button.dataset.commentId}`);
+        thread.insertAdjacentHTML('beforeend', data.comments.map(renderComment).join(''));
+        if (data.next_cursor) {
+            button.dataset.cursor = data.next_cursor;
+            button.disabled = false;
+        }
+        else {
+            button.remove();
+        }
+        replyUser();
+        loadMoreButtons();
+        markOnlineUsers();
+    }
+    catch (error) {
+        console.log(error)
+        button.disabled = false;
+    }
+}
+
+async function loadRootComments(event) {
+    const button = event.currentTarget;
+    button.disabled = true;
+    try {
+        const data = await fetchComments({cursor: button.dataset.cursor});
+        button.insertAdjacentHTML('beforebegin', data.comments.map(renderComment).join(''));
+        if (data.next_cursor) {
+            button.dataset.cursor = data.next_cursor;
+            button.disabled = false;
+        }
+        else {
+            button.remove();
+        }
+        replyUser();
+        loadMoreButtons();
+        markOnlineUsers();
+    }
+    catch (error) {
+        console.log(error)
+        button.disabled = false;
+    }
+}
+
 function replyComment() {
   const commentUsername = this.getAttribute('data-comment-username');
   const commentMessageId = this.getAttribute('data-comment-id');
-  commentFormContent.value = `${commentUsername}, `;
-  commentFormParentInput.value = commentMessageId;
+  commentForm.content.value = `${commentUsername}, `;
+  commentForm.parent.value = commentMessageId;
 }
 async function createComment(event) {
     event.preventDefault();
+    const commentFormSubmit = commentForm.commentSubmit;
+    const commentPostId = commentForm.getAttribute('data-post-id');
     commentFormSubmit.disabled = true;
     commentFormSubmit.innerText = "Ожидаем ответа сервера";
     try {
@@ -35,38 +178,17 @@ async function createComment(event) {
         });
         const comment = await response.json();
 
-        let commentTemplate = `<ul id="comment-thread-${comment.id}">
-                                <li class="card border-0">
-                                    <div class="row">
-                                        <div class="col-md-2">
-                                            <img src="${comment.avatar}" style="width: 120px;height: 120px;object-fit: cover;" alt="${comment.author}"/>
-                                        </div>
-                                        <div class="col-md-10">
-                                            <div class="card-body">
-                                                <h6 class="card-title">
-                                                    <a href="${comment.get_absolute_url}">${comment.author}</a>
-                                                </h6>
-                                                <p class="card-text">
-                                                    ${comment.content}
-                                                </p>
-                                                <a class="btn btn-sm btn-dark btn-reply" href="#commentForm" data-comment-id="${comment.id}" data-comment-username="${comment.author}">Ответить</a>
-                                                <hr/>
-                                                <time>${comment.time_create}</time>
-                                            </div>
-                                        </div>
-                                    </div>
-                                </li>
-                            </ul>`;
+        let commentTemplate = renderComment(comment);
         if (comment.is_child) {
             document.querySelector(`#comment-thread-${comment.parent_id}`).insertAdjacentHTML("beforeend", commentTemplate);
         }
         else {
-            document.querySelector('.nested-comments').insertAdjacentHTML("beforeend", commentTemplate)
+            commentsThread.insertAdjacentHTML("beforeend", commentTemplate)
         }
         commentForm.reset()
         commentFormSubmit.disabled = false;
         commentFormSubmit.innerText = "Добавить комментарий";
-        commentFormParentInput.value = null;
+        commentForm.parent.value = null;
         replyUser();
     }
     catch (error) {
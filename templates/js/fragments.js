@@ -0,0 +1,34 @@
+// Заполнение персональных фрагментов общей (закэшированной) страницы одним запросом
+const userFragments = document.querySelectorAll('[data-user-fragment]');
+
+if (userFragments.length) {
+    loadUserFragments();
+}
+
+async function loadUserFragments() {
+    const params = new URLSearchParams();
+    params.append('names', Array.from(userFragments, e => e.dataset.userFragment).join(','));
+    userFragments.forEach(e => {
+        Object.entries(e.dataset).forEach(([key, value]) => {
+            // data-param-post_id -> dataset.paramPost_id -> param-post_id
+            if (key.startsWith('param')) {
+                params.append(`param-${key.charAt(5).toLowerCase()}${key.slice(6)}`, value);
+            }
+        });
+    });
+    try {
+        const response = await fetch(`/fragments/?${params}`, {
+            headers: {'X-Requested-With': 'XMLHttpRequest'},
+            credentials: 'same-origin',
+        });
+        const fragments = await response.json();
+        userFragments.forEach(e => {
+            e.innerHTML = fragments[e.dataset.userFragment] || '';
+        });
+        csrftoken = getCookie("csrftoken");
+        document.dispatchEvent(new Event('user-fragments-loaded'));
+    }
+    catch (error) {
+        console.log(error)
+    }
+}